@@ -1,11 +1,22 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
-import cv2
-import numpy as np
 import base64
 import logging
 import os
-from plate_detector import LicensePlateDetector
+import time
+import multiprocessing as mp
+from plate_detector import LicensePlateDetector, InvalidImageError
+from inference_server import InferencePool, QueueFullError
+from stream_processor import StreamManager
+from plate_tracker import PlateTracker
+import metrics
+from metrics import collect_timings, stage
+from detection_result import DetectionResult
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 # Setup logging
 logging.basicConfig(
@@ -17,19 +28,327 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
-# Initialize detector
+def detector_config_from_env():
+    """Đọc cấu hình detector từ environment variables"""
+    backend = os.environ.get('PLATE_LOCALIZER', 'onnx')
+    options = {}
+    if backend == 'onnx':
+        options = {
+            'model_path': os.environ.get('PLATE_ONNX_MODEL', 'license_plate.onnx'),
+            'input_size': int(os.environ.get('PLATE_INPUT_SIZE', 640)),
+            'conf_threshold': float(os.environ.get('PLATE_CONF_THRESHOLD', 0.3)),
+            'nms_threshold': float(os.environ.get('PLATE_NMS_THRESHOLD', 0.3)),
+            'intra_op_threads': int(os.environ.get('PLATE_INTRA_OP_THREADS', 1)),
+            'engine': os.environ.get('PLATE_ONNX_ENGINE', 'auto'),
+        }
+    return {
+        'localizer_backend': backend,
+        'localizer_options': options,
+        'variant_order': os.environ.get('PLATE_VARIANT_ORDER', 'gray,clahe,otsu,adaptive').split(','),
+        'cascade_min_confidence': float(os.environ.get('PLATE_CASCADE_MIN_CONF', 0.8)),
+        'cache_size': int(os.environ.get('PLATE_CACHE_SIZE', 256)),
+        'cache_ttl': float(os.environ.get('PLATE_CACHE_TTL', 5.0)),
+        'image_cache_distance': int(os.environ.get('PLATE_CACHE_DISTANCE', 6)),
+        'plate_confirm_distance': int(os.environ.get('PLATE_CACHE_CONFIRM_DISTANCE', 8)),
+        'constrained_decoding': os.environ.get('PLATE_CONSTRAINED_DECODING', '1') == '1',
+        'debug_capture': debug_capture_from_env(),
+        'fallback_budget': float(os.environ.get('PLATE_FALLBACK_BUDGET', 1.5)),
+        'fallback_full_frame': os.environ.get('PLATE_FALLBACK_FULL_FRAME', '0') == '1',
+        'camera_profiles': os.environ.get('PLATE_CAMERA_PROFILES', 'camera_profiles.json'),
+        'ocr_line_height': int(os.environ.get('PLATE_OCR_LINE_HEIGHT', 64)),
+        'ocr_interpolation': os.environ.get('PLATE_OCR_INTERPOLATION', 'linear'),
+        # Local mode: số (reader, decoder) OCR chạy song song giữa các request thread
+        'ocr_instances': int(os.environ.get('PLATE_OCR_INSTANCES', 1)),
+        # Thread torch/OpenCV/ONNX mỗi lời gọi model; không đặt = mặc định của thư viện
+        # (pool mode dùng AI_THREADS_PER_WORKER)
+        'intra_op_threads': optional_int('PLATE_INTRA_OP_THREADS'),
+        'inter_op_threads': optional_int('PLATE_INTER_OP_THREADS'),
+        # OCR recognizer: torch (fp32), int8, onnx, onnx-int8 - so sánh bằng bench/run_bench.py --ocr-engine
+        'ocr_engine': os.environ.get('PLATE_OCR_ENGINE', 'int8'),
+        'ocr_onnx_path': os.environ.get('PLATE_OCR_ONNX_MODEL', 'ocr_recognizer.onnx'),
+        'ocr_skip_detection': os.environ.get('PLATE_OCR_SKIP_DETECTION', '0') == '1',
+        # Plate registry (biển đang gửi, backend push qua /registry); bật theo camera bằng registry_match
+        'registry': {'max_distance': int(os.environ.get('PLATE_REGISTRY_MAX_DISTANCE', 1))},
+        'registry_match': os.environ.get('PLATE_REGISTRY_MATCH', '0') == '1',
+        'detection_filter': detection_filter_from_env(),
+        'max_candidates': int(os.environ.get('PLATE_MAX_CANDIDATES', 3)),
+    }
+
+def detection_filter_from_env():
+    """Lọc detection trước OCR (xem plate_filter); camera profile ghi đè bằng detection_filter"""
+    position_prior = os.environ.get('PLATE_POSITION_PRIOR')
+    return {
+        'min_score': float(os.environ.get('PLATE_MIN_SCORE', 0.3)),
+        # NMS không phân biệt class, bắt các box trùng mà NMS theo class của localizer bỏ sót
+        'nms_threshold': float(os.environ.get('PLATE_FILTER_NMS', 0.5)),
+        'min_width': int(os.environ.get('PLATE_MIN_WIDTH', 40)),
+        'min_height': int(os.environ.get('PLATE_MIN_HEIGHT', 12)),
+        'top_k': int(os.environ.get('PLATE_TOP_K', 2)),
+        # "x,y" theo tỉ lệ frame, vd. 0.5,0.8 = giữa, gần đáy
+        'position_prior': [float(v) for v in position_prior.split(',')] if position_prior else None,
+        'prior_sigma': float(os.environ.get('PLATE_PRIOR_SIGMA', 0.25)),
+    }
+
+def optional_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+def debug_capture_from_env():
+    """Debug capture tắt mặc định; bật bằng PLATE_DEBUG_SAMPLE_RATE (0-1) và/hoặc PLATE_DEBUG_LOW_CONF"""
+    low_confidence = os.environ.get('PLATE_DEBUG_LOW_CONF')
+    return {
+        'directory': os.environ.get('PLATE_DEBUG_DIR', os.path.join('uploads', 'debug')),
+        'sample_rate': float(os.environ.get('PLATE_DEBUG_SAMPLE_RATE', 0)),
+        'low_confidence': float(low_confidence) if low_confidence else None,
+        'max_megabytes': float(os.environ.get('PLATE_DEBUG_MAX_MB', 100)),
+    }
+
+# Số ảnh tối đa trong một request /detect-batch
+MAX_BATCH_IMAGES = int(os.environ.get('AI_MAX_BATCH_IMAGES', 64))
+# Thời gian tối đa cho một request detection (ms), client ghi đè bằng X-Deadline-Ms / deadline_ms; 0 = không giới hạn
+DEFAULT_DEADLINE_MS = float(os.environ.get('AI_DEADLINE_MS', 2000))
+
+# 'local': một detector trong process Flask; 'pool': inference worker processes
+SERVING_MODE = os.environ.get('AI_SERVING_MODE', 'local')
+
 detector = None
-try:
-    detector = LicensePlateDetector()
-    logger.info("License plate detector initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize detector: {e}")
+inference_pool = None
+
+def init_service():
+    """Khởi tạo detector (local) hoặc inference pool (pool)"""
+    global detector, inference_pool
+    
+    config = detector_config_from_env()
+    if SERVING_MODE == 'pool':
+        inference_pool = InferencePool(
+            detector_config=config,
+            num_workers=int(os.environ.get('AI_WORKERS', 2)),
+            queue_size=int(os.environ.get('AI_QUEUE_SIZE', 32)),
+            max_batch_size=int(os.environ.get('AI_MAX_BATCH', 4)),
+            batch_window_ms=float(os.environ.get('AI_BATCH_WINDOW_MS', 5)),
+            threads_per_worker=int(os.environ.get('AI_THREADS_PER_WORKER', 1)),
+        )
+        inference_pool.start()
+        logger.info("Inference pool initialized successfully")
+    else:
+        # Load model ở background: Flask phục vụ /health, /ready ngay lập tức
+        detector = LicensePlateDetector(**config, load_async=True)
+        logger.info("License plate detector created, loading models in background")
+
+def service_available():
+    return detector is not None or inference_pool is not None
+
+def service_ready():
+    if inference_pool is not None:
+        return inference_pool.is_ready()
+    return detector is not None and detector.is_ready()
+
+def service_readiness():
+    if inference_pool is not None:
+        return inference_pool.get_readiness()
+    if detector is not None:
+        return detector.get_readiness()
+    return {'ready': False, 'starting': False, 'components': {}}
+
+def not_ready_response():
+    """503 + Retry-After khi model chưa load xong; startup đã xong mà vẫn lỗi thì không Retry-After"""
+    readiness = service_readiness()
+    response = jsonify({
+        'success': False,
+        'error': 'Detector is still loading' if readiness['starting'] else 'Detector component failed to load',
+        'readiness': readiness
+    })
+    if readiness['starting']:
+        response.headers['Retry-After'] = '5'
+    return response, 503
+
+def run_detection(image_bytes, name=None, camera_id=None, deadline=None):
+    """Chạy detection trên local detector hoặc inference pool, trả về (result, timings)"""
+    if inference_pool is not None:
+        result, timings = inference_pool.detect(image_bytes, name, camera_id, deadline)
+    else:
+        with collect_timings() as stage_timings:
+            with stage('decode'):
+                image = detector.load_image(image_bytes)
+            if image is None:
+                raise InvalidImageError("Invalid image data")
+            result = detector.detect_license_plate_image(image, name=name, camera_id=camera_id, details=True,
+                                                         deadline=deadline)
+        timings = stage_timings.as_dict()
+    
+    metrics.observe_timings(timings)
+    return result, timings
+
+def run_detection_batch(sources, names, camera_ids=None, deadline=None):
+    """Detection cho nhiều ảnh trong một lần chạy pipeline
+    
+    Trả về list (result, timings) theo thứ tự; ảnh không decode được là InvalidImageError.
+    """
+    if inference_pool is not None:
+        outcomes = inference_pool.detect_many(sources, names, camera_ids, deadline)
+        for outcome in outcomes:
+            if not isinstance(outcome, Exception):
+                metrics.observe_timings(outcome[1])
+        return outcomes
+    
+    camera_ids = camera_ids or [None] * len(sources)
+    with collect_timings() as stage_timings:
+        with stage('decode'):
+            images = [detector.load_image(source) for source in sources]
+        valid = [n for n, image in enumerate(images) if image is not None]
+        results = detector.detect_license_plates_batch([images[n] for n in valid], [names[n] for n in valid],
+                                                       [camera_ids[n] for n in valid], details=True,
+                                                       deadlines=[deadline] * len(valid))
+    timings = stage_timings.as_dict()
+    metrics.observe_timings(timings)
+    
+    outcomes = [InvalidImageError("Invalid image data") for _ in sources]
+    for n, result in zip(valid, results):
+        outcomes[n] = (result, timings)
+    return outcomes
+
+def parse_length_prefixed(body):
+    """Tách body gồm các frame [4 byte big-endian length][ảnh JPEG/PNG] liên tiếp"""
+    frames = []
+    view = memoryview(body)
+    offset = 0
+    while offset < len(body):
+        if offset + 4 > len(body):
+            raise ValueError("Truncated frame header")
+        length = int.from_bytes(view[offset:offset + 4], 'big')
+        offset += 4
+        if offset + length > len(body):
+            raise ValueError("Truncated frame data")
+        frames.append(bytes(view[offset:offset + length]))
+        offset += length
+    return frames
+
+def detect_frame(image):
+    """Detect trên frame đã decode (dùng cho video stream), trả về biển số"""
+    if inference_pool is not None:
+        result, timings = inference_pool.detect(image)
+    else:
+        with collect_timings() as stage_timings:
+            result = detector.detect_license_plate_image(image, details=True)
+        timings = stage_timings.as_dict()
+    
+    metrics.observe_timings(timings)
+    return result.license_plate if result else None
+
+def request_camera_id(data=None):
+    """Camera id (chọn profile ROI/resolution) từ form field, query ?camera_id= hoặc JSON field"""
+    camera_id = request.form.get('camera_id') or request.args.get('camera_id')
+    if not camera_id and data:
+        camera_id = data.get('camera_id')
+    return camera_id or None
+
+def deadline_after(received_at, budget_ms=None, default_ms=DEFAULT_DEADLINE_MS):
+    """time.monotonic() deadline từ budget (ms) của client hoặc default_ms, None = không giới hạn"""
+    budget = default_ms
+    if budget_ms not in (None, ''):
+        try:
+            budget = float(budget_ms)
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid deadline '{budget_ms}', using default "
+                           f"{'none' if default_ms is None else f'{default_ms:.0f} ms'}")
+    if budget is None or budget <= 0:
+        return None
+    return received_at + budget / 1000.0
+
+def request_deadline(received_at, data=None, default_ms=DEFAULT_DEADLINE_MS):
+    """Deadline của request từ header X-Deadline-Ms, form/query field hoặc JSON field 'deadline_ms'"""
+    budget_ms = (request.headers.get('X-Deadline-Ms') or request.form.get('deadline_ms')
+                 or request.args.get('deadline_ms'))
+    if not budget_ms and data:
+        budget_ms = data.get('deadline_ms')
+    return deadline_after(received_at, budget_ms, default_ms)
+
+def wants_timings(data=None):
+    """Client yêu cầu breakdown timing qua ?timings=1 hoặc JSON field 'timings'"""
+    if request.args.get('timings', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return bool(data and data.get('timings'))
+
+def create_tracker():
+    """Tracker cần bbox + OCR từng crop nên chỉ dùng được với local detector"""
+    if detector is None:
+        return None
+    return PlateTracker(
+        detector,
+        min_observations=int(os.environ.get('TRACK_MIN_FRAMES', 3)),
+        agreement_threshold=float(os.environ.get('TRACK_AGREEMENT', 0.75)),
+        max_idle_seconds=float(os.environ.get('TRACK_MAX_IDLE', 3.0)),
+        reverify_frames=int(os.environ.get('TRACK_REVERIFY_FRAMES', 10))
+    )
+
+stream_manager = StreamManager(detect_frame, tracker_factory=create_tracker)
+
+# Spawned worker processes re-import this module; chỉ main process khởi tạo service
+if mp.current_process().name == 'MainProcess':
+    try:
+        init_service()
+    except Exception as e:
+        logger.error(f"Failed to initialize detector: {e}")
+
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+def wants_msgpack(accept):
+    """Client gửi Accept: application/x-msgpack và server có msgpack"""
+    return msgpack is not None and MSGPACK_MIMETYPE in (accept or '')
+
+def encode_response(body, status):
+    """JSON hoặc msgpack (nhỏ hơn, parse nhanh hơn cho backend) theo header Accept"""
+    if wants_msgpack(request.headers.get('Accept')):
+        return Response(msgpack.packb(body), status=status, mimetype=MSGPACK_MIMETYPE)
+    return jsonify(body), status
+
+def detection_response(result, timings, include_timings=False):
+    """Response cho kết quả detection (kèm timing breakdown nếu được yêu cầu)"""
+    return encode_response(*detection_body(result, timings, include_timings))
+
+def detection_body(result, timings, include_timings=False):
+    """(body, status) cho một kết quả detection - dùng chung cho single và batch endpoint"""
+    if not result:
+        logger.warning("Detection failed: No result returned")
+        metrics.REQUESTS.inc('not_found')
+        body = {
+            'success': False,
+            'error': 'Could not detect license plate'
+        }
+        if include_timings:
+            body['timings_ms'] = {k: round(v * 1000, 2) for k, v in timings.items()}
+        return body, 404
+    
+    logger.info(f"Detection successful: {result}")
+    
+    if not isinstance(result, DetectionResult):
+        logger.error(f"Unexpected result type: {type(result)}")
+        metrics.REQUESTS.inc('error')
+        return {
+            'success': False,
+            'error': 'Invalid detection result format'
+        }, 500
+    
+    metrics.REQUESTS.inc('success')
+    # license_plate / confidence / method / tier (+ corrected_from, registry_distance khi khớp plate
+    # registry) của ứng viên chính, và 'candidates': top-N biển kèm bbox, điểm localizer / OCR, variant
+    body = {'success': True}
+    body.update(result.to_dict())
+    if include_timings:
+        body['timings_ms'] = {k: round(v * 1000, 2) for k, v in timings.items()}
+    return body, 200
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     try:
-        status = "healthy" if detector is not None else "unhealthy"
+        readiness = service_readiness()
+        if readiness['ready']:
+            status = "healthy"
+        elif readiness['starting']:
+            status = "starting"
+        else:
+            status = "unhealthy"
         return jsonify({
             'status': status,
             'message': 'AI Service is running'
@@ -41,20 +360,30 @@ def health_check():
             'message': str(e)
         }), 500
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness từng component (localizer, OCR, warm-up) và thời gian startup"""
+    readiness = service_readiness()
+    return jsonify(readiness), 200 if readiness['ready'] else 503
+
 @app.route('/detect-file', methods=['POST'])
 def detect_license_plate_file():
     """Detect license plate from uploaded file"""
+    received_at = time.monotonic()
     try:
         logger.info("Received file detection request")
         
         # Check if detector is available
-        if detector is None:
+        if not service_available():
             logger.error("Detector not initialized")
             return jsonify({
                 'success': False,
                 'error': 'Detector not initialized'
             }), 500
         
+        if not service_ready():
+            return not_ready_response()
+        
         # Check if file is in request
         if 'file' not in request.files:
             logger.error("No file in request")
@@ -71,53 +400,35 @@ def detect_license_plate_file():
                 'error': 'No file selected'
             }), 400
         
-        # Save uploaded file
-        upload_dir = 'uploads'
-        os.makedirs(upload_dir, exist_ok=True)
+        name = f"detect_{os.path.splitext(os.path.basename(file.filename))[0]}"
         
-        filename = f"detect_{file.filename}"
-        filepath = os.path.join(upload_dir, filename)
-        file.save(filepath)
+        # Detect license plate (decode in memory, no disk round trip)
+        result, timings = run_detection(file.read(), name=name, camera_id=request_camera_id(),
+                                        deadline=request_deadline(received_at))
         
-        logger.info(f"File saved: {filepath}")
-        
-        # Detect license plate
-        result = detector.detect_license_plate(filepath)
-        
-        if result:
-            logger.info(f"Detection successful: {result}")
-            
-            # Handle both string and dict results
-            if isinstance(result, str):
-                license_plate = result
-                confidence = 0.8
-                method = 'Roboflow+OCR'
-            elif isinstance(result, dict):
-                license_plate = result.get('license_plate', 'Unknown')
-                confidence = result.get('confidence', 0.0)
-                method = result.get('method', 'N/A')
-            else:
-                logger.error(f"Unexpected result type: {type(result)}")
-                return jsonify({
-                    'success': False,
-                    'error': 'Invalid detection result format'
-                }), 500
-            
-            return jsonify({
-                'success': True,
-                'license_plate': license_plate,
-                'confidence': float(confidence),
-                'method': method
-            }), 200
-        else:
-            logger.warning("Detection failed: No result returned")
-            return jsonify({
-                'success': False,
-                'error': 'Could not detect license plate'
-            }), 404
+        return detection_response(result, timings, wants_timings())
+    
+    except InvalidImageError:
+        logger.error("Failed to decode image")
+        metrics.REQUESTS.inc('invalid')
+        return jsonify({
+            'success': False,
+            'error': 'Invalid image data'
+        }), 400
+    
+    except QueueFullError as e:
+        logger.warning("Inference queue full, rejecting request")
+        metrics.REQUESTS.inc('rejected')
+        response = jsonify({
+            'success': False,
+            'error': 'Service busy, retry later'
+        })
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
     
     except Exception as e:
         logger.error(f"Detection error: {e}")
+        metrics.REQUESTS.inc('error')
         return jsonify({
             'success': False,
             'error': f'Detection failed: {str(e)}'
@@ -126,17 +437,21 @@ def detect_license_plate_file():
 @app.route('/detect-base64', methods=['POST'])
 def detect_license_plate_base64():
     """Detect license plate from base64 image"""
+    received_at = time.monotonic()
     try:
         logger.info("Received base64 detection request")
         
         # Check if detector is available
-        if detector is None:
+        if not service_available():
             logger.error("Detector not initialized")
             return jsonify({
                 'success': False,
                 'error': 'Detector not initialized'
             }), 500
         
+        if not service_ready():
+            return not_ready_response()
+        
         # Get JSON data
         data = request.get_json()
         if not data or 'image' not in data:
@@ -156,17 +471,6 @@ def detect_license_plate_base64():
             # Decode base64
             image_bytes = base64.b64decode(image_data)
             
-            # Convert to numpy array
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            if image is None:
-                logger.error("Failed to decode image")
-                return jsonify({
-                    'success': False,
-                    'error': 'Invalid image data'
-                }), 400
-            
         except Exception as e:
             logger.error(f"Image decoding failed: {e}")
             return jsonify({
@@ -174,75 +478,337 @@ def detect_license_plate_base64():
                 'error': 'Failed to decode image'
             }), 400
         
-        # Save image for processing
-        upload_dir = 'uploads'
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        import time
         timestamp = int(time.time() * 1000000)
-        filename = f"base64-{timestamp}.jpg"
-        filepath = os.path.join(upload_dir, filename)
-        
-        cv2.imwrite(filepath, image)
-        logger.info(f"Base64 image saved: {filepath}")
+        name = f"base64-{timestamp}"
         
         # Detect license plate
-        result = detector.detect_license_plate(filepath)
+        result, timings = run_detection(image_bytes, name=name, camera_id=request_camera_id(data),
+                                        deadline=request_deadline(received_at, data))
         
-        if result:
-            logger.info(f"Base64 detection successful: {result}")
-            
-            # Handle both string and dict results
-            if isinstance(result, str):
-                license_plate = result
-                confidence = 0.8
-                method = 'Roboflow+OCR'
-            elif isinstance(result, dict):
-                license_plate = result.get('license_plate', 'Unknown')
-                confidence = result.get('confidence', 0.0)
-                method = result.get('method', 'N/A')
-            else:
-                logger.error(f"Unexpected result type: {type(result)}")
+        return detection_response(result, timings, wants_timings(data))
+    
+    except InvalidImageError:
+        logger.error("Failed to decode image")
+        metrics.REQUESTS.inc('invalid')
+        return jsonify({
+            'success': False,
+            'error': 'Invalid image data'
+        }), 400
+    
+    except QueueFullError as e:
+        logger.warning("Inference queue full, rejecting request")
+        metrics.REQUESTS.inc('rejected')
+        response = jsonify({
+            'success': False,
+            'error': 'Service busy, retry later'
+        })
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
+    
+    except Exception as e:
+        logger.error(f"Base64 detection error: {e}")
+        metrics.REQUESTS.inc('error')
+        return jsonify({
+            'success': False,
+            'error': f'Detection failed: {str(e)}'
+        }), 500
+
+@app.route('/detect-batch', methods=['POST'])
+def detect_license_plate_batch():
+    """Detect nhiều ảnh trong một request: multipart (field 'files') hoặc length-prefixed raw frames
+    
+    Length-prefixed: Content-Type application/octet-stream, body là các frame
+    [4 byte big-endian length][ảnh] liên tiếp. Kết quả trả về theo đúng thứ tự ảnh.
+    Deadline (X-Deadline-Ms / ?deadline_ms=) áp dụng cho cả batch.
+    """
+    received_at = time.monotonic()
+    try:
+        if not service_available():
+            logger.error("Detector not initialized")
+            return jsonify({
+                'success': False,
+                'error': 'Detector not initialized'
+            }), 500
+        
+        if not service_ready():
+            return not_ready_response()
+        
+        timestamp = int(time.time() * 1000000)
+        if request.mimetype == 'application/octet-stream':
+            try:
+                sources = parse_length_prefixed(request.get_data())
+            except ValueError as e:
                 return jsonify({
                     'success': False,
-                    'error': 'Invalid detection result format'
-                }), 500
-            
-            return jsonify({
-                'success': True,
-                'license_plate': license_plate,
-                'confidence': float(confidence),
-                'method': method
-            }), 200
+                    'error': f'Invalid frame stream: {e}'
+                }), 400
+            names = [f"batch-{timestamp}-{i}" for i in range(len(sources))]
         else:
-            logger.warning("Base64 detection failed: No result returned")
+            files = request.files.getlist('files') or request.files.getlist('file')
+            sources = [file.read() for file in files]
+            names = [f"batch_{os.path.splitext(os.path.basename(file.filename or str(i)))[0]}"
+                     for i, file in enumerate(files)]
+        
+        if not sources:
+            return jsonify({
+                'success': False,
+                'error': 'No images provided'
+            }), 400
+        
+        if len(sources) > MAX_BATCH_IMAGES:
             return jsonify({
                 'success': False,
-                'error': 'Could not detect license plate'
-            }), 404
+                'error': f'Too many images (max {MAX_BATCH_IMAGES})'
+            }), 413
+        
+        logger.info(f"Received batch detection request with {len(sources)} images")
+        include_timings = wants_timings()
+        
+        results = []
+        camera_id = request_camera_id()
+        # DEFAULT_DEADLINE_MS là budget cho một ảnh: batch (tối đa MAX_BATCH_IMAGES ảnh) chỉ có
+        # deadline khi client gửi budget cho cả batch
+        deadline = request_deadline(received_at, default_ms=None)
+        for outcome in run_detection_batch(sources, names, [camera_id] * len(sources), deadline):
+            if isinstance(outcome, InvalidImageError):
+                metrics.REQUESTS.inc('invalid')
+                results.append({'success': False, 'error': 'Invalid image data'})
+            else:
+                body, _ = detection_body(*outcome, include_timings)
+                results.append(body)
+        
+        return encode_response({
+            'success': True,
+            'count': len(results),
+            'results': results
+        }, 200)
+    
+    except QueueFullError as e:
+        logger.warning("Inference queue full, rejecting batch request")
+        metrics.REQUESTS.inc('rejected')
+        response = jsonify({
+            'success': False,
+            'error': 'Service busy, retry later'
+        })
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
     
     except Exception as e:
-        logger.error(f"Base64 detection error: {e}")
+        logger.error(f"Batch detection error: {e}")
+        metrics.REQUESTS.inc('error')
         return jsonify({
             'success': False,
             'error': f'Detection failed: {str(e)}'
         }), 500
 
+@app.route('/streams', methods=['GET'])
+def list_streams():
+    """Danh sách video stream đang chạy"""
+    return jsonify({'streams': stream_manager.list_streams()}), 200
+
+@app.route('/streams', methods=['POST'])
+def start_stream():
+    """Bắt đầu đọc RTSP/MJPEG stream hoặc video file"""
+    try:
+        if not service_available():
+            return jsonify({
+                'success': False,
+                'error': 'Detector not initialized'
+            }), 500
+        
+        if not service_ready():
+            return not_ready_response()
+        
+        data = request.get_json() or {}
+        if not data.get('source'):
+            return jsonify({
+                'success': False,
+                'error': 'No stream source provided'
+            }), 400
+        
+        stream = stream_manager.start_stream(
+            data['source'],
+            stream_id=data.get('stream_id'),
+            lane_id=data.get('lane_id'),
+            max_fps=float(data.get('max_fps', 2.0)),
+            dedup_seconds=float(data.get('dedup_seconds', 10.0)),
+            loop_file=bool(data.get('loop', False)),
+            tracking=bool(data.get('tracking', True))
+        )
+        
+        return jsonify({
+            'success': True,
+            'stream': stream.info(),
+            'events_url': f"/streams/{stream.stream_id}/events"
+        }), 201
+    
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 409
+    
+    except Exception as e:
+        logger.error(f"Stream start error: {e}")
+        return jsonify({
+            'success': False,
+            'error': f'Stream start failed: {str(e)}'
+        }), 500
+
+@app.route('/streams/<stream_id>', methods=['DELETE'])
+def stop_stream(stream_id):
+    """Dừng video stream"""
+    if not stream_manager.stop_stream(stream_id):
+        return jsonify({
+            'success': False,
+            'error': 'Stream not found'
+        }), 404
+    
+    return jsonify({'success': True}), 200
+
+@app.route('/streams/<stream_id>/events', methods=['GET'])
+def stream_events(stream_id):
+    """Server-Sent Events: plate events của stream"""
+    stream = stream_manager.get(stream_id)
+    if stream is None:
+        return jsonify({
+            'success': False,
+            'error': 'Stream not found'
+        }), 404
+    
+    return Response(stream.sse_events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/registry', methods=['GET'])
+def registry_stats():
+    """Số biển trong plate registry và thống kê match / correction"""
+    if inference_pool is not None:
+        return jsonify({'workers': [snapshot.get('registry') for snapshot in worker_stats()]}), 200
+    if detector is None:
+        return jsonify({'error': 'Detector not initialized'}), 500
+    return jsonify(detector.plate_registry.get_stats()), 200
+
+@app.route('/registry', methods=['POST', 'PUT'])
+def update_registry():
+    """Backend push biển đang gửi: POST {"add": [...], "remove": [...]}, PUT {"plates": [...]} thay toàn bộ"""
+    try:
+        if not service_available():
+            return jsonify({
+                'success': False,
+                'error': 'Detector not initialized'
+            }), 500
+        
+        data = request.get_json(silent=True) or {}
+        if request.method == 'PUT':
+            update = {'replace': data.get('plates')}
+            if not isinstance(update['replace'], list):
+                return jsonify({
+                    'success': False,
+                    'error': 'plates must be a list'
+                }), 400
+        else:
+            update = {'add': data.get('add') or [], 'remove': data.get('remove') or []}
+            if not all(isinstance(plates, list) for plates in update.values()):
+                return jsonify({
+                    'success': False,
+                    'error': 'add and remove must be lists'
+                }), 400
+        
+        if inference_pool is not None:
+            inference_pool.update_registry(**update)
+        else:
+            detector.update_registry(**update)
+        
+        return jsonify({'success': True}), 200
+    
+    except Exception as e:
+        logger.error(f"Registry update error: {e}")
+        return jsonify({
+            'success': False,
+            'error': f'Registry update failed: {str(e)}'
+        }), 500
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Thống kê cascade (variant thắng, số OCR pass) và cache hit rate"""
+    if inference_pool is not None:
+        return jsonify({
+            'queue_depth': inference_pool.queue_depth(),
+            'workers': worker_stats()
+        }), 200
+    if detector is None:
+        return jsonify({'error': 'Detector not initialized'}), 500
+    
+    return jsonify({
+        'cascade': detector.get_cascade_stats(),
+        'cache': detector.get_cache_stats(),
+        'debug_capture': detector.debug_capture.get_stats(),
+        'registry': detector.plate_registry.get_stats()
+    }), 200
+
+def worker_stats():
+    """Cascade + cache stats: từ local detector hoặc tổng hợp từ các pool worker"""
+    if inference_pool is not None:
+        return list(inference_pool.worker_stats.values())
+    if detector is not None:
+        return [{'cascade': detector.get_cascade_stats(), 'cache': detector.get_cache_stats()}]
+    return []
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus metrics: latency từng stage, queue depth, cache hit rate, variant win counts"""
+    extra = []
+    stats_list = worker_stats()
+    
+    if inference_pool is not None:
+        extra += metrics.metric_lines('plate_queue_depth', 'Requests waiting in the inference queue',
+                                      inference_pool.queue_depth())
+    
+    wins = {}
+    cache_hits = {}
+    cache_lookups = {}
+    for snapshot in stats_list:
+        for variant, count in snapshot['cascade']['wins'].items():
+            wins[variant] = wins.get(variant, 0) + count
+        for cache_name, cache in snapshot['cache'].items():
+            cache_hits[cache_name] = cache_hits.get(cache_name, 0) + cache['hits']
+            cache_lookups[cache_name] = cache_lookups.get(cache_name, 0) + cache['hits'] + cache['misses']
+    
+    extra += metrics.metric_lines('plate_variant_wins_total', 'Crops resolved by each OCR variant',
+                                  wins, 'variant', 'counter')
+    extra += metrics.metric_lines('plate_cache_hits_total', 'Result cache hits', cache_hits, 'cache', 'counter')
+    extra += metrics.metric_lines('plate_cache_hit_ratio', 'Result cache hit ratio',
+                                  {name: cache_hits[name] / lookups if lookups else 0.0
+                                   for name, lookups in cache_lookups.items()}, 'cache')
+    extra += metrics.metric_lines('plate_active_streams', 'Running video streams',
+                                  len(stream_manager.list_streams()))
+    
+    return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
 @app.route('/test', methods=['GET'])
 def test():
     return jsonify({
         'message': 'AI Service is working',
-        'detector_status': 'ready' if detector else 'not_ready'
+        'detector_status': 'ready' if service_ready() else 'not_ready'
     })
 
 if __name__ == '__main__':
     logger.info("Starting AI License Plate Service...")
     
     # Initialize detector
-    if detector is not None:
-        logger.info("✅ Detector ready")
+    if service_available():
+        logger.info("✅ Detector created (models load in background, see /ready)")
     else:
         logger.error("❌ Detector initialization failed")
     
-    logger.info("🚀 Starting Flask server...")
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    if SERVING_MODE == 'pool':
+        try:
+            from waitress import serve
+            logger.info("🚀 Starting waitress server (pool mode)...")
+            serve(app, host='0.0.0.0', port=5000, threads=int(os.environ.get('AI_HTTP_THREADS', 16)))
+        except ImportError:
+            logger.info("🚀 Starting threaded Flask server (pool mode)...")
+            app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
+    else:
+        logger.info("🚀 Starting Flask server...")
+        app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
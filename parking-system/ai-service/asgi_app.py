@@ -0,0 +1,243 @@
+"""ASGI front end: /detect-file và /detect-base64 chạy trên asyncio, các route khác giữ Flask app
+
+Với Flask (WSGI), mỗi request chiếm một thread suốt thời gian upload, nên camera có
+mạng chập chờn giữ chỗ của inference. Ở đây body được đọc bất đồng bộ trên event loop.
+JSON parse, base64 decode và decode ảnh chạy trong decode executor. Chỉ ndarray đã decode mới
+được đưa sang CPU executor chạy LicensePlateDetector, nên network-bound và CPU-bound
+không dùng chung slot.
+
+Ở pool mode, bytes được submit thẳng vào InferencePool (worker tự decode, IPC nhỏ hơn
+ndarray) và được await, không chiếm thread nào.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+    python asgi_app.py
+
+Env: AI_DECODE_THREADS (mặc định 2), AI_CPU_WORKERS (mặc định = PLATE_OCR_INSTANCES),
+AI_MAX_PENDING (local mode: số request tối đa đang decode/chờ CPU, vượt quá trả 503).
+"""
+import asyncio
+import base64
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+
+import app as service
+import metrics
+from inference_server import QueueFullError
+from metrics import collect_timings, stage
+from plate_detector import InvalidImageError
+
+logger = logging.getLogger(__name__)
+
+TRUE_VALUES = ('1', 'true', 'yes')
+
+decode_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('AI_DECODE_THREADS', 2)),
+                                     thread_name_prefix='decode')
+# Thread chạy model: nhiều hơn số OCR instance chỉ làm thread chờ slot
+cpu_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('AI_CPU_WORKERS', 0)) or int(os.environ.get('PLATE_OCR_INSTANCES', 1)),
+    thread_name_prefix='detect')
+MAX_PENDING = int(os.environ.get('AI_MAX_PENDING', 32))
+pending = 0
+
+
+class BadRequest(Exception):
+    """Request thiếu / sai dữ liệu ảnh - trả 400 với message"""
+
+
+def decode_image(data):
+    """Chạy trong decode executor, trả về (ndarray, timings)"""
+    with collect_timings() as stage_timings:
+        with stage('decode'):
+            image = service.detector.load_image(data)
+    if image is None:
+        raise InvalidImageError("Invalid image data")
+    return image, stage_timings.as_dict()
+
+
+def detect_image(image, name, camera_id, deadline):
+    """Chạy trong CPU executor"""
+    with collect_timings() as stage_timings:
+        result = service.detector.detect_license_plate_image(image, name=name, camera_id=camera_id, details=True,
+                                                             deadline=deadline)
+    return result, stage_timings.as_dict()
+
+
+async def run_detection(data, name=None, camera_id=None, deadline=None):
+    """Như app.run_detection nhưng không chặn event loop; trả về (result, timings)"""
+    global pending
+    loop = asyncio.get_running_loop()
+
+    if service.inference_pool is not None:
+        result, timings = await service.inference_pool.detect_async(data, name, camera_id, deadline)
+    else:
+        # Backpressure thay cho queue của inference pool
+        if pending >= MAX_PENDING:
+            raise QueueFullError()
+        pending += 1
+        try:
+            image, decode_timings = await loop.run_in_executor(decode_executor, decode_image, data)
+            result, timings = await loop.run_in_executor(cpu_executor, detect_image,
+                                                         image, name, camera_id, deadline)
+        finally:
+            pending -= 1
+        timings['decode'] = decode_timings['decode']
+        timings['total'] += decode_timings['total']
+
+    metrics.observe_timings(timings)
+    return result, timings
+
+
+def parse_base64_body(body):
+    """JSON body {'image': base64 hoặc data URL, ...} -> (bytes ảnh, JSON data)"""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or 'image' not in data:
+        raise BadRequest('No image data provided')
+
+    try:
+        image_data = data['image']
+        # Remove data URL prefix if present
+        if ',' in image_data:
+            image_data = image_data.split(',')[1]
+        return base64.b64decode(image_data), data
+    except Exception as e:
+        logger.error(f"Image decoding failed: {e}")
+        raise BadRequest('Failed to decode image')
+
+
+def encode_response(request, body, status):
+    """JSON hoặc msgpack theo header Accept (như app.encode_response)"""
+    if service.wants_msgpack(request.headers.get('accept')):
+        return Response(service.msgpack.packb(body), status_code=status, media_type=service.MSGPACK_MIMETYPE)
+    return JSONResponse(body, status_code=status)
+
+
+def error_response(message, status, headers=None):
+    return JSONResponse({'success': False, 'error': message}, status_code=status, headers=headers)
+
+
+def not_ready_response():
+    readiness = service.service_readiness()
+    if not readiness['starting']:
+        return JSONResponse({
+            'success': False,
+            'error': 'Detector component failed to load',
+            'readiness': readiness
+        }, status_code=503)
+    return JSONResponse({
+        'success': False,
+        'error': 'Detector is still loading',
+        'readiness': readiness
+    }, status_code=503, headers={'Retry-After': '5'})
+
+
+async def handle_detection(request, read):
+    """Khung chung của 2 endpoint: kiểm tra service, read(request) -> (bytes, name, camera_id, timings, deadline ms)"""
+    received_at = time.monotonic()
+    if not service.service_available():
+        logger.error("Detector not initialized")
+        return error_response('Detector not initialized', 500)
+    if not service.service_ready():
+        return not_ready_response()
+
+    try:
+        data, name, camera_id, include_timings, budget_ms = await read(request)
+        deadline = service.deadline_after(received_at, request.headers.get('X-Deadline-Ms') or budget_ms)
+        result, timings = await run_detection(data, name, camera_id, deadline)
+        body, status = service.detection_body(result, timings, include_timings)
+        return encode_response(request, body, status)
+
+    except BadRequest as e:
+        logger.error(str(e))
+        return error_response(str(e), 400)
+
+    except InvalidImageError:
+        logger.error("Failed to decode image")
+        metrics.REQUESTS.inc('invalid')
+        return error_response('Invalid image data', 400)
+
+    except QueueFullError as e:
+        logger.warning("Inference queue full, rejecting request")
+        metrics.REQUESTS.inc('rejected')
+        return error_response('Service busy, retry later', 503, {'Retry-After': str(e.retry_after)})
+
+    except Exception as e:
+        logger.error(f"Detection error: {e}")
+        metrics.REQUESTS.inc('error')
+        return error_response(f'Detection failed: {str(e)}', 500)
+
+
+async def read_file_request(request):
+    """Multipart field 'file' (+ camera_id, deadline_ms); body được stream từ client trên event loop"""
+    logger.info("Received file detection request")
+    form = await request.form()
+    file = form.get('file')
+    if file is None or isinstance(file, str):
+        raise BadRequest('No file provided')
+    if not file.filename:
+        raise BadRequest('No file selected')
+
+    data = await file.read()
+    await file.close()
+    name = f"detect_{os.path.splitext(os.path.basename(file.filename))[0]}"
+    camera_id = form.get('camera_id') or request.query_params.get('camera_id') or None
+    include_timings = request.query_params.get('timings', '').lower() in TRUE_VALUES
+    budget_ms = form.get('deadline_ms') or request.query_params.get('deadline_ms')
+    return data, name, camera_id, include_timings, budget_ms
+
+
+async def read_base64_request(request):
+    """JSON {'image', 'camera_id'?, 'timings'?, 'deadline_ms'?}; JSON parse + base64 decode chạy trong decode executor"""
+    logger.info("Received base64 detection request")
+    body = await request.body()
+    image_bytes, data = await asyncio.get_running_loop().run_in_executor(decode_executor, parse_base64_body, body)
+
+    name = f"base64-{int(time.time() * 1000000)}"
+    camera_id = request.query_params.get('camera_id') or data.get('camera_id') or None
+    include_timings = (request.query_params.get('timings', '').lower() in TRUE_VALUES
+                       or bool(data.get('timings')))
+    budget_ms = request.query_params.get('deadline_ms') or data.get('deadline_ms')
+    return image_bytes, name, camera_id, include_timings, budget_ms
+
+
+async def detect_file(request):
+    return await handle_detection(request, read_file_request)
+
+
+async def detect_base64(request):
+    return await handle_detection(request, read_base64_request)
+
+
+def shutdown():
+    decode_executor.shutdown(wait=False)
+    cpu_executor.shutdown(wait=False)
+
+
+app = Starlette(
+    routes=[
+        Route('/detect-file', detect_file, methods=['POST']),
+        Route('/detect-base64', detect_base64, methods=['POST']),
+        # /health, /ready, /detect-batch, /streams, /stats, /metrics... vẫn do Flask xử lý
+        Mount('/', app=WSGIMiddleware(service.app)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    on_shutdown=[shutdown],
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    logger.info("🚀 Starting ASGI server...")
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('AI_PORT', 5000)))
@@ -0,0 +1,141 @@
+"""So sánh policy resize của preprocess_crop_for_ocr: legacy (>= 4x INTER_CUBIC) và target-height
+
+Crop biển số lấy từ bbox trong labels.json, thêm bản thu nhỏ để mô phỏng camera xa.
+Mặc định chỉ đo thời gian preprocess (mọi variant); --ocr chạy thêm OCR cascade để so
+độ chính xác và thời gian end-to-end mỗi crop (cần EasyOCR).
+
+Usage:
+    python bench/preprocess_bench.py --repeat 50
+    python bench/preprocess_bench.py --ocr --output bench/preprocess.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from plate_detector import LicensePlateDetector  # noqa: E402
+from run_bench import SERVICE_DIR, accuracy, load_json  # noqa: E402
+
+# Chiều cao crop mô phỏng (pixel), None = kích thước gốc
+CROP_HEIGHTS = (None, 100, 60, 40)
+
+
+def legacy_preprocess(crop):
+    """preprocess_crop_for_ocr trước đây: upscale >= 4x khi crop < 60x200, tính cả 4 variant"""
+    h, w = crop.shape[:2]
+    if h < 60 or w < 200:
+        scale = max(60 / h, 200 / w, 4.0)
+        crop = cv2.resize(crop, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_CUBIC)
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if len(crop.shape) == 3 else crop
+    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    adaptive = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+    return [gray, clahe.apply(gray), thresh, adaptive]
+
+
+def load_crops(detector, labels):
+    """List (tên, plate, crop BGR) cho mọi bbox có nhãn, ở từng chiều cao trong CROP_HEIGHTS"""
+    crops = []
+    for entry in load_json(labels):
+        image = cv2.imread(os.path.join(SERVICE_DIR, entry['path']))
+        if image is None:
+            continue
+        for bbox in entry.get('bboxes') or []:
+            crop = detector.crop_license_plate(image, bbox)
+            for height in CROP_HEIGHTS:
+                if height is None or height >= crop.shape[0]:
+                    scaled = crop
+                else:
+                    scale = height / crop.shape[0]
+                    scaled = cv2.resize(crop, (int(crop.shape[1] * scale), height), interpolation=cv2.INTER_AREA)
+                crops.append((f"{os.path.basename(entry['path'])}@{scaled.shape[0]}px",
+                              entry.get('plate', ''), scaled))
+    return crops
+
+
+def time_preprocess(policy, crop, repeat, variants):
+    """ms mỗi lần preprocess + tạo `variants` variant đầu tiên, và số pixel mỗi variant"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        processed = policy(crop)
+        for i in range(variants):
+            processed[i]
+    elapsed = (time.perf_counter() - start) / repeat * 1000
+    return elapsed, int(processed[0].size)
+
+
+def run_policy(name, policy, detector, crops, args):
+    report = {'policy': name, 'crops': []}
+    predictions = []
+    for crop_name, plate, crop in crops:
+        all_ms, pixels = time_preprocess(policy, crop, args.repeat, 4)
+        first_ms, _ = time_preprocess(policy, crop, args.repeat, 1)
+        row = {'crop': crop_name, 'input': list(crop.shape[:2]), 'ocr_pixels': pixels,
+               'all_variants_ms': round(all_ms, 3), 'first_variant_ms': round(first_ms, 3)}
+
+        if args.ocr:
+            detector.preprocess_crop_for_ocr = policy
+            start = time.perf_counter()
+            text, _ = detector.extract_text_from_crop(crop)
+            row['ocr_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            row['text'] = text
+            predictions.append((crop_name, plate, text))
+        report['crops'].append(row)
+
+    for key in ('all_variants_ms', 'first_variant_ms', 'ocr_ms', 'ocr_pixels'):
+        values = [row[key] for row in report['crops'] if key in row]
+        if values:
+            report[f'mean_{key}'] = round(float(np.mean(values)), 3)
+    if args.ocr:
+        report['accuracy'] = accuracy(predictions)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark preprocess_crop_for_ocr resize policy")
+    parser.add_argument('--labels', default=os.path.join(BENCH_DIR, 'labels.json'))
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--ocr', action='store_true', help="Chạy OCR cascade để so độ chính xác (cần EasyOCR)")
+    parser.add_argument('--interpolation', default='linear')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    # Đường dẫn do user truyền tính từ thư mục hiện tại: resolve trước khi chdir
+    for name in ('labels', 'output'):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    os.chdir(SERVICE_DIR)
+
+    detector = LicensePlateDetector(
+        localizer_backend='static', localizer_options={'labels': args.labels},
+        cache_size=0, warmup_dir=None, camera_profiles=None, ocr_interpolation=args.interpolation,
+    )
+    target_height = detector.preprocess_crop_for_ocr
+
+    crops = load_crops(detector, args.labels)
+    reports = [run_policy('legacy', legacy_preprocess, detector, crops, args),
+               run_policy('target_height', target_height, detector, crops, args)]
+
+    for report in reports:
+        print(f"\n[{report['policy']}]")
+        for row in report['crops']:
+            extra = f"  ocr {row['ocr_ms']:>8.1f} ms  -> {row['text']}" if 'ocr_ms' in row else ''
+            print(f"  {row['crop']:<50} {str(row['input']):>12} -> {row['ocr_pixels']:>8} px  "
+                  f"all {row['all_variants_ms']:>7.3f} ms  first {row['first_variant_ms']:>7.3f} ms{extra}")
+        summary = {k: v for k, v in report.items() if k not in ('policy', 'crops')}
+        print(f"  summary: {summary}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
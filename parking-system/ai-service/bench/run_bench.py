@@ -0,0 +1,325 @@
+"""Offline benchmark: throughput, latency theo stage và độ chính xác trên corpus có nhãn
+
+Chạy LicensePlateDetector qua InferencePool (giống chế độ serving 'pool') với
+localizer 'static' (bbox lấy từ labels.json) nên không cần network hay model YOLO.
+
+Usage:
+    python bench/run_bench.py --workers 4 --repeat 5 --output bench/results.json
+    python bench/run_bench.py --workers 4 --compare bench/baseline.json
+    python bench/run_bench.py --workers 4 --ocr-engine onnx-int8 --skip-detection --compare bench/baseline.json
+    python bench/run_bench.py --workers 2 --ocr-engine torch,int8,onnx,onnx-int8 --skip-detection   # bảng so sánh engine
+    python bench/run_bench.py --seed               # thêm ảnh chưa có nhãn (hinh/, uploads/ ở repo root) vào labels.json
+    python bench/run_bench.py --seed path/to/dir   # đường dẫn tính từ thư mục hiện tại
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_ROOT = os.path.dirname(os.path.dirname(SERVICE_DIR))
+DEFAULT_SEED_DIRS = (os.path.join(SERVICE_DIR, 'hinh'), os.path.join(REPO_ROOT, 'uploads'))
+sys.path.insert(0, SERVICE_DIR)
+
+from inference_server import InferencePool, QueueFullError  # noqa: E402
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+PERCENTILES = (50, 95, 99)
+ALNUM_RE = re.compile(r'[^A-Z0-9]')
+
+
+def load_json(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def seed_labels(path, directories):
+    """Thêm ảnh chưa có trong labels.json (plate rỗng = chỉ đo tốc độ, không tính accuracy)
+
+    directories là đường dẫn tuyệt đối; path trong labels.json tính từ SERVICE_DIR.
+    """
+    entries = load_json(path) if os.path.exists(path) else []
+    known = {entry['path'] for entry in entries}
+    added = 0
+    for directory in directories:
+        if not os.path.isdir(directory):
+            print(f"Skipping {directory}: not a directory")
+            continue
+        for filename in sorted(os.listdir(directory)):
+            relative = os.path.relpath(os.path.join(directory, filename), SERVICE_DIR).replace(os.sep, '/')
+            if filename.lower().endswith(IMAGE_EXTENSIONS) and relative not in known:
+                entries.append({'path': relative, 'plate': '', 'bboxes': []})
+                added += 1
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+    print(f"Added {added} images to {path} ({len(entries)} total)")
+
+
+def load_corpus(entries):
+    """List (path, plate, jpeg bytes) - gửi bytes như request thật"""
+    corpus = []
+    for entry in entries:
+        with open(os.path.join(SERVICE_DIR, entry['path']), 'rb') as f:
+            corpus.append((entry['path'], entry.get('plate', ''), f.read()))
+    return corpus
+
+
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def accuracy(predictions):
+    """Exact match trên chuỗi đã format và character accuracy (1 - edit distance) trên ký tự A-Z0-9"""
+    labeled = [(plate, predicted) for _, plate, predicted in predictions if plate]
+    if not labeled:
+        return {'labeled': 0, 'exact_match': None, 'char_accuracy': None}
+
+    exact = sum(1 for plate, predicted in labeled if predicted == plate)
+    chars = errors = 0
+    for plate, predicted in labeled:
+        expected = ALNUM_RE.sub('', plate.upper())
+        got = ALNUM_RE.sub('', (predicted or '').upper())
+        chars += len(expected)
+        errors += min(len(expected), edit_distance(expected, got))
+
+    return {
+        'labeled': len(labeled),
+        'exact_match': exact / len(labeled),
+        'char_accuracy': 1 - errors / chars if chars else None
+    }
+
+
+def stage_percentiles(samples):
+    """{stage: [giây]} -> {stage: {'count', 'p50_ms', 'p95_ms', 'p99_ms'}}"""
+    report = {}
+    for name, values in sorted(samples.items()):
+        values = np.asarray(values) * 1000
+        report[name] = {'count': len(values)}
+        for p in PERCENTILES:
+            report[name][f'p{p}_ms'] = round(float(np.percentile(values, p)), 3)
+    return report
+
+
+def peak_rss_mb():
+    """Peak RSS của process bench và của worker process lớn nhất (đã join)"""
+    if resource is None:
+        return None
+    # ru_maxrss: KB trên Linux, byte trên macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {
+        'main': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        'worker': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1)
+    }
+
+
+def wait_until_ready(pool, timeout):
+    deadline = time.monotonic() + timeout
+    while len(pool.worker_readiness) < pool.num_workers:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Workers not ready after {timeout}s")
+        time.sleep(0.1)
+    if not pool.is_ready():
+        raise RuntimeError(f"No worker became ready: {pool.get_readiness()}")
+
+
+def run_workers(num_workers, corpus, args, detector_config):
+    """Một lượt benchmark với num_workers process; client gửi đồng thời để giữ queue luôn có việc
+
+    Stage 'ocr_all' là tổng các stage ocr_* của một ảnh (latency recognizer để so sánh engine).
+    """
+    clients = num_workers * args.max_batch
+    pool = InferencePool(detector_config, num_workers=num_workers, queue_size=clients * 2,
+                         max_batch_size=args.max_batch, batch_window_ms=args.batch_window_ms,
+                         threads_per_worker=args.threads_per_worker, request_timeout=args.timeout)
+    pool.start()
+    try:
+        wait_until_ready(pool, args.ready_timeout)
+        # Engine thực sự load được (lỗi export/quantize thì worker quay về torch)
+        ocr_engines = sorted({str(r['components']['ocr'].get('engine')) for r in pool.worker_readiness.values()})
+
+        def detect(item):
+            path, plate, data = item
+            while True:
+                try:
+                    result, timings = pool.detect(data)
+                    return path, plate, result.license_plate if result else None, timings
+                except QueueFullError:
+                    time.sleep(0.001)
+
+        jobs = [item for _ in range(args.repeat) for item in corpus]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            outcomes = list(executor.map(detect, jobs))
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.stop()
+
+    samples = {}
+    for _, _, _, timings in outcomes:
+        for name, seconds in timings.items():
+            samples.setdefault(name, []).append(seconds)
+        ocr_seconds = [seconds for name, seconds in timings.items() if name.startswith('ocr_')]
+        if ocr_seconds:
+            samples.setdefault('ocr_all', []).append(sum(ocr_seconds))
+
+    return {
+        'ocr_engine': detector_config['ocr_engine'],
+        'workers': num_workers,
+        'images': len(jobs),
+        'seconds': round(elapsed, 3),
+        'images_per_sec': round(len(jobs) / elapsed, 2) if elapsed else None,
+        'ocr_engines': ocr_engines,
+        'stages': stage_percentiles(samples),
+        'accuracy': accuracy([(path, plate, result) for path, plate, result, _ in outcomes]),
+        'predictions': {path: result for path, _, result, _ in outcomes}
+    }
+
+
+def compare(report, baseline):
+    """In chênh lệch images/sec và p95 theo stage so với một lần chạy trước (cùng engine + số worker)"""
+    # Baseline cũ không có 'ocr_engine' trong từng run
+    default_engine = baseline.get('config', {}).get('ocr_engine', 'torch')
+    previous = {(run.get('ocr_engine', default_engine), run['workers']): run for run in baseline['runs']}
+    for run in report['runs']:
+        old = previous.get((run['ocr_engine'], run['workers']))
+        if old is None:
+            continue
+        print(f"\n[{run['ocr_engine']}, {run['workers']} workers] "
+              f"images/sec {old['images_per_sec']} -> {run['images_per_sec']}")
+        old_acc, new_acc = old['accuracy'], run['accuracy']
+        print(f"  exact_match {old_acc['exact_match']} -> {new_acc['exact_match']}, "
+              f"char_accuracy {old_acc['char_accuracy']} -> {new_acc['char_accuracy']}")
+        for name, stats in run['stages'].items():
+            if name in old['stages']:
+                before, after = old['stages'][name]['p95_ms'], stats['p95_ms']
+                change = (after - before) / before * 100 if before else 0.0
+                print(f"  {name:<20} p95 {before:>9.2f} -> {after:>9.2f} ms ({change:+.1f}%)")
+
+
+def print_run(run):
+    acc = run['accuracy']
+    print(f"\n[{run['ocr_engine']}, {run['workers']} workers] {run['images']} images in {run['seconds']}s "
+          f"= {run['images_per_sec']} images/sec, exact_match={acc['exact_match']}, "
+          f"char_accuracy={acc['char_accuracy']}, loaded={','.join(run['ocr_engines'])}")
+    for name, stats in run['stages'].items():
+        print(f"  {name:<20} p50 {stats['p50_ms']:>9.2f}  p95 {stats['p95_ms']:>9.2f}  "
+              f"p99 {stats['p99_ms']:>9.2f} ms  (n={stats['count']})")
+
+
+def print_comparison(runs):
+    """Bảng accuracy / latency theo OCR engine cho từng số worker, để chọn engine cho deployment"""
+    print(f"\n{'engine':<10} {'loaded':<10} {'workers':>7} {'img/s':>8} {'exact':>7} {'char':>7} "
+          f"{'ocr p50':>9} {'ocr p95':>9} {'total p95':>10}")
+    for run in sorted(runs, key=lambda r: r['workers']):
+        acc = run['accuracy']
+        ocr = run['stages'].get('ocr_all', {})
+        total = run['stages'].get('total', {})
+        print(f"{run['ocr_engine']:<10} {','.join(run['ocr_engines']):<10} {run['workers']:>7} "
+              f"{run['images_per_sec'] or 0:>8.2f} {format_ratio(acc['exact_match']):>7} "
+              f"{format_ratio(acc['char_accuracy']):>7} {ocr.get('p50_ms', 0):>9.2f} "
+              f"{ocr.get('p95_ms', 0):>9.2f} {total.get('p95_ms', 0):>10.2f}")
+
+
+def format_ratio(value):
+    return '-' if value is None else f"{value:.3f}"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline license plate benchmark")
+    parser.add_argument('--labels', default=os.path.join(SERVICE_DIR, 'bench', 'labels.json'))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Đo lần lượt 1..N workers")
+    parser.add_argument('--repeat', type=int, default=3, help="Số lần chạy lại toàn bộ corpus mỗi lượt")
+    parser.add_argument('--max-batch', type=int, default=4)
+    parser.add_argument('--batch-window-ms', type=float, default=5)
+    parser.add_argument('--threads-per-worker', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--ready-timeout', type=float, default=600.0)
+    parser.add_argument('--localizer', default='static', help="static (không cần network), onnx, roboflow")
+    parser.add_argument('--ocr-engine', default='int8',
+                        help="torch, int8, onnx, onnx-int8 (xem ocr_recognizer); nhiều engine cách nhau "
+                             "bằng dấu phẩy để chạy lần lượt và in bảng so sánh")
+    parser.add_argument('--skip-detection', action='store_true', help="Bỏ CRAFT, chỉ chạy recognizer trên crop biển số")
+    parser.add_argument('--cache', action='store_true', help="Bật image/crop cache (mặc định tắt để đo pipeline thật)")
+    parser.add_argument('--output', help="Ghi kết quả JSON")
+    parser.add_argument('--compare', help="So sánh với JSON của một lần chạy trước")
+    parser.add_argument('--seed', nargs='*', metavar='DIR',
+                        help="Thêm ảnh trong các thư mục (mặc định ai-service/hinh và uploads/ ở repo root) "
+                             "vào labels.json rồi thoát")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # Đường dẫn do user truyền tính từ thư mục hiện tại: resolve trước khi chdir
+    seed_dirs = [os.path.abspath(directory) for directory in args.seed] if args.seed else DEFAULT_SEED_DIRS
+    for name in ('labels', 'output', 'compare'):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    os.chdir(SERVICE_DIR)
+
+    if args.seed is not None:
+        seed_labels(args.labels, seed_dirs)
+        return
+
+    corpus = load_corpus(load_json(args.labels))
+    engines = [engine.strip() for engine in args.ocr_engine.split(',') if engine.strip()]
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'seed')},
+        'corpus': {'images': len(corpus), 'labeled': sum(1 for _, plate, _ in corpus if plate)},
+        'runs': []
+    }
+
+    for engine in engines:
+        detector_config = {
+            'localizer_backend': args.localizer,
+            'localizer_options': {'labels': args.labels} if args.localizer == 'static' else {},
+            'cache_size': 256 if args.cache else 0,
+            'ocr_engine': engine,
+            'ocr_skip_detection': args.skip_detection,
+        }
+        for num_workers in range(1, args.workers + 1):
+            run = run_workers(num_workers, corpus, args, detector_config)
+            print_run(run)
+            report['runs'].append(run)
+
+    if len(engines) > 1:
+        print_comparison(report['runs'])
+
+    report['peak_rss_mb'] = peak_rss_mb()
+    print(f"\nPeak RSS (MB): {report['peak_rss_mb']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        compare(report, load_json(args.compare))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Profile theo camera: vùng ROI, độ phân giải cho localizer, loại biển, thứ tự variant OCR, registry match
+và lọc detection
+
+File JSON (mặc định camera_profiles.json), key là camera id do backend gửi kèm request;
+profile "default" áp dụng cho camera không có trong file:
+
+    {
+        "gate-1": {"roi": [0.25, 0.4, 0.75, 1.0], "max_width": 640,
+                   "plate_type": "motorcycle", "variant_order": ["clahe", "gray"]},
+        "exit-1": {"registry_match": true,
+                   "detection_filter": {"position_prior": [0.5, 0.8], "top_k": 1}},
+        "default": {"max_width": 1280}
+    }
+
+roi là [x1, y1, x2, y2] theo pixel hoặc theo tỉ lệ (mọi giá trị <= 1). detection_filter ghi đè
+option của DetectionFilter mặc định (xem plate_filter) cho camera này. File được đọc
+lại khi mtime thay đổi (kiểm tra tối đa mỗi check_interval giây), không cần restart.
+"""
+import cv2
+import json
+import logging
+import os
+import threading
+import time
+
+from plate_filter import DetectionFilter
+
+logger = logging.getLogger(__name__)
+
+PLATE_TYPES = ('motorcycle', 'car')
+
+
+class CameraProfile:
+    """Cấu hình của một camera"""
+
+    def __init__(self, roi=None, max_width=None, plate_type=None, variant_order=None, registry_match=None,
+                 detection_filter=None):
+        if plate_type is not None and plate_type not in PLATE_TYPES:
+            raise ValueError(f"Unknown plate_type: {plate_type}")
+        if roi is not None and len(roi) != 4:
+            raise ValueError(f"roi must be [x1, y1, x2, y2]: {roi}")
+        self.roi = roi
+        self.max_width = max_width
+        self.plate_type = plate_type
+        self.variant_order = variant_order
+        # Sửa kết quả OCR theo biển đang gửi trong bãi (camera cổng ra); None = mặc định của detector
+        self.registry_match = registry_match
+        if detection_filter is not None:
+            # Báo lỗi option sai ngay khi load file
+            DetectionFilter(**detection_filter)
+        self.detection_filter = detection_filter
+
+    def roi_pixels(self, width, height):
+        """ROI theo pixel, clip vào ảnh"""
+        if self.roi is None:
+            return 0, 0, width, height
+        x1, y1, x2, y2 = self.roi
+        if all(v <= 1 for v in self.roi):
+            x1, x2 = x1 * width, x2 * width
+            y1, y2 = y1 * height, y2 * height
+        x1, y1 = max(0, int(x1)), max(0, int(y1))
+        x2, y2 = min(width, int(x2)), min(height, int(y2))
+        if x2 <= x1 or y2 <= y1:
+            return 0, 0, width, height
+        return x1, y1, x2, y2
+
+    def localizer_view(self, image):
+        """(ảnh cho localizer, (offset_x, offset_y, scale)) - ROI là view, chỉ copy khi downscale"""
+        h, w = image.shape[:2]
+        x1, y1, x2, y2 = self.roi_pixels(w, h)
+        view = image[y1:y2, x1:x2]
+        scale = 1.0
+        if self.max_width and view.shape[1] > self.max_width:
+            scale = self.max_width / float(view.shape[1])
+            view = cv2.resize(view, (self.max_width, max(1, int(view.shape[0] * scale))),
+                              interpolation=cv2.INTER_AREA)
+        return view, (x1, y1, scale)
+
+    @staticmethod
+    def to_original(bbox, transform):
+        """bbox trên ảnh localizer -> toạ độ ảnh gốc"""
+        offset_x, offset_y, scale = transform
+        x1, y1, x2, y2 = bbox
+        return [int(x1 / scale) + offset_x, int(y1 / scale) + offset_y,
+                int(x2 / scale) + offset_x, int(y2 / scale) + offset_y]
+
+
+class CameraProfiles:
+    """Tập profile đọc từ file JSON, hot-reload theo mtime"""
+
+    def __init__(self, path='camera_profiles.json', check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.profiles = {}
+        self.mtime = None
+        self.last_check = 0.0
+        self.lock = threading.Lock()
+        self.reload_if_changed(force=True)
+
+    def reload_if_changed(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_check < self.check_interval:
+            return
+        self.last_check = now
+
+        try:
+            mtime = os.path.getmtime(self.path) if self.path else None
+        except OSError:
+            mtime = None
+        if mtime == self.mtime:
+            return
+
+        if mtime is None:
+            # File bị xoá: không dùng profile nào
+            self.profiles, self.mtime = {}, None
+            return
+
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                raw = json.load(f)
+            profiles = {str(camera_id): CameraProfile(**options) for camera_id, options in raw.items()}
+        except Exception as e:
+            # Giữ profile cũ nếu file mới lỗi
+            logger.error(f"Failed to load camera profiles from {self.path}: {e}")
+            self.mtime = mtime
+            return
+
+        self.profiles, self.mtime = profiles, mtime
+        logger.info(f"Loaded {len(profiles)} camera profiles from {self.path}")
+
+    def get(self, camera_id):
+        """Profile của camera (hoặc 'default'), None nếu không có"""
+        with self.lock:
+            self.reload_if_changed()
+        if camera_id is not None and str(camera_id) in self.profiles:
+            return self.profiles[str(camera_id)]
+        return self.profiles.get('default')
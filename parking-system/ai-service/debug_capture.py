@@ -0,0 +1,151 @@
+"""Lưu ảnh debug (crop + các variant đã preprocess) ngoài request path
+
+Tắt mặc định. Khi bật, chỉ một phần kết quả được lấy mẫu (sample_rate) hoặc các
+kết quả có confidence thấp; ảnh được encode và ghi bởi một background thread vào
+thư mục ring giới hạn dung lượng (file cũ nhất bị xoá trước). Queue đầy thì bỏ
+capture chứ không bao giờ chặn request.
+"""
+import cv2
+import itertools
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = os.path.join('uploads', 'debug')
+DEFAULT_MAX_MEGABYTES = 100
+
+
+class DebugCapture:
+    """Sampled, asynchronous debug image writer với thư mục ring theo dung lượng"""
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, sample_rate=0.0,
+                 low_confidence=None, max_megabytes=DEFAULT_MAX_MEGABYTES, queue_size=64, expand=None):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.low_confidence = low_confidence
+        self.max_bytes = int(max_megabytes * 1024 * 1024)
+        # expand(crop) -> list ảnh variant, chạy trong writer thread
+        self.expand = expand
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.files = deque()
+        self.total_bytes = 0
+        self.captured = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.writer = None
+        self.paused = False
+        self.sequence = itertools.count()
+
+    def enabled(self):
+        return self.sample_rate > 0 or self.low_confidence is not None
+
+    def should_capture(self, confidence):
+        """Lấy mẫu ngẫu nhiên hoặc khi không đọc được / confidence thấp"""
+        if not self.enabled() or self.paused:
+            return False
+        if self.low_confidence is not None and (confidence is None or confidence < self.low_confidence):
+            return True
+        return random.random() < self.sample_rate
+
+    def submit(self, name, image, confidence=None, text=None):
+        """Đưa ảnh vào queue ghi (không chặn); trả về False nếu không capture"""
+        if not self.should_capture(confidence):
+            return False
+
+        self.ensure_writer()
+        label = text.replace(' ', '_') if text else 'none'
+        conf = f"{confidence:.2f}" if confidence is not None else 'na'
+        prefix = f"{name or 'frame'}_{int(time.time() * 1000)}_{os.getpid()}_{next(self.sequence)}_{label}_{conf}"
+        try:
+            # Copy: crop thường là view của frame mà caller có thể tái sử dụng
+            self.queue.put_nowait((prefix, image.copy()))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+        return True
+
+    @contextmanager
+    def suspended(self):
+        """Tạm tắt capture (warm-up)"""
+        self.paused = True
+        try:
+            yield
+        finally:
+            self.paused = False
+
+    def ensure_writer(self):
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.run, daemon=True)
+                self.writer.start()
+
+    def run(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self.scan_existing()
+        except Exception as e:
+            logger.error(f"Debug capture directory setup failed: {e}")
+
+        while True:
+            prefix, image = self.queue.get()
+            try:
+                self.write(f"{prefix}_original.jpg", image)
+                if self.expand is not None:
+                    for i, variant in enumerate(self.expand(image)):
+                        self.write(f"{prefix}_processed_{i}.jpg", variant)
+                with self.lock:
+                    self.captured += 1
+                self.trim()
+            except Exception as e:
+                logger.error(f"Debug capture write failed: {e}")
+
+    def scan_existing(self):
+        """Nạp file đã có (cũ nhất trước) để giới hạn dung lượng áp dụng cho cả file từ lần chạy trước"""
+        entries = []
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if os.path.isfile(path):
+                entries.append((os.path.getmtime(path), path, os.path.getsize(path)))
+        for _, path, size in sorted(entries):
+            self.files.append((path, size))
+            self.total_bytes += size
+        self.trim()
+
+    def write(self, filename, image):
+        ok, encoded = cv2.imencode('.jpg', image)
+        if not ok:
+            return
+        path = os.path.join(self.directory, filename)
+        with open(path, 'wb') as f:
+            f.write(encoded.tobytes())
+        self.files.append((path, len(encoded)))
+        self.total_bytes += len(encoded)
+
+    def trim(self):
+        while self.files and self.total_bytes > self.max_bytes:
+            path, size = self.files.popleft()
+            self.total_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                # Worker khác đã xoá
+                pass
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'enabled': self.enabled(),
+                'captured': self.captured,
+                'dropped': self.dropped,
+                'queued': self.queue.qsize(),
+                'files': len(self.files),
+                'bytes': self.total_bytes
+            }
@@ -0,0 +1,82 @@
+"""Kết quả detection có cấu trúc: các biển ứng viên (top-N) của một ảnh kèm chi tiết từng detection
+
+Backend cần bbox, điểm của localizer / OCR và biển thứ hai (khi có hai xe trong khung)
+để quyết định mở barrier mà không phải gửi thêm request. Object dùng __slots__ vì được
+tạo cho mỗi ảnh, giữ trong image cache và pickle qua queue của inference pool.
+
+to_dict() trả về dạng gọn (bỏ field None) để serialize JSON hoặc msgpack.
+"""
+
+
+class PlateCandidate:
+    """Một biển đọc được từ một vùng của ảnh"""
+
+    __slots__ = ('license_plate', 'confidence', 'detector_score', 'ocr_score', 'bbox', 'method',
+                 'variant', 'plate_type', 'corrected_from', 'registry_distance')
+
+    def __init__(self, license_plate, confidence, detector_score, ocr_score, bbox, method,
+                 variant=None, plate_type=None, corrected_from=None, registry_distance=None):
+        self.license_plate = license_plate
+        # (detector_score + ocr_score) / 2, dùng để xếp hạng các ứng viên
+        self.confidence = float(confidence)
+        # None khi không qua localizer (fallback OCR cả frame)
+        self.detector_score = float(detector_score) if detector_score is not None else None
+        self.ocr_score = float(ocr_score)
+        self.bbox = [int(v) for v in bbox] if bbox is not None else None
+        self.method = method
+        # Variant OCR tạo ra kết quả ('constrained', 'gray', 'clahe', ...)
+        self.variant = variant
+        self.plate_type = plate_type
+        self.corrected_from = corrected_from
+        self.registry_distance = registry_distance
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+
+    def __repr__(self):
+        return f"PlateCandidate({self.license_plate!r}, confidence={self.confidence:.2f}, method={self.method!r})"
+
+
+class DetectionResult:
+    """Các ứng viên của một ảnh, sắp theo confidence giảm dần; ứng viên đầu tiên là kết quả chính"""
+
+    __slots__ = ('candidates', 'tier')
+
+    def __init__(self, candidates, tier='full'):
+        self.candidates = sorted(candidates, key=lambda c: c.confidence, reverse=True)
+        # Mức pipeline tạo ra kết quả (plate_detector.DEGRADATION_TIERS)
+        self.tier = tier
+
+    @property
+    def best(self):
+        return self.candidates[0]
+
+    @property
+    def license_plate(self):
+        return self.best.license_plate
+
+    @property
+    def confidence(self):
+        return self.best.confidence
+
+    @property
+    def method(self):
+        return self.best.method
+
+    def to_dict(self):
+        """Field của ứng viên chính ở top level (tương thích response cũ) + danh sách ứng viên"""
+        body = {
+            'license_plate': self.license_plate,
+            'confidence': self.confidence,
+            'method': self.method,
+            'tier': self.tier,
+            'candidates': [candidate.to_dict() for candidate in self.candidates]
+        }
+        if self.best.corrected_from is not None:
+            body['corrected_from'] = self.best.corrected_from
+        if self.best.registry_distance is not None:
+            body['registry_distance'] = self.best.registry_distance
+        return body
+
+    def __repr__(self):
+        return f"DetectionResult({self.candidates!r}, tier={self.tier!r})"
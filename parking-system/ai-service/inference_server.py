@@ -0,0 +1,320 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+from debug_capture import DEFAULT_DIRECTORY, DEFAULT_MAX_MEGABYTES
+from metrics import collect_timings
+from plate_detector import InvalidImageError, LicensePlateDetector, configure_threads
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Request queue đầy - caller nên trả 503 + Retry-After"""
+
+    def __init__(self, retry_after=1):
+        super().__init__("Inference queue is full")
+        self.retry_after = retry_after
+
+
+def with_queue_wait(timings, start):
+    """Copy timings của worker kèm thời gian chờ trong queue + IPC (ngoài thời gian xử lý của worker)"""
+    timings = dict(timings)
+    timings['queue_wait'] = max(0.0, time.perf_counter() - start - timings.get('total', 0.0))
+    return timings
+
+
+def collect_batch(request_queue, max_batch_size, batch_window):
+    """Lấy một request (blocking) rồi gom thêm các request đến trong batch_window giây"""
+    first = request_queue.get()
+    if first is None:
+        return None
+
+    batch = [first]
+    deadline = time.monotonic() + batch_window
+    while len(batch) < max_batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            item = request_queue.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if item is None:
+            # Trả lại sentinel cho vòng lặp sau để worker dừng
+            request_queue.put(None)
+            break
+        batch.append(item)
+
+    return batch
+
+
+def apply_control_messages(detector, control_queue):
+    """Áp dụng các update gửi riêng cho worker này (plate registry) trước khi xử lý batch"""
+    while True:
+        try:
+            kind, payload = control_queue.get_nowait()
+        except queue.Empty:
+            return
+        if kind == 'registry':
+            detector.update_registry(**payload)
+
+
+def worker_main(worker_id, request_queue, result_queue, detector_config,
+                max_batch_size, batch_window, threads_per_worker, control_queue):
+    """Entry point của inference worker process, mỗi worker sở hữu một LicensePlateDetector"""
+    # Giới hạn thread pool của torch/OpenCV trong mỗi worker process
+    configure_threads(threads_per_worker, 1)
+    detector_config = dict(detector_config)
+    if not detector_config.get('intra_op_threads'):
+        detector_config['intra_op_threads'] = threads_per_worker
+
+    detector = LicensePlateDetector(**detector_config)
+    logger.info(f"Inference worker {worker_id} started (pid {os.getpid()})")
+    result_queue.put(('ready', worker_id, detector.get_readiness()))
+
+    while True:
+        batch = collect_batch(request_queue, max_batch_size, batch_window)
+        if batch is None:
+            break
+
+        request_ids = [request_id for request_id, _, _, _, _ in batch]
+        try:
+            apply_control_messages(detector, control_queue)
+
+            # Decode trong worker để main process chỉ chuyển bytes qua queue
+            decoded = [(request_id, detector.load_image(source), name, camera_id, deadline)
+                       for request_id, source, name, camera_id, deadline in batch]
+            for request_id, image, _, _, _ in decoded:
+                if image is None:
+                    result_queue.put(('invalid', request_id, None))
+            decoded = [item for item in decoded if item[1] is not None]
+
+            with collect_timings() as timings:
+                results = detector.detect_license_plates_batch([image for _, image, _, _, _ in decoded],
+                                                               [name for _, _, name, _, _ in decoded],
+                                                               [camera_id for _, _, _, camera_id, _ in decoded],
+                                                               details=True,
+                                                               deadlines=[deadline for *_, deadline in decoded])
+            # Timing của cả batch gửi kèm từng request (các request chờ cùng một batch)
+            batch_timings = timings.as_dict()
+            for (request_id, *_), result in zip(decoded, results):
+                result_queue.put(('result', request_id, (result, batch_timings)))
+
+            result_queue.put(('stats', worker_id, {
+                'cascade': detector.get_cascade_stats(),
+                'cache': detector.get_cache_stats(),
+                'debug_capture': detector.debug_capture.get_stats(),
+                'registry': detector.plate_registry.get_stats()
+            }))
+        except Exception as e:
+            logger.error(f"Worker {worker_id} batch failed: {e}")
+            for request_id in request_ids:
+                result_queue.put(('error', request_id, str(e)))
+
+    logger.info(f"Inference worker {worker_id} stopped")
+
+
+class InferencePool:
+    """Pool các inference worker process dùng chung một bounded request queue + micro-batching"""
+
+    def __init__(self, detector_config=None, num_workers=2, queue_size=32, max_batch_size=4,
+                 batch_window_ms=5, threads_per_worker=1, request_timeout=30.0, retry_after=1):
+        self.detector_config = detector_config or {}
+        self.num_workers = num_workers
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window_ms / 1000.0
+        self.threads_per_worker = threads_per_worker
+        self.request_timeout = request_timeout
+        self.retry_after = retry_after
+
+        ctx = mp.get_context('spawn')
+        self.request_queue = ctx.Queue(maxsize=queue_size)
+        self.result_queue = ctx.Queue()
+        self.ctx = ctx
+        self.workers = []
+        # Queue riêng mỗi worker cho update phải tới mọi worker (request_queue chỉ tới một worker)
+        self.control_queues = [ctx.Queue() for _ in range(num_workers)]
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.ids = itertools.count()
+        self.worker_readiness = {}
+        self.worker_stats = {}
+        self.dispatcher = None
+
+    def start(self):
+        for worker_id in range(self.num_workers):
+            process = self.ctx.Process(
+                target=worker_main,
+                args=(worker_id, self.request_queue, self.result_queue, self.worker_config(worker_id),
+                      self.max_batch_size, self.batch_window, self.threads_per_worker,
+                      self.control_queues[worker_id]),
+                daemon=True
+            )
+            process.start()
+            self.workers.append(process)
+
+        self.dispatcher = threading.Thread(target=self.dispatch_results, daemon=True)
+        self.dispatcher.start()
+        logger.info(f"Inference pool started with {self.num_workers} workers")
+
+    def worker_config(self, worker_id):
+        """Detector config của một worker: debug capture ghi vào thư mục riêng với phần dung lượng của worker
+
+        Mỗi worker có DebugCapture riêng; dùng chung thư mục và max_megabytes thì tổng dung lượng
+        lên tới num_workers lần giới hạn và các worker xoá file của nhau.
+        """
+        config = dict(self.detector_config)
+        capture = config.get('debug_capture')
+        if capture:
+            capture = dict(capture)
+            capture['directory'] = os.path.join(capture.get('directory', DEFAULT_DIRECTORY), f'worker-{worker_id}')
+            capture['max_megabytes'] = capture.get('max_megabytes', DEFAULT_MAX_MEGABYTES) / self.num_workers
+            config['debug_capture'] = capture
+        return config
+
+    def dispatch_results(self):
+        """Chuyển kết quả từ worker về Future của từng request"""
+        while True:
+            kind, key, payload = self.result_queue.get()
+            if kind == 'stop':
+                break
+            if kind == 'ready':
+                self.worker_readiness[key] = payload
+                continue
+            if kind == 'stats':
+                self.worker_stats[key] = payload
+                continue
+
+            with self.pending_lock:
+                future = self.pending.pop(key, None)
+            if future is None:
+                continue
+            if kind == 'invalid':
+                future.set_exception(InvalidImageError("Invalid image data"))
+            elif kind == 'error':
+                future.set_exception(RuntimeError(payload))
+            else:
+                future.set_result(payload)
+
+    def submit(self, source, name=None, camera_id=None, deadline=None):
+        """Đưa request vào queue; raise QueueFullError khi queue đầy (backpressure)
+
+        deadline là time.monotonic() của main process: CLOCK_MONOTONIC dùng chung cho mọi
+        process trên cùng máy nên worker so sánh trực tiếp được.
+        """
+        request_id = next(self.ids)
+        future = Future()
+        future.request_id = request_id
+        # RUNNING: cancel() (vd. asyncio.wait_for timeout) không được làm dispatcher set_result lỗi
+        future.set_running_or_notify_cancel()
+        with self.pending_lock:
+            self.pending[request_id] = future
+
+        try:
+            self.request_queue.put_nowait((request_id, source, name, camera_id, deadline))
+        except queue.Full:
+            with self.pending_lock:
+                self.pending.pop(request_id, None)
+            raise QueueFullError(self.retry_after)
+
+        return future
+
+    def detect(self, source, name=None, camera_id=None, deadline=None):
+        """Submit và chờ (result, timings) (blocking tới request_timeout); result là DetectionResult hoặc None"""
+        start = time.perf_counter()
+        future = self.submit(source, name, camera_id, deadline)
+        try:
+            result, timings = future.result(timeout=self.request_timeout)
+            return result, with_queue_wait(timings, start)
+        finally:
+            if not future.done():
+                # Timeout: bỏ Future để dispatcher không giữ reference
+                with self.pending_lock:
+                    self.pending.pop(future.request_id, None)
+
+    async def detect_async(self, source, name=None, camera_id=None, deadline=None):
+        """Như detect() nhưng await trong event loop (ASGI front end) thay vì chặn một thread"""
+        start = time.perf_counter()
+        future = self.submit(source, name, camera_id, deadline)
+        try:
+            result, timings = await asyncio.wait_for(asyncio.wrap_future(future), self.request_timeout)
+            return result, with_queue_wait(timings, start)
+        finally:
+            if not future.done():
+                with self.pending_lock:
+                    self.pending.pop(future.request_id, None)
+
+    def detect_many(self, sources, names=None, camera_ids=None, deadline=None):
+        """Submit nhiều ảnh của cùng một request, trả về list (result, timings) hoặc exception theo thứ tự
+
+        Khi queue đầy thì chờ ảnh của chính request này xong bớt rồi submit tiếp, chỉ raise
+        QueueFullError nếu queue bị request khác chiếm hết.
+        """
+        names = names or [None] * len(sources)
+        camera_ids = camera_ids or [None] * len(sources)
+        start = time.perf_counter()
+        timeout_at = time.monotonic() + self.request_timeout
+        futures = []
+        try:
+            for source, name, camera_id in zip(sources, names, camera_ids):
+                while True:
+                    try:
+                        futures.append(self.submit(source, name, camera_id, deadline))
+                        break
+                    except QueueFullError:
+                        outstanding = [f for f in futures if not f.done()]
+                        remaining = timeout_at - time.monotonic()
+                        if not outstanding or remaining <= 0:
+                            raise
+                        wait(outstanding, timeout=remaining, return_when=FIRST_COMPLETED)
+
+            outcomes = []
+            for future in futures:
+                try:
+                    result, timings = future.result(timeout=max(0.0, timeout_at - time.monotonic()))
+                except InvalidImageError as e:
+                    outcomes.append(e)
+                    continue
+                outcomes.append((result, with_queue_wait(timings, start)))
+            return outcomes
+        finally:
+            with self.pending_lock:
+                for future in futures:
+                    if not future.done():
+                        self.pending.pop(future.request_id, None)
+
+    def update_registry(self, add=None, remove=None, replace=None):
+        """Gửi update plate registry tới mọi worker (áp dụng trước batch tiếp theo của worker)"""
+        for control_queue in self.control_queues:
+            control_queue.put(('registry', {'add': add, 'remove': remove, 'replace': replace}))
+
+    def queue_depth(self):
+        try:
+            return self.request_queue.qsize()
+        except NotImplementedError:
+            # macOS không hỗ trợ qsize()
+            return len(self.pending)
+
+    def is_ready(self):
+        return any(r['ready'] for r in self.worker_readiness.values())
+
+    def get_readiness(self):
+        return {
+            'ready': self.is_ready(),
+            'starting': len(self.worker_readiness) < self.num_workers,
+            'workers': {str(worker_id): r for worker_id, r in self.worker_readiness.items()}
+        }
+
+    def stop(self):
+        for _ in self.workers:
+            self.request_queue.put(None)
+        for process in self.workers:
+            process.join(timeout=5)
+        self.result_queue.put(('stop', None, None))
@@ -0,0 +1,141 @@
+"""Timing spans theo stage và metrics dạng Prometheus text exposition
+
+Detector gọi `with stage('localize'):` quanh từng bước; thời gian được cộng vào
+StageTimings của request hiện tại (thread-local). Khi request kết thúc, app gọi
+observe_timings() để đưa vào histogram của process phục vụ HTTP.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+
+
+class StageTimings:
+    """Tổng thời gian (giây) theo stage của một request"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def as_dict(self):
+        return dict(self.stages)
+
+    def as_milliseconds(self):
+        return {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()}
+
+
+@contextmanager
+def collect_timings():
+    """Bật thu thập timing cho thread hiện tại, yield StageTimings"""
+    previous = getattr(_local, 'timings', None)
+    timings = StageTimings()
+    _local.timings = timings
+    start = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        timings.add('total', time.perf_counter() - start)
+        _local.timings = previous
+
+
+@contextmanager
+def stage(name):
+    """Đo một stage; no-op nếu thread không thu thập timing"""
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+class Histogram:
+    """Histogram cumulative theo label 'stage'"""
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label, value):
+        with self.lock:
+            series = self.series.get(label)
+            if series is None:
+                series = self.series[label] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label, series in sorted(self.series.items()):
+                for bound, count in zip(self.buckets, series['counts']):
+                    lines.append(f'{self.name}_bucket{{stage="{label}",le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{stage="{label}",le="+Inf"}} {series["count"]}')
+                lines.append(f'{self.name}_sum{{stage="{label}"}} {series["sum"]:.6f}')
+                lines.append(f'{self.name}_count{{stage="{label}"}} {series["count"]}')
+        return lines
+
+
+class Counter:
+    """Counter theo label tuỳ ý"""
+
+    def __init__(self, name, help_text, label_name):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label, amount=1):
+        with self.lock:
+            self.values[label] = self.values.get(label, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for label, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{{{self.label_name}="{label}"}} {value}')
+        return lines
+
+
+STAGE_LATENCY = Histogram('plate_stage_latency_seconds', 'Latency of each detection pipeline stage')
+REQUESTS = Counter('plate_requests_total', 'Detection requests by outcome', 'outcome')
+
+
+def observe_timings(timings):
+    """Đưa timing của một request (dict stage -> giây) vào histogram"""
+    for name, seconds in timings.items():
+        STAGE_LATENCY.observe(name, seconds)
+
+
+def metric_lines(name, help_text, values, label_name=None, metric_type='gauge'):
+    """Render gauge/counter từ snapshot; values là số hoặc dict label -> số"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    if isinstance(values, dict):
+        for label, value in sorted(values.items()):
+            lines.append(f'{name}{{{label_name}="{label}"}} {value}')
+    else:
+        lines.append(f"{name} {values}")
+    return lines
+
+
+def render(extra_lines=None):
+    lines = STAGE_LATENCY.render() + REQUESTS.render()
+    if extra_lines:
+        lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,113 @@
+"""Recognizer engine cho EasyOCR trên CPU: int8 dynamic quantization (mặc định), fp32 torch hoặc ONNX
+
+Reader phải được tạo với quantize=False (EasyOCR mặc định quantize dynamic recognizer khi
+chạy CPU), nếu không 'torch' không còn là fp32, 'int8' quantize lần hai và export ONNX lỗi.
+Chỉ thay reader.recognizer (CRNN); CRAFT detector giữ nguyên. Engine mới nhận cùng
+tensor (N, 1, H, W) và trả về cùng logits (N, T, C) như model torch nên readtext(),
+recognize() và CTCPlateDecoder dùng được không cần sửa.
+
+    torch       fp32, không quantize
+    int8        torch.quantization.quantize_dynamic trên LSTM + Linear (như EasyOCR mặc định trên CPU)
+    onnx        export recognizer sang ONNX (một lần, cache theo onnx_path), chạy bằng onnxruntime
+    onnx-int8   như onnx, weight được quantize int8 bằng onnxruntime.quantization
+"""
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+RECOGNIZER_ENGINES = ('torch', 'int8', 'onnx', 'onnx-int8')
+
+
+class OnnxRecognizer:
+    """Thay thế reader.recognizer bằng onnxruntime session, giữ interface model(image, text)"""
+
+    def __init__(self, model_path, intra_op_threads=1):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads or 0
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=options,
+                                            providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def eval(self):
+        # EasyOCR gọi model.eval() trước mỗi lần predict
+        return self
+
+    def __call__(self, image, text=None):
+        import torch
+
+        preds = self.session.run(None, {self.input_name: image.detach().cpu().numpy()})[0]
+        return torch.from_numpy(preds)
+
+
+def export_recognizer(recognizer, path, line_height=64):
+    """Export CRNN của EasyOCR sang ONNX với batch và chiều rộng dynamic"""
+    import torch
+
+    class Wrapper(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, image):
+            return self.model(image, None)
+
+    logger.info(f"Exporting OCR recognizer to {path}...")
+    recognizer.eval()
+    dummy = torch.zeros(1, 1, line_height, line_height * 4)
+    # Ghi file tạm rồi rename: nhiều worker có thể export cùng lúc
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.onnx.export(Wrapper(recognizer), dummy, tmp_path, input_names=['image'], output_names=['preds'],
+                      dynamic_axes={'image': {0: 'batch', 3: 'width'}, 'preds': {0: 'batch', 1: 'steps'}},
+                      opset_version=13)
+    os.replace(tmp_path, path)
+
+
+def quantize_onnx(source, path):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    logger.info(f"Quantizing {source} to {path}...")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    quantize_dynamic(source, tmp_path, weight_type=QuantType.QInt8)
+    os.replace(tmp_path, path)
+
+
+def apply_recognizer_engine(reader, engine='int8', onnx_path='ocr_recognizer.onnx', intra_op_threads=1):
+    """Thay reader.recognizer theo engine; trả về engine thực sự dùng ('torch' nếu lỗi)"""
+    if engine not in RECOGNIZER_ENGINES:
+        raise ValueError(f"Unknown OCR engine: {engine} (expected one of {RECOGNIZER_ENGINES})")
+    if engine == 'torch':
+        return engine
+
+    try:
+        if engine == 'int8':
+            import torch
+
+            reader.recognizer = torch.quantization.quantize_dynamic(
+                reader.recognizer, {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8)
+            return engine
+
+        if ort is None:
+            raise RuntimeError("onnxruntime is not installed")
+        if not os.path.exists(onnx_path):
+            export_recognizer(reader.recognizer, onnx_path, getattr(reader, 'imgH', 64))
+        model_path = onnx_path
+        if engine == 'onnx-int8':
+            model_path = os.path.splitext(onnx_path)[0] + '.int8.onnx'
+            if not os.path.exists(model_path):
+                quantize_onnx(onnx_path, model_path)
+        reader.recognizer = OnnxRecognizer(model_path, intra_op_threads)
+        return engine
+
+    except Exception as e:
+        # reader.recognizer chỉ bị thay khi setup thành công nên vẫn là model torch gốc
+        logger.error(f"OCR engine '{engine}' setup failed, falling back to torch fp32: {e}")
+        return 'torch'
@@ -0,0 +1,228 @@
+"""Constrained decoding: giải mã xác suất từng ký tự của recognizer theo format biển số
+
+Thay vì greedy decode rồi sửa chữ/số bằng regex, CTC output của recognizer được
+gom thành lattice các segment (mỗi segment là phân phối xác suất trên charset),
+sau đó Viterbi trên lattice cho từng template (DD-LD, DDD.DD, DDL-DDDDD...) chọn
+chuỗi hợp lệ có xác suất cao nhất.
+"""
+import cv2
+import numpy as np
+import logging
+import math
+
+import plate_grammar
+
+logger = logging.getLogger(__name__)
+
+DIGITS = '0123456789'
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+# Ký tự không thuộc biển số mà segment được phép bỏ qua
+SKIPPABLE = ' -*:_|\'"[]()'
+# Xác suất tối thiểu khi bỏ một segment nhiễu / bỏ dấu chấm bị mất
+SKIP_FLOOR = 0.05
+MISSING_DOT_PROB = 0.5
+
+LINE_TEMPLATES = {
+    'moto_top': plate_grammar.FRAGMENT_TEMPLATES['moto_top'],
+    'moto_bottom': plate_grammar.FRAGMENT_TEMPLATES['moto_bottom'],
+    'car': plate_grammar.FRAGMENT_TEMPLATES['car'],
+}
+
+
+def split_row(gray):
+    """Hàng ít pixel tối nhất trong khoảng 30-70% chiều cao (ranh giới 2 dòng biển xe máy), None nếu ảnh quá thấp"""
+    h = gray.shape[0]
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    profile = binary.sum(axis=1)
+    lo, hi = int(h * 0.3), int(h * 0.7)
+    if hi <= lo:
+        return None
+    return lo + int(np.argmin(profile[lo:hi]))
+
+
+class CTCPlateDecoder:
+    """Chạy recognizer của EasyOCR trực tiếp để lấy xác suất từng frame rồi decode có ràng buộc"""
+
+    def __init__(self, reader, two_line_max_aspect=2.5):
+        self.reader = reader
+        self.two_line_max_aspect = two_line_max_aspect
+        self.characters = list(reader.converter.character)
+        self.img_height = getattr(reader, 'imgH', 64)
+        self.digit_idx, self.letter_idx, self.dot_idx, self.skip_idx = self.build_class_indices()
+
+    def build_class_indices(self):
+        """Index của từng class trong charset (chữ thường gộp vào chữ hoa)"""
+        digit_idx = {d: [] for d in DIGITS}
+        letter_idx = {l: [] for l in LETTERS}
+        dot_idx = []
+        skip_idx = [0]  # CTC blank
+        for i, char in enumerate(self.characters):
+            if char in digit_idx:
+                digit_idx[char].append(i)
+            elif char.upper() in letter_idx:
+                letter_idx[char.upper()].append(i)
+            elif char == '.':
+                dot_idx.append(i)
+            elif char in SKIPPABLE:
+                skip_idx.append(i)
+        return digit_idx, letter_idx, dot_idx, skip_idx
+
+    def line_probs(self, gray):
+        """Softmax output (T, C) của recognizer cho một dòng text grayscale"""
+        import torch
+
+        h, w = gray.shape[:2]
+        new_w = max(self.img_height, int(round(w * self.img_height / float(h))))
+        resized = cv2.resize(gray, (new_w, self.img_height), interpolation=cv2.INTER_AREA)
+        tensor = torch.from_numpy(resized).float().div_(255.0).sub_(0.5).div_(0.5)
+        tensor = tensor.unsqueeze(0).unsqueeze(0)
+
+        with torch.no_grad():
+            preds = self.reader.recognizer(tensor, None)
+            probs = torch.softmax(preds, dim=2)[0]
+        return probs.cpu().numpy()
+
+    def segments(self, probs):
+        """Gom các frame liên tiếp cùng argmax (khác blank) thành segment với phân phối max-pooled"""
+        best = probs.argmax(axis=1)
+        segments = []
+        start = None
+        for t in range(len(best) + 1):
+            same = t < len(best) and start is not None and best[t] == best[start]
+            if same:
+                continue
+            if start is not None and best[start] != 0:
+                segments.append(probs[start:t].max(axis=0))
+            start = t if t < len(best) else None
+        return segments
+
+    def class_prob(self, dist, groups):
+        """(char, prob) tốt nhất trong một nhóm class"""
+        best_char, best_prob = None, 0.0
+        for char, indices in groups.items():
+            prob = float(dist[indices].sum()) if indices else 0.0
+            if prob > best_prob:
+                best_char, best_prob = char, prob
+        return best_char, best_prob
+
+    def viterbi(self, segments, template):
+        """Viterbi trên lattice segment x slot; trả về (value, log_score) hoặc None"""
+        n, m = len(segments), len(template)
+        neg_inf = float('-inf')
+        dp = [[neg_inf] * (m + 1) for _ in range(n + 1)]
+        back = [[None] * (m + 1) for _ in range(n + 1)]
+        dp[0][0] = 0.0
+
+        for i in range(n + 1):
+            for j in range(m + 1):
+                score = dp[i][j]
+                if score == neg_inf:
+                    continue
+
+                if i < n:
+                    # Bỏ segment nhiễu (separator, ký tự rác)
+                    skip = max(float(segments[i][self.skip_idx].sum()), SKIP_FLOOR)
+                    if score + math.log(skip) > dp[i + 1][j]:
+                        dp[i + 1][j] = score + math.log(skip)
+                        back[i + 1][j] = (i, j, None)
+
+                if j < m and template[j] == '.':
+                    # Dấu chấm bị OCR bỏ sót
+                    missing = score + math.log(MISSING_DOT_PROB)
+                    if missing > dp[i][j + 1]:
+                        dp[i][j + 1] = missing
+                        back[i][j + 1] = (i, j, '.')
+
+                if i < n and j < m:
+                    slot = template[j]
+                    if slot == 'D':
+                        char, prob = self.class_prob(segments[i], self.digit_idx)
+                    elif slot == 'L':
+                        char, prob = self.class_prob(segments[i], self.letter_idx)
+                    else:
+                        char, prob = '.', float(segments[i][self.dot_idx].sum()) if self.dot_idx else 0.0
+                    if prob > 0 and score + math.log(prob) > dp[i + 1][j + 1]:
+                        dp[i + 1][j + 1] = score + math.log(prob)
+                        back[i + 1][j + 1] = (i, j, char)
+
+        if dp[n][m] == neg_inf:
+            return None
+
+        chars = []
+        i, j = n, m
+        while (i, j) != (0, 0):
+            pi, pj, char = back[i][j]
+            if char is not None:
+                chars.append(char)
+            i, j = pi, pj
+        value = ''.join(reversed(chars))
+
+        if value[:2] not in plate_grammar.PROVINCE_CODES and 'L' in template:
+            return None
+        return value, dp[n][m]
+
+    def decode_line(self, gray, kind):
+        """Template tốt nhất cho một dòng: (value, confidence) - confidence là geometric mean theo slot"""
+        segments = self.segments(self.line_probs(gray))
+        best = None
+        for template in LINE_TEMPLATES[kind]:
+            decoded = self.viterbi(segments, template)
+            if decoded is None:
+                continue
+            value, log_score = decoded
+            confidence = math.exp(log_score / len(template))
+            if best is None or confidence > best[1]:
+                best = (value, confidence)
+        return best
+
+    def split_lines(self, gray):
+        """Tách biển 2 dòng tại hàng ít pixel tối nhất ở giữa ảnh"""
+        split = split_row(gray)
+        if split is None:
+            return None
+        return gray[:split], gray[split:]
+
+    def decode(self, gray, expected_type=None):
+        """Decode crop grayscale thành {'text', 'confidence', 'type'} hoặc None
+
+        expected_type ('motorcycle' / 'car', theo camera) thay cho việc đoán biển 1 hay 2 dòng theo tỉ lệ khung.
+        """
+        try:
+            h, w = gray.shape[:2]
+            candidates = []
+
+            if expected_type:
+                two_line = expected_type == 'motorcycle'
+            else:
+                two_line = w / float(h) < self.two_line_max_aspect
+
+            if two_line:
+                lines = self.split_lines(gray)
+                if lines is not None:
+                    top = self.decode_line(lines[0], 'moto_top')
+                    bottom = self.decode_line(lines[1], 'moto_bottom')
+                    if top and bottom:
+                        candidates.append({
+                            'text': plate_grammar.format_moto(top[0], bottom[0]),
+                            'confidence': math.sqrt(top[1] * bottom[1]),
+                            'type': 'motorcycle'
+                        })
+            else:
+                car = self.decode_line(gray, 'car')
+                if car:
+                    candidates.append({
+                        'text': plate_grammar.format_car(car[0]),
+                        'confidence': car[1],
+                        'type': 'car_complete'
+                    })
+
+            if not candidates:
+                return None
+
+            best = max(candidates, key=lambda p: p['confidence'])
+            logger.info(f"Constrained decode: '{best['text']}' (conf: {best['confidence']:.2f})")
+            return best
+
+        except Exception as e:
+            logger.error(f"Constrained decoding failed: {e}")
+            return None
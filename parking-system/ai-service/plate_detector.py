@@ -1,103 +1,367 @@
 import cv2
 import numpy as np
-from roboflow import Roboflow
-from ultralytics import YOLO
 import easyocr
-import re
 import logging
 import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import plate_grammar
+from metrics import stage
+from plate_decoder import CTCPlateDecoder, split_row
+from ocr_recognizer import apply_recognizer_engine
+from plate_localizer import ContourPlateLocalizer, create_localizer
+from plate_filter import DetectionFilter
+from result_cache import PerceptualCache, dhash, hamming
+from debug_capture import DebugCapture
+from camera_profiles import CameraProfile, CameraProfiles
+from detection_result import DetectionResult, PlateCandidate
+from plate_registry import PlateRegistry
 
 logger = logging.getLogger(__name__)
 
+# Thứ tự các variant trả về từ preprocess_crop_for_ocr
+VARIANT_NAMES = ('gray', 'clahe', 'otsu', 'adaptive')
+
+INTERPOLATIONS = {
+    'nearest': cv2.INTER_NEAREST,
+    'linear': cv2.INTER_LINEAR,
+    'cubic': cv2.INTER_CUBIC,
+    'area': cv2.INTER_AREA,
+    'lanczos': cv2.INTER_LANCZOS4,
+}
+# Crop đã pad nên chữ chiếm khoảng 60% chiều cao; biển có tỉ lệ khung nhỏ hơn là biển 2 dòng
+TEXT_HEIGHT_RATIO = 0.6
+TWO_LINE_MAX_ASPECT = 2.5
+# Mức giảm tải khi request sắp hết deadline, theo thứ tự tăng dần
+DEGRADATION_TIERS = ('full', 'fewer_variants', 'no_fallback', 'top1_only')
+
+def degrade(tier, other):
+    """Tier nặng hơn trong hai tier"""
+    return max(tier, other, key=DEGRADATION_TIERS.index)
+
+# CLAHE object giữ buffer nội bộ nên mỗi thread dùng một instance
+_thread_local = threading.local()
+
+def thread_clahe():
+    clahe = getattr(_thread_local, 'clahe', None)
+    if clahe is None:
+        clahe = _thread_local.clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+    return clahe
+
+class CropVariants:
+    """Các variant OCR của một crop, tính lazy từ cùng một buffer grayscale đã resize
+    
+    Cascade thường dừng ở variant đầu nên các variant sau chỉ được tính khi cần.
+    """
+    
+    def __init__(self, gray):
+        self.gray = gray
+        self.computed = [gray, None, None, None]
+    
+    def __len__(self):
+        return len(VARIANT_NAMES)
+    
+    def __getitem__(self, i):
+        if self.computed[i] is None:
+            if i == 1:
+                self.computed[i] = thread_clahe().apply(self.gray)
+            elif i == 2:
+                _, self.computed[i] = cv2.threshold(self.gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            else:
+                self.computed[i] = cv2.adaptiveThreshold(self.gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                                         cv2.THRESH_BINARY, 11, 2)
+        return self.computed[i]
+    
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+def configure_threads(intra_op_threads=None, inter_op_threads=None):
+    """Số thread torch / OpenCV của process (ONNX Runtime cấu hình theo session); None = giữ mặc định"""
+    if intra_op_threads:
+        os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+        os.environ['MKL_NUM_THREADS'] = str(intra_op_threads)
+        cv2.setNumThreads(intra_op_threads)
+    try:
+        import torch
+        if intra_op_threads:
+            torch.set_num_threads(intra_op_threads)
+        if inter_op_threads:
+            torch.set_num_interop_threads(inter_op_threads)
+    except ImportError:
+        pass
+    except RuntimeError as e:
+        # set_num_interop_threads chỉ gọi được trước khi torch chạy parallel work đầu tiên
+        logger.warning(f"Could not set torch inter-op threads: {e}")
+
+class InvalidImageError(ValueError):
+    """Input không decode được thành ảnh"""
+    pass
+
 class LicensePlateDetector:
-    def __init__(self):
-        self.rf = None
-        self.roboflow_model = None
-        self.yolo_model = None
+    """Detect + OCR biển số
+    
+    Concurrency: an toàn khi gọi từ nhiều thread (Flask threaded). EasyOCR reader và
+    constrained decoder được giữ trong ocr_instances slot; mỗi lời gọi OCR mượn một slot
+    nên tối đa ocr_instances lời gọi model chạy song song, còn lại chờ. Localizer không
+    thread-safe (cv2.dnn) được serialize bằng localizer_lock. Preprocess, grammar và
+    cache chạy song song không cần lock. Mỗi lời gọi model dùng intra_op_threads thread,
+    nên đặt ocr_instances * intra_op_threads ~ số core để không oversubscribe.
+    """
+    
+    def __init__(self, localizer_backend='onnx', localizer_options=None, ocr_batch_size=16,
+                 variant_order=VARIANT_NAMES, cascade_min_confidence=0.8,
+                 cascade_valid_types=('motorcycle', 'car_complete'),
+                 cache_size=256, cache_ttl=5.0, image_cache_distance=6, crop_cache_distance=2,
+                 plate_confirm_distance=8,
+                 constrained_decoding=True, load_async=False, warmup_dir='hinh', debug_capture=None,
+                 fallback_budget=1.5, fallback_options=None, fallback_full_frame=False,
+                 camera_profiles='camera_profiles.json', ocr_line_height=64, ocr_max_upscale=4.0,
+                 ocr_interpolation='linear', ocr_instances=1, intra_op_threads=None, inter_op_threads=None,
+                 ocr_engine='int8', ocr_onnx_path='ocr_recognizer.onnx', ocr_skip_detection=False,
+                 registry=None, registry_match=False, detection_filter=None, max_candidates=3):
+        self.localizer_backend = localizer_backend
+        self.localizer_options = dict(localizer_options or {})
+        if localizer_backend == 'onnx' and intra_op_threads:
+            self.localizer_options.setdefault('intra_op_threads', intra_op_threads)
+            self.localizer_options.setdefault('inter_op_threads', inter_op_threads or 1)
+        configure_threads(intra_op_threads, inter_op_threads)
+        self.ocr_instances = max(1, ocr_instances)
+        self.ocr_slots = queue.Queue()
+        self.localizer_lock = threading.Lock()
+        self.ocr_batch_size = ocr_batch_size
+        # Recognizer engine (torch / int8 / onnx / onnx-int8), xem ocr_recognizer
+        self.ocr_engine = ocr_engine
+        self.ocr_onnx_path = ocr_onnx_path
+        self.intra_op_threads = intra_op_threads
+        # Crop biển số đã sát: bỏ CRAFT, chỉ chạy recognizer trên từng dòng chữ
+        self.ocr_skip_detection = ocr_skip_detection
+        self.variant_order = [v for v in variant_order if v in VARIANT_NAMES]
+        self.cascade_min_confidence = cascade_min_confidence
+        # Resize crop sao cho mỗi dòng chữ cao ~ocr_line_height (input height của recognizer)
+        self.ocr_line_height = ocr_line_height
+        self.ocr_max_upscale = ocr_max_upscale
+        self.ocr_interpolation = INTERPOLATIONS[ocr_interpolation]
+        self.cascade_valid_types = tuple(cascade_valid_types)
+        self.stats_lock = threading.Lock()
+        # EWMA thời gian OCR một crop trong một pass (giây), để quyết định còn kịp chạy tiếp trước deadline
+        self.pass_seconds = None
+        self.cascade_stats = {'crops': 0, 'wins': {}, 'passes': {}}
+        self.image_cache = PerceptualCache(cache_size, cache_ttl, image_cache_distance)
+        self.crop_cache = PerceptualCache(cache_size, cache_ttl, crop_cache_distance)
+        # Hash cả frame không thấy ký tự biển số: near hit của image cache phải khớp cả vùng biển
+        self.plate_confirm_distance = plate_confirm_distance
+        self.constrained_decoding = constrained_decoding
+        # Fallback: OCR vài ROI hình biển số trong fallback_budget giây thay vì cả frame
+        self.fallback_budget = fallback_budget
+        self.fallback_full_frame = fallback_full_frame
+        self.roi_proposer = ContourPlateLocalizer(**(fallback_options or {}))
+        # Profile theo camera (ROI, độ phân giải, loại biển, variant order), hot-reload từ file
+        self.camera_profiles = CameraProfiles(camera_profiles) if camera_profiles else None
+        # Biển số đang gửi trong bãi (backend push); registry_match: mặc định cho camera không cấu hình
+        self.plate_registry = PlateRegistry(**(registry or {}))
+        self.registry_match = registry_match
+        # Lọc + xếp hạng detection trước OCR (NMS, kích thước, top-k, position prior), camera ghi đè được
+        self.detection_filter_options = dict(detection_filter or {})
+        self.detection_filter = DetectionFilter(**self.detection_filter_options)
+        # Số biển ứng viên tối đa trả về cho mỗi ảnh (details=True)
+        self.max_candidates = max(1, max_candidates)
+        # Debug image capture: tắt mặc định, options xem DebugCapture
+        self.debug_capture = DebugCapture(expand=self.preprocess_crop_for_ocr, **(debug_capture or {}))
+        self.localizer = None
         self.reader = None
-        self.dataset_path = None
-        self.setup_dataset()
-        self.setup_models()
-        self.setup_ocr()
+        self.plate_decoder = None
+        self.warmup_dir = warmup_dir
+        self.components = {
+            name: {'ready': False, 'seconds': None, 'error': None}
+            for name in ('localizer', 'ocr', 'warmup')
+        }
+        self.ready_event = threading.Event()
+        self.startup_seconds = None
+        
+        if load_async:
+            threading.Thread(target=self.start_up, daemon=True).start()
+        else:
+            self.start_up()
     
-    def setup_dataset(self):
-        """Download và setup dataset từ Roboflow"""
-        try:
-            logger.info("Setting up Roboflow dataset...")
-            
-            rf = Roboflow(api_key="************")
-            project = rf.workspace("platedetector-ecjn8").project("my-first-project-icuxt-pp5kj")
-            version = project.version(1)
-            
-            # Setup Roboflow inference model
-            self.roboflow_model = version.model
-            logger.info("Roboflow model setup successfully")
-            
-        except Exception as e:
-            logger.error(f"Roboflow setup failed: {e}")
+    def start_up(self):
+        """Load các component song song, warm-up rồi đánh dấu ready"""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                executor.submit(self.run_component, 'localizer', self.setup_localizer),
+                executor.submit(self.run_component, 'ocr', self.setup_ocr)
+            ]
+            for future in futures:
+                future.result()
+        
+        if self.components['ocr']['ready']:
+            self.run_component('warmup', self.warm_up)
+        
+        self.startup_seconds = time.perf_counter() - start
+        timings = ', '.join(f"{name}={c['seconds']:.2f}s" for name, c in self.components.items()
+                            if c['seconds'] is not None)
+        logger.info(f"Detector startup finished in {self.startup_seconds:.2f}s ({timings})")
+        self.ready_event.set()
     
-    def setup_models(self):
-        """Setup YOLO models"""
+    def run_component(self, name, setup):
+        """Chạy một bước setup, ghi lại thời gian và lỗi (nếu có)"""
+        start = time.perf_counter()
         try:
-            logger.info("Setting up YOLO models...")
-            
-            if os.path.exists('yolov8n.pt'):
-                self.yolo_model = YOLO('yolov8n.pt')
-                logger.info("YOLOv8n model loaded successfully")
-            else:
-                logger.warning("YOLOv8n model not found")
-            
+            setup()
+            self.components[name]['ready'] = True
         except Exception as e:
-            logger.error(f"YOLO model setup failed: {e}")
+            self.components[name]['error'] = str(e)
+            logger.error(f"{name} setup failed: {e}")
+        finally:
+            self.components[name]['seconds'] = time.perf_counter() - start
+    
+    def setup_localizer(self):
+        """Setup plate localizer backend (mặc định: ONNX local trên CPU)"""
+        logger.info(f"Setting up '{self.localizer_backend}' plate localizer...")
+        self.localizer = create_localizer(self.localizer_backend, **self.localizer_options)
+        logger.info(f"Plate localizer '{self.localizer.name}' ready")
     
     def setup_ocr(self):
+        logger.info(f"Setting up EasyOCR ({self.ocr_instances} instance(s))...")
+        for i in range(self.ocr_instances):
+            # quantize=False: EasyOCR mặc định quantize recognizer trên CPU, apply_recognizer_engine quyết định
+            reader = easyocr.Reader(['en'], gpu=False, quantize=False)
+            engine = apply_recognizer_engine(reader, self.ocr_engine, self.ocr_onnx_path,
+                                             self.intra_op_threads or 1)
+            self.components['ocr']['engine'] = engine
+            decoder = None
+            if self.constrained_decoding:
+                try:
+                    decoder = CTCPlateDecoder(reader)
+                except Exception as e:
+                    logger.error(f"Constrained decoder setup failed: {e}")
+            if i == 0:
+                self.reader, self.plate_decoder = reader, decoder
+            self.ocr_slots.put((reader, decoder))
+        logger.info("EasyOCR loaded successfully")
+        if self.plate_decoder is not None:
+            logger.info("Constrained plate decoder ready")
+    
+    @contextmanager
+    def ocr_slot(self):
+        """Mượn một (reader, decoder) cho thread hiện tại, chờ nếu mọi instance đang bận"""
+        slot = self.ocr_slots.get()
+        try:
+            yield slot
+        finally:
+            self.ocr_slots.put(slot)
+    
+    def warm_up(self):
+        """Chạy một inference trên ảnh mẫu (hinh/) để khởi tạo kernel trước request đầu tiên"""
+        samples = []
+        if self.warmup_dir and os.path.isdir(self.warmup_dir):
+            samples = sorted(f for f in os.listdir(self.warmup_dir)
+                             if f.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')))
+        
+        if samples:
+            image = self.load_image(os.path.join(self.warmup_dir, samples[0]))
+        else:
+            image = None
+        if image is None:
+            # Không có ảnh mẫu: dùng ảnh trống để vẫn chạy qua localizer + recognizer
+            image = np.full((480, 640, 3), 255, dtype=np.uint8)
+        
+        with self.debug_capture.suspended():
+            result = self.detect_license_plate_image(image)
+        logger.info(f"Warm-up inference result: {result}")
+        
+        # Không để warm-up ảnh hưởng cache và thống kê
+        self.image_cache.clear()
+        self.crop_cache.clear()
+        with self.stats_lock:
+            self.cascade_stats = {'crops': 0, 'wins': {}, 'passes': {}}
+            # Pass đầu tiên gồm cả khởi tạo kernel, không đại diện cho request thật
+            self.pass_seconds = None
+    
+    def is_ready(self):
+        """Ready khi startup xong và OCR load thành công
+        
+        Localizer lỗi không chặn request: ảnh không có detection đi qua fallback OCR
+        (ROI proposal / cả frame), readiness đánh dấu 'degraded'.
+        """
+        return self.ready_event.is_set() and self.components['ocr']['ready']
+    
+    def get_readiness(self):
+        ready = self.is_ready()
+        return {
+            'ready': ready,
+            'degraded': ready and not self.components['localizer']['ready'],
+            'starting': not self.ready_event.is_set(),
+            'startup_seconds': self.startup_seconds,
+            'components': {name: dict(c) for name, c in self.components.items()}
+        }
+    
+    def load_image(self, source):
+        """Decode ảnh đúng một lần từ path, raw bytes hoặc ndarray"""
         try:
-            logger.info("Setting up EasyOCR...")
-            self.reader = easyocr.Reader(['en'], gpu=False)
-            logger.info("EasyOCR loaded successfully")
+            if source is None:
+                return None
+            if isinstance(source, np.ndarray):
+                return source
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                nparr = np.frombuffer(source, np.uint8)
+                return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            if isinstance(source, str):
+                if not os.path.exists(source):
+                    logger.error(f"Image file not found: {source}")
+                    return None
+                return cv2.imread(source)
+            
+            logger.error(f"Unsupported image source type: {type(source)}")
+            return None
+            
         except Exception as e:
-            logger.error(f"EasyOCR setup failed: {e}")
+            logger.error(f"Image loading failed: {e}")
+            return None
     
-    def detect_with_roboflow(self, image_path):
-        """Detect bằng Roboflow API"""
+    def detect_plate_regions(self, image, profile=None):
+        """Detect vùng biển số bằng localizer backend (trong ROI của camera nếu có profile)"""
         try:
-            if not self.roboflow_model:
+            if not self.localizer:
                 return []
             
-            logger.info("Running Roboflow detection...")
-            predictions = self.roboflow_model.predict(image_path, confidence=30, overlap=30)
-            
-            detections = []
-            if predictions and 'predictions' in predictions.json():
-                for prediction in predictions.json()['predictions']:
-                    x = prediction['x']
-                    y = prediction['y']
-                    w = prediction['width']
-                    h = prediction['height']
-                    confidence = prediction['confidence']
-                    
-                    x1 = int(x - w/2)
-                    y1 = int(y - h/2)
-                    x2 = int(x + w/2)
-                    y2 = int(y + h/2)
-                    
-                    detections.append({
-                        'bbox': [x1, y1, x2, y2],
-                        'confidence': confidence,
-                        'method': 'Roboflow'
-                    })
+            logger.info(f"Running {self.localizer.name} detection...")
+            detections = self.localize(image, profile, self.localizer)
             
-            logger.info(f"Roboflow detected {len(detections)} license plates")
-            return detections
+            kept = self.detection_filter_for(profile).apply(detections, image.shape)
+            logger.info(f"{self.localizer.name} detected {len(detections)} license plates, kept {len(kept)}")
+            return kept
             
         except Exception as e:
-            logger.error(f"Roboflow detection failed: {e}")
+            logger.error(f"{self.localizer.name} detection failed: {e}")
             return []
     
-    def crop_license_plate(self, image_path, bbox):
+    def detection_filter_for(self, profile):
+        if profile is None or not profile.detection_filter:
+            return self.detection_filter
+        return DetectionFilter(**dict(self.detection_filter_options, **profile.detection_filter))
+    
+    def localize(self, image, profile, localizer):
+        """Chạy localizer trên ROI đã downscale theo profile camera, trả bbox theo toạ độ ảnh gốc"""
+        view, transform = profile.localizer_view(image) if profile is not None else (image, None)
+        if getattr(localizer, 'thread_safe', False):
+            detections = localizer.detect(view)
+        else:
+            with self.localizer_lock:
+                detections = localizer.detect(view)
+        if transform is None:
+            return detections
+        
+        for detection in detections:
+            detection['bbox'] = CameraProfile.to_original(detection['bbox'], transform)
+        return detections
+    
+    def crop_license_plate(self, image, bbox):
         """Crop license plate region"""
         try:
-            image = cv2.imread(image_path)
             x1, y1, x2, y2 = bbox
             
             # Add padding
@@ -115,321 +379,375 @@ class LicensePlateDetector:
             logger.error(f"Cropping failed: {e}")
             return None
     
+    def ocr_scale(self, h, w):
+        """Hệ số resize để mỗi dòng chữ cao ~ocr_line_height; 1.0 nếu crop đã gần đúng kích thước"""
+        lines = 2 if w / float(h) < TWO_LINE_MAX_ASPECT else 1
+        target_h = self.ocr_line_height * lines / TEXT_HEIGHT_RATIO
+        scale = min(target_h / h, self.ocr_max_upscale)
+        # Chỉ upscale khi nhỏ hơn target, chỉ downscale khi lớn hơn nhiều (giữ chi tiết nét chữ)
+        if scale > 1.1 or scale < 1 / 1.5:
+            return scale
+        return 1.0
+    
     def preprocess_crop_for_ocr(self, crop):
-        """Preprocess crop cho OCR"""
+        """Preprocess crop cho OCR: grayscale -> resize theo chiều cao dòng chữ -> CropVariants"""
         try:
             if crop is None or crop.size == 0:
                 return []
             
-            # Resize nếu quá nhỏ
-            h, w = crop.shape[:2]
-            if h < 60 or w < 200:
-                scale = max(60/h, 200/w, 4.0)
-                new_w = int(w * scale)
-                new_h = int(h * scale)
-                crop = cv2.resize(crop, (new_w, new_h), interpolation=cv2.INTER_CUBIC)
-            
-            # Convert to grayscale
-            if len(crop.shape) == 3:
-                gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
-            else:
-                gray = crop
-            
-            processed_images = []
+            # Grayscale trước khi resize: resize một channel thay vì ba
+            gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
             
-            # Method 1: Original
-            processed_images.append(gray)
+            h, w = gray.shape[:2]
+            scale = self.ocr_scale(h, w)
+            if scale != 1.0:
+                interpolation = self.ocr_interpolation if scale > 1.0 else cv2.INTER_AREA
+                gray = cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))),
+                                  interpolation=interpolation)
             
-            # Method 2: CLAHE
-            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-            enhanced = clahe.apply(gray)
-            processed_images.append(enhanced)
-            
-            # Method 3: Threshold
-            _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-            processed_images.append(thresh)
-            
-            # Method 4: Adaptive threshold
-            adaptive = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
-            processed_images.append(adaptive)
-            
-            return processed_images
+            return CropVariants(gray)
             
         except Exception as e:
             logger.error(f"Preprocessing failed: {e}")
             return [crop] if crop is not None else []
     
-    def extract_text_from_crop(self, crop, save_path_prefix=""):
-        """Extract text từ crop"""
-        try:
-            if crop is None or crop.size == 0:
-                return None, 0
-            
-            # Save original
-            if save_path_prefix:
-                cv2.imwrite(f"{save_path_prefix}_original.jpg", crop)
-            
-            # Preprocess
-            processed_images = self.preprocess_crop_for_ocr(crop)
-            
-            # Save processed
-            for i, proc_img in enumerate(processed_images):
-                if save_path_prefix:
-                    cv2.imwrite(f"{save_path_prefix}_processed_{i}.jpg", proc_img)
-            
-            # Collect all OCR results
-            all_texts = []
-            
-            for i, img in enumerate(processed_images):
+    def pad_to_shape(self, image, height, width):
+        """Pad ảnh (replicate border) về cùng kích thước để ghép batch"""
+        h, w = image.shape[:2]
+        if h == height and w == width:
+            return image
+        return cv2.copyMakeBorder(image, 0, height - h, 0, width - w, cv2.BORDER_REPLICATE)
+    
+    def text_line_boxes(self, image):
+        """Box [x_min, x_max, y_min, y_max] của từng dòng chữ trong crop biển số (1 hoặc 2 dòng theo tỉ lệ)"""
+        h, w = image.shape[:2]
+        if w / float(h) < TWO_LINE_MAX_ASPECT:
+            gray = image if len(image.shape) == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            split = split_row(gray)
+            if split is not None:
+                return [[0, w, 0, split], [0, w, split, h]]
+        return [[0, w, 0, h]]
+    
+    def ocr_lines(self, images):
+        """OCR crop đã sát biển số không qua CRAFT: recognizer chạy trực tiếp trên từng dòng chữ"""
+        results = []
+        with self.ocr_slot() as (reader, _):
+            for img in images:
                 try:
-                    results = self.reader.readtext(img, detail=1, paragraph=False)
-                    
-                    for bbox, text, confidence in results:
-                        if confidence > 0.1:
-                            all_texts.append({
-                                'text': text.strip(),
-                                'confidence': confidence,
-                                'method': f'processed_{i}'
-                            })
-                            logger.info(f"OCR result: '{text}' (conf: {confidence:.2f})")
-                            
+                    results.append(reader.recognize(img, horizontal_list=self.text_line_boxes(img), free_list=[],
+                                                    batch_size=self.ocr_batch_size, detail=1, paragraph=False))
                 except Exception as e:
-                    logger.error(f"OCR failed on image {i}: {e}")
-            
-            if not all_texts:
-                return None, 0
-            
-            # Cố gắng tạo biển số hoàn chỉnh
-            result = self.construct_license_plate(all_texts)
-            
+                    logger.error(f"OCR failed: {e}")
+                    results.append([])
+        return results
+    
+    def ocr_batch(self, images, detect_text=True):
+        """Chạy EasyOCR theo batch, trả về list kết quả [(bbox, text, conf)] cho từng ảnh
+        
+        Ảnh được pad về cùng kích thước trong mỗi nhóm cùng số channel để CRAFT
+        detector chạy trên một tensor, recognizer gom mọi text box theo batch_size.
+        detect_text=False: ảnh là crop biển số, bỏ CRAFT (xem ocr_lines).
+        """
+        results = [[] for _ in images]
+        if not images or self.reader is None:
+            return results
+        if not detect_text:
+            return self.ocr_lines(images)
+        
+        groups = {}
+        for idx, img in enumerate(images):
+            if img is None or img.size == 0:
+                continue
+            groups.setdefault(img.ndim, []).append(idx)
+        
+        with self.ocr_slot() as (reader, _):
+            for indices in groups.values():
+                height = max(images[i].shape[0] for i in indices)
+                width = max(images[i].shape[1] for i in indices)
+                batch = [self.pad_to_shape(images[i], height, width) for i in indices]
+                
+                try:
+                    batch_results = reader.readtext_batched(
+                        batch, batch_size=self.ocr_batch_size, detail=1, paragraph=False)
+                except Exception as e:
+                    logger.error(f"Batched OCR failed, falling back to sequential: {e}")
+                    batch_results = []
+                    for img in batch:
+                        try:
+                            batch_results.append(reader.readtext(img, detail=1, paragraph=False))
+                        except Exception as inner:
+                            logger.error(f"OCR failed: {inner}")
+                            batch_results.append([])
+                
+                for i, res in zip(indices, batch_results):
+                    results[i] = res
+        
+        return results
+    
+    def extract_text_from_crop(self, crop, profile=None):
+        """Extract text từ crop"""
+        return self.extract_texts_from_crops([crop], [profile])[0]
+    
+    def extract_texts_from_crops(self, crops, profiles=None, use_cache=True):
+        """(text, confidence) cho từng crop, (None, 0) nếu không đọc được"""
+        extracted = []
+        for result in self.read_plates(crops, profiles, use_cache=use_cache):
             if result:
-                return result['text'], result['confidence']
+                extracted.append((result['text'], result['confidence']))
             else:
-                return None, 0
-            
-        except Exception as e:
-            logger.error(f"Text extraction failed: {e}")
-            return None, 0
+                extracted.append((None, 0))
+        return extracted
     
-    def find_motorcycle_pattern(self, texts):
-        """Tìm pattern biển số xe máy với logic linh hoạt hơn"""
+    def read_plates(self, crops, profiles=None, deadlines=None, use_cache=True):
+        """Đọc biển số từ nhiều crop theo cascade các variant
+        
+        Mỗi stage gom variant hiện tại của mọi crop chưa xong vào một OCR batch;
+        crop dừng sớm khi biển số đạt pattern hợp lệ và đủ confidence, hoặc khớp
+        một biển trong plate registry (camera bật registry_match).
+        profiles: CameraProfile của từng crop (variant order + loại biển), None = mặc định.
+        deadlines: time.monotonic() deadline của từng crop; sau pass đầu tiên, crop không còn
+        đủ thời gian cho một pass nữa dừng cascade (kết quả đánh dấu tier 'fewer_variants').
+        use_cache=False: luôn OCR lại (tracker cần các lần đọc độc lập để vote).
+        Trả về dict {'text', 'confidence', 'type', 'variant', ...} hoặc None cho từng crop.
+        """
         try:
-            # Tìm các components với logic mở rộng
-            first_parts = []  # Các phần đầu
-            second_parts = []  # Các phần sau như 452.30
-            
-            for item in texts:
-                text = item['text']
-                conf = item['confidence']
-                
-                # Check for second part patterns (xxx.xx format) - Ưu tiên trước
-                if re.match(r'^\d{3}\.\d{2}$', text):
-                    second_parts.append(item)
-                    logger.info(f"Found second part candidate: '{text}' (conf: {conf:.2f})")
+            profiles = profiles or [None] * len(crops)
+            deadlines = deadlines or [None] * len(crops)
+            truncated = set()
+            orders = [self.variant_order_for(profile) for profile in profiles]
+            expected_types = [profile.plate_type if profile else None for profile in profiles]
+            use_registry = [self.uses_registry(profile) for profile in profiles]
+            
+            variants_per_crop = []
+            for crop in crops:
+                if crop is None or crop.size == 0:
+                    variants_per_crop.append([])
                     continue
                 
-                # Check for first part patterns - MỞ RỘNG để bao gồm "29-61"
-                clean_text = text.replace('-', '').replace('*', '').replace(':', '')
-                
-                # Pattern 1: Standard format like "29G1", "18A"  
-                if re.match(r'^\d{2}[A-Z]{1,2}\d*$', clean_text):
-                    first_parts.append(item)
-                    logger.info(f"Found first part candidate (standard): '{text}' (conf: {conf:.2f})")
-                
-                # Pattern 2: Number format like "29-61" (needs conversion to "29-G1")
-                elif re.match(r'^\d{2}[-*:]\d{1,2}$', text):
-                    first_parts.append(item)
-                    logger.info(f"Found first part candidate (number): '{text}' (conf: {conf:.2f})")
-                
-                # Pattern 3: Pure numbers that could be first part like "2961"
-                elif re.match(r'^\d{4}$', clean_text) and clean_text[:2] in ['18', '29', '30', '43', '51', '59', '72', '73', '74', '75', '77', '78', '79', '80', '81', '82', '83', '85', '86', '88', '89', '90', '92', '93', '94', '95', '97', '98', '99']:
-                    first_parts.append(item)
-                    logger.info(f"Found first part candidate (4-digit): '{text}' (conf: {conf:.2f})")
-            
-            # Sort by confidence
-            first_parts.sort(key=lambda x: x['confidence'], reverse=True)
-            second_parts.sort(key=lambda x: x['confidence'], reverse=True)
-            
-            logger.info(f"Found {len(first_parts)} first parts and {len(second_parts)} second parts")
+                with stage('preprocess'):
+                    variants_per_crop.append(self.preprocess_crop_for_ocr(crop))
+            
+            texts_per_crop = [[] for _ in crops]
+            results = [None for _ in crops]
+            pending = [c for c, variants in enumerate(variants_per_crop) if variants]
+            
+            # Crop gần trùng với crop đã OCR gần đây: dùng lại kết quả. Scope theo các setting
+            # của profile làm thay đổi kết quả (variant order, loại biển, registry match)
+            crop_keys = [None for _ in crops]
+            scopes = [(tuple(orders[c]), expected_types[c], use_registry[c]) for c in range(len(crops))]
+            if use_cache and self.crop_cache.enabled():
+                for c in list(pending):
+                    crop_keys[c] = self.crop_cache.key(variants_per_crop[c][0])
+                    found, cached = self.crop_cache.get(crop_keys[c], scope=scopes[c])
+                    if found:
+                        results[c] = cached
+                        crop_keys[c] = None
+                        pending.remove(c)
+            
+            # Stage 0: decode xác suất recognizer theo format biển số (không cần CRAFT)
+            # Decoder của từng slot có thể None (setup lỗi ở instance đó) nên kiểm tra decoder được mượn
+            offset = 0
+            if self.constrained_decoding and pending:
+                with self.ocr_slot() as (_, decoder):
+                    if decoder is not None:
+                        offset = 1
+                        still_pending = []
+                        for c in pending:
+                            with stage('constrained_decode'):
+                                results[c] = decoder.decode(variants_per_crop[c][0], expected_types[c])
+                            if results[c] is not None:
+                                results[c]['variant'] = 'constrained'
+                            if self.is_confident_plate(results[c]):
+                                self.record_cascade_result('constrained', 1)
+                            elif use_registry[c] and self.snap_to_registry(results, c):
+                                self.record_cascade_result('registry', 1)
+                            else:
+                                still_pending.append(c)
+                        pending = still_pending
             
-            # Nếu có cả 2 phần
-            if first_parts and second_parts:
-                best_first = first_parts[0]
-                best_second = second_parts[0]
+            for step in range(max((len(order) for order in orders), default=0)):
+                owners = [c for c in pending if step < len(orders[c])]
                 
-                first_text = best_first['text']
-                logger.info(f"Processing first part: '{first_text}'")
+                # Luôn chạy ít nhất một pass; các pass sau chỉ khi còn kịp trước deadline
+                if step + offset > 0:
+                    for c in [c for c in owners if not self.has_time_for_pass(deadlines[c], len(owners))]:
+                        self.record_cascade_result('deadline', step + offset)
+                        truncated.add(c)
+                        owners.remove(c)
+                if not owners:
+                    break
                 
-                # Convert first part to proper motorcycle format
-                formatted_first = self.convert_to_motorcycle_format(first_text)
+                # Crop của các camera khác nhau có thể ở variant khác nhau trong cùng stage
+                by_variant = {}
+                for c in owners:
+                    by_variant.setdefault(orders[c][step], []).append(c)
                 
-                if formatted_first:
-                    result_text = f"{formatted_first} {best_second['text']}"
-                    avg_confidence = (best_first['confidence'] + best_second['confidence']) / 2
-                    
-                    logger.info(f"Motorcycle pattern found: '{result_text}' (conf: {avg_confidence:.2f})")
+                for variant, group in by_variant.items():
+                    i = VARIANT_NAMES.index(variant)
+                    start = time.perf_counter()
+                    with stage(f'ocr_{variant}'):
+                        ocr_results = self.ocr_batch([variants_per_crop[c][i] for c in group],
+                                                     detect_text=not self.ocr_skip_detection)
+                    self.observe_pass((time.perf_counter() - start) / len(group))
                     
-                    return {
-                        'text': result_text,
-                        'confidence': avg_confidence,
-                        'type': 'motorcycle'
-                    }
-            
-            # Nếu chỉ có first part, thử convert
-            elif first_parts:
-                best_first = first_parts[0]
-                formatted = self.convert_to_motorcycle_format(best_first['text'])
+                    for c, ocr_result in zip(group, ocr_results):
+                        for bbox, text, confidence in ocr_result:
+                            if confidence > 0.1:
+                                texts_per_crop[c].append({
+                                    'text': text.strip(),
+                                    'confidence': confidence,
+                                    'method': f'processed_{i}'
+                                })
+                                logger.info(f"OCR result: '{text}' (conf: {confidence:.2f})")
                 
-                if formatted:
-                    logger.info(f"Partial motorcycle pattern: '{formatted}'")
-                    return {
-                        'text': formatted,
-                        'confidence': best_first['confidence'] * 0.6,  # Lower confidence
-                        'type': 'motorcycle_partial'
-                    }
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"Motorcycle pattern search failed: {e}")
-            return None
-    
-    def convert_to_motorcycle_format(self, text):
-        """Convert text to standard motorcycle format"""
-        try:
-            clean_text = text.replace('-', '').replace('*', '').replace(':', '')
-            
-            # Case 1: Already proper format like "29G1"
-            match = re.match(r'^(\d{2})([A-Z]{1,2})(\d*)$', clean_text)
-            if match:
-                province = match.group(1)
-                letters = match.group(2)
-                numbers = match.group(3) if match.group(3) else '1'
-                return f"{province}-{letters}{numbers}"
-            
-            # Case 2: Number format like "2961" -> "29-G1"
-            match = re.match(r'^(\d{2})(\d{1,2})$', clean_text)
-            if match:
-                province = match.group(1)
-                series_num = match.group(2)
-                
-                # Convert number to letter series
-                # Common conversions: 61->G1, 51->H1, etc.
-                if series_num == '61':
-                    return f"{province}-G1"
-                elif series_num == '51':
-                    return f"{province}-H1"  
-                elif series_num == '71':
-                    return f"{province}-B1"
-                else:
-                    # Default conversion: first digit as letter position
-                    first_digit = int(series_num[0]) if series_num else 1
-                    second_digit = series_num[1] if len(series_num) > 1 else '1'
-                    
-                    # Map digit to letter (1->A, 2->B, ..., 7->G, etc.)
-                    letter_map = {1: 'A', 2: 'B', 3: 'C', 4: 'D', 5: 'E', 6: 'F', 7: 'G', 8: 'H', 9: 'K'}
-                    letter = letter_map.get(first_digit, 'G')
+                still_pending = []
+                for c in owners:
+                    # Cố gắng tạo biển số hoàn chỉnh, giữ kết quả constrained nếu tốt hơn
+                    if texts_per_crop[c]:
+                        constructed = self.construct_license_plate(texts_per_crop[c], expected_types[c])
+                        if constructed and (results[c] is None or constructed['confidence'] >= results[c]['confidence']):
+                            results[c] = dict(constructed, variant=orders[c][step])
                     
-                    return f"{province}-{letter}{second_digit}"
-            
-            # Case 3: Format like "29-61" (with separator)
-            if '-' in text or '*' in text or ':' in text:
-                parts = re.split(r'[-*:]', text)
-                if len(parts) == 2:
-                    province = parts[0]
-                    series = parts[1]
-                    
-                    if province.isdigit() and len(province) == 2:
-                        if series.isdigit():
-                            # Convert number series to letter
-                            if series == '61':
-                                return f"{province}-G1"
-                            elif series == '51':
-                                return f"{province}-H1"
-                            else:
-                                return f"{province}-G{series[-1]}"
-                        else:
-                            # Already has letters
-                            return f"{province}-{series}"
-            
-            logger.warning(f"Could not convert '{text}' to motorcycle format")
-            return None
+                    passes = step + offset + 1
+                    if self.is_confident_plate(results[c]):
+                        self.record_cascade_result(orders[c][step], passes)
+                    elif use_registry[c] and self.snap_to_registry(results, c, texts_per_crop[c]):
+                        # Biển đang gửi trong bãi: không cần thử thêm variant
+                        self.record_cascade_result('registry', passes)
+                    elif step + 1 == len(orders[c]):
+                        self.record_cascade_result(None, passes)
+                    else:
+                        still_pending.append(c)
+                pending = still_pending
+            
+            for c, key in enumerate(crop_keys):
+                if key is not None and c not in truncated:
+                    self.crop_cache.put(key, results[c], scope=scopes[c])
+            
+            for c in truncated:
+                if results[c] is not None:
+                    results[c] = dict(results[c], tier='fewer_variants')
+            
+            return results
             
         except Exception as e:
-            logger.error(f"Motorcycle format conversion failed: {e}")
+            logger.error(f"Text extraction failed: {e}")
+            return [None for _ in crops]
+    
+    def observe_pass(self, seconds):
+        with self.stats_lock:
+            if self.pass_seconds is None:
+                self.pass_seconds = seconds
+            else:
+                self.pass_seconds = 0.8 * self.pass_seconds + 0.2 * seconds
+    
+    def has_time_for_pass(self, deadline, crops=1):
+        """Còn đủ thời gian cho một OCR pass trên `crops` crop trước deadline (None = không giới hạn)"""
+        if deadline is None:
+            return True
+        return time.monotonic() + crops * (self.pass_seconds or 0.0) <= deadline
+    
+    def uses_registry(self, profile):
+        """Camera có sửa kết quả theo plate registry không (bật ở camera cổng ra)"""
+        if profile is not None and profile.registry_match is not None:
+            return profile.registry_match
+        return self.registry_match
+    
+    def snap_to_registry(self, results, c, fragments=None):
+        """Thay results[c] bằng biển đã đăng ký gần nhất (trong max_distance); True nếu khớp
+        
+        Khi grammar không dựng được biển hợp lệ, thử khớp chuỗi ghép từ các OCR fragment.
+        """
+        if not len(self.plate_registry):
+            return False
+        
+        result = results[c]
+        if result is None and fragments:
+            result = {
+                'text': ''.join(f['text'] for f in fragments),
+                'confidence': float(np.mean([f['confidence'] for f in fragments])),
+                'type': 'fragments'
+            }
+        if result is None:
+            return False
+        
+        with stage('registry'):
+            match = self.plate_registry.match(result['text'])
+        if match is None:
+            return False
+        
+        plate, distance = match
+        snapped = dict(result, text=plate, registry_distance=distance)
+        if distance > 0:
+            snapped['corrected_from'] = result['text']
+            logger.info(f"Registry correction: '{result['text']}' -> '{plate}' (distance {distance})")
+        results[c] = snapped
+        return True
+    
+    def update_registry(self, add=None, remove=None, replace=None):
+        """Cập nhật danh sách biển đang gửi (push từ backend)"""
+        self.plate_registry.apply(add=add, remove=remove, replace=replace)
+        # Kết quả cache có thể đã được sửa theo registry cũ
+        self.image_cache.clear()
+        self.crop_cache.clear()
+    
+    def variant_order_for(self, profile):
+        """Variant order của camera (bỏ tên variant không hợp lệ), mặc định self.variant_order"""
+        if profile is not None and profile.variant_order:
+            order = [v for v in profile.variant_order if v in VARIANT_NAMES]
+            if order:
+                return order
+        return self.variant_order
+    
+    def get_camera_profile(self, camera_id):
+        """CameraProfile của camera (hoặc profile 'default'), None nếu không cấu hình"""
+        if self.camera_profiles is None:
             return None
+        return self.camera_profiles.get(camera_id)
+    
+    def is_confident_plate(self, result):
+        """Stop criteria cho cascade: pattern hợp lệ + confidence đủ cao"""
+        return (result is not None
+                and result['type'] in self.cascade_valid_types
+                and result['confidence'] >= self.cascade_min_confidence)
+    
+    def record_cascade_result(self, variant, passes):
+        """Thống kê variant nào thắng và số OCR pass mỗi crop"""
+        with self.stats_lock:
+            key = variant if variant else 'exhausted'
+            self.cascade_stats['wins'][key] = self.cascade_stats['wins'].get(key, 0) + 1
+            self.cascade_stats['passes'][passes] = self.cascade_stats['passes'].get(passes, 0) + 1
+            self.cascade_stats['crops'] += 1
     
-    def construct_license_plate(self, all_texts):
-        """Tạo biển số với priority và validation cải tiến"""
+    def get_cascade_stats(self):
+        """Snapshot thống kê cascade"""
+        with self.stats_lock:
+            crops = self.cascade_stats['crops']
+            total_passes = sum(k * v for k, v in self.cascade_stats['passes'].items())
+            return {
+                'crops': crops,
+                'wins': dict(self.cascade_stats['wins']),
+                'passes': dict(self.cascade_stats['passes']),
+                'avg_passes': total_passes / crops if crops else 0.0
+            }
+    
+    def get_cache_stats(self):
+        """Hit/miss của image cache và crop cache"""
+        return {
+            'image': self.image_cache.get_stats(),
+            'crop': self.crop_cache.get_stats()
+        }
+    
+    def construct_license_plate(self, all_texts, expected_type=None):
+        """Tạo biển số từ OCR fragments bằng plate grammar (một lượt parse)"""
         try:
             logger.info(f"Constructing license plate from {len(all_texts)} text fragments")
             
-            # Clean và filter texts
-            cleaned_texts = []
-            for item in all_texts:
-                text = item['text'].upper().strip()
-                confidence = item['confidence']
-                
-                # Clean text
-                text = self.clean_text(text)
-                
-                # Keep texts with lower threshold for motorcycle plates
-                if text and len(text) >= 2 and confidence > 0.1:
-                    cleaned_texts.append({
-                        'text': text,
-                        'confidence': confidence,
-                        'method': item['method']
-                    })
-                    logger.info(f"Cleaned text: '{text}' (conf: {confidence:.2f})")
-            
-            if not cleaned_texts:
-                return None
-            
-            patterns = []
-            
-            # Priority 1: Motorcycle patterns (most common)
-            motorcycle_pattern = self.find_motorcycle_pattern(cleaned_texts)
-            if motorcycle_pattern:
-                patterns.append(motorcycle_pattern)
-            
-            # Priority 2: Complete car plates
-            for item in cleaned_texts:
-                text = item['text'].replace(' ', '').replace('-', '')
-                
-                # Complete car format: 18A12345
-                if re.match(r'^\d{2,3}[A-Z]{1,2}\d{3,5}$', text):
-                    match = re.match(r'^(\d{2,3})([A-Z]{1,2})(\d{3,5})$', text)
-                    if match and len(match.group(3)) >= 3:
-                        formatted = f"{match.group(1)}{match.group(2)}-{match.group(3)}"
-                        patterns.append({
-                            'text': formatted,
-                            'confidence': item['confidence'],
-                            'type': 'car_complete'
-                        })
-                        logger.info(f"Complete car pattern: '{formatted}' (conf: {item['confidence']:.2f})")
-            
-            # Priority 3: Other car patterns
-            car_pattern = self.find_car_pattern(cleaned_texts)
-            if car_pattern:
-                patterns.append(car_pattern)
-            
-            if patterns:
-                # Choose best pattern with preference for motorcycle (common in Vietnam)
-                def pattern_score(p):
-                    base_score = p['confidence']
-                    if p['type'] == 'motorcycle':
-                        base_score += 0.3  # High bonus for motorcycle
-                    elif p['type'] == 'car_complete':
-                        base_score += 0.2
-                    elif p['type'] == 'motorcycle_partial':
-                        base_score += 0.1
-                    return base_score
-                
-                best_pattern = max(patterns, key=pattern_score)
+            with stage('grammar'):
+                best_pattern = plate_grammar.parse_fragments(all_texts, expected_type=expected_type)
+            if best_pattern:
                 logger.info(f"Best pattern: '{best_pattern['text']}' (conf: {best_pattern['confidence']:.2f}, type: {best_pattern['type']})")
-                return best_pattern
-            
-            return None
+            return best_pattern
             
         except Exception as e:
             logger.error(f"License plate construction failed: {e}")
@@ -437,96 +755,264 @@ class LicensePlateDetector:
     
     def clean_text(self, text):
         """Clean và normalize text"""
-        try:
-            # Replacements for common OCR errors
-            replacements = {
-                '*': '-', 'I': '1', 'O': '0', 'S': '5', 'B': '8', 'G': '6', 'Z': '2',
-                'D': '0', 'Q': '0', 'U': '0', 'C': '0', 'L': '1', 'J': '1', ':': '-',
-                '"': '', "'": '', '[': '', ']': '', '(': '', ')': '', '|': '1'
-            }
-            
-            for old, new in replacements.items():
-                text = text.replace(old, new)
-            
-            # Remove extra spaces and special chars
-            text = re.sub(r'[^\w\s\-\.]', '', text)
-            text = ' '.join(text.split())
-            
-            return text
-            
-        except Exception as e:
-            logger.error(f"Text cleaning failed: {e}")
-            return text
+        return plate_grammar.clean_text(text)
+    
+    def format_license_plate(self, text):
+        """Format text thành biển số hợp lệ với validation"""
+        return plate_grammar.format_plate(text)
     
     def detect_license_plate(self, image_path):
-        """Main detection method"""
+        """Main detection method (file path wrapper)"""
+        logger.info(f"Processing image: {image_path}")
+        
+        image = self.load_image(image_path)
+        if image is None:
+            return None
+        
+        name = os.path.splitext(os.path.basename(image_path))[0]
+        return self.detect_license_plate_image(image, name=name)
+    
+    def detect_license_plate_bytes(self, image_bytes, name=None, camera_id=None, details=False, deadline=None):
+        """Detect từ raw bytes (JPEG/PNG) - decode một lần duy nhất"""
+        image = self.load_image(image_bytes)
+        if image is None:
+            logger.error("Failed to decode image bytes")
+            return None
+        
+        return self.detect_license_plate_image(image, name=name, camera_id=camera_id, details=details,
+                                               deadline=deadline)
+    
+    def detect_license_plate_image(self, image, name=None, camera_id=None, details=False, deadline=None):
+        """Detect trên ảnh đã decode (BGR ndarray), dùng chung buffer cho mọi bước"""
+        return self.detect_license_plates_batch([image], [name], [camera_id], details, [deadline])[0]
+    
+    def detect_license_plates_batch(self, images, names=None, camera_ids=None, details=False, deadlines=None):
+        """Detect trên nhiều ảnh: localize từng ảnh, OCR mọi crop của mọi ảnh trong một batch
+        
+        deadlines: time.monotonic() deadline của từng ảnh (None = không giới hạn). Giữa các
+        bước, ảnh sắp hết thời gian được chuyển xuống tier rẻ hơn (DEGRADATION_TIERS): ít
+        variant hơn, bỏ fallback, chỉ OCR detection có confidence cao nhất.
+        
+        Trả về biển số (str) cho từng ảnh, hoặc với details=True DetectionResult (tối đa
+        max_candidates biển ứng viên kèm bbox, điểm localizer / OCR, variant, loại biển).
+        """
+        names = names or [None] * len(images)
+        camera_ids = camera_ids or [None] * len(images)
+        deadlines = deadlines or [None] * len(images)
+        results = [None] * len(images)
+        candidates = [[] for _ in images]
+        tiers = ['full'] * len(images)
+        
         try:
-            logger.info(f"Processing image: {image_path}")
-            
-            if not os.path.exists(image_path):
-                logger.error(f"Image file not found: {image_path}")
-                return None
-            
-            # Detect license plate regions
-            detections = self.detect_with_roboflow(image_path)
-            
-            if not detections:
-                logger.warning("No license plate regions detected")
-                return self.fallback_full_image_ocr(image_path)
-            
-            # Process each detection
-            best_result = None
-            best_confidence = 0
-            
-            for i, detection in enumerate(detections):
-                bbox = detection['bbox']
-                det_confidence = detection['confidence']
-                method = detection['method']
+            profiles = [self.get_camera_profile(camera_id) for camera_id in camera_ids]
+            
+            # Crop every detection from the shared buffers
+            crops = []
+            crop_profiles = []
+            owners = []
+            needs_fallback = []
+            image_keys = [None] * len(images)
+            processed = set()
+            for n, (image, name) in enumerate(zip(images, names)):
+                if image is None or image.size == 0:
+                    logger.error("Empty image")
+                    continue
                 
-                logger.info(f"Processing detection {i+1}: {method} (conf: {det_confidence:.2f})")
+                # Frame gần trùng (xe dừng ở barrier, backend retry) của cùng camera: trả kết quả cache
+                if self.image_cache.enabled():
+                    with stage('cache'):
+                        key = self.image_cache.key(image)
+                        found, cached = self.image_cache.get(
+                            key, scope=camera_ids[n],
+                            confirm=lambda entry: self.same_plate_region(image, *entry))
+                    if found:
+                        cached = cached[0]
+                        logger.info(f"Image cache hit: '{cached.license_plate if cached else None}'")
+                        results[n] = cached
+                        continue
+                    image_keys[n] = key
                 
-                # Crop license plate
-                crop = self.crop_license_plate(image_path, bbox)
-                if crop is None:
-                    continue
+                processed.add(n)
+                
+                # Detect license plate regions (trong ROI / độ phân giải của camera nếu có profile)
+                with stage('localize'):
+                    detections = self.detect_plate_regions(image, profiles[n])
                 
-                # Save for debugging
-                base_name = os.path.splitext(os.path.basename(image_path))[0]
-                save_prefix = f"uploads/{base_name}_crop_{method}_{det_confidence:.2f}"
+                if not detections:
+                    logger.warning("No license plate regions detected")
+                    needs_fallback.append(n)
+                    continue
                 
-                # Extract text
-                license_text, ocr_confidence = self.extract_text_from_crop(crop, save_prefix)
+                # Không kịp OCR mọi detection: chỉ giữ detection có priority cao nhất (đã sắp xếp)
+                if len(detections) > 1 and not self.has_time_for_pass(deadlines[n], len(detections)):
+                    logger.warning(f"Deadline near, OCR top-1 of {len(detections)} detections")
+                    detections = detections[:1]
+                    tiers[n] = degrade(tiers[n], 'top1_only')
                 
-                if license_text:
-                    combined_confidence = (det_confidence + ocr_confidence) / 2
-                    logger.info(f"Extracted: '{license_text}' (combined: {combined_confidence:.2f})")
+                for i, detection in enumerate(detections):
+                    bbox = detection['bbox']
+                    det_confidence = detection['confidence']
+                    method = detection['method']
                     
-                    if combined_confidence > best_confidence:
-                        best_result = license_text
-                        best_confidence = combined_confidence
+                    logger.info(f"Processing detection {i+1}: {method} (conf: {det_confidence:.2f})")
+                    
+                    # Crop license plate
+                    with stage('crop'):
+                        crop = self.crop_license_plate(image, bbox)
+                    if crop is None:
+                        continue
+                    
+                    crops.append(crop)
+                    crop_profiles.append(profiles[n])
+                    owners.append((n, detection))
             
-            if best_result:
-                logger.info(f"FINAL RESULT: '{best_result}' (confidence: {best_confidence:.2f})")
-                return best_result
-            else:
-                return self.fallback_full_image_ocr(image_path)
+            # Extract text (một OCR batch cho mọi crop)
+            plates = self.read_plates(crops, crop_profiles, [deadlines[n] for n, _ in owners])
+            
+            for crop, (n, detection), plate in zip(crops, owners, plates):
+                # Lấy mẫu crop để debug (ghi ở background thread)
+                self.debug_capture.submit(f"{names[n] or 'frame'}_crop_{detection['method']}", crop,
+                                          plate['confidence'] if plate else None, plate['text'] if plate else None)
                 
+                if plate:
+                    tiers[n] = degrade(tiers[n], plate.get('tier', 'full'))
+                    combined_confidence = (detection['confidence'] + plate['confidence']) / 2
+                    logger.info(f"Extracted: '{plate['text']}' (combined: {combined_confidence:.2f})")
+                    candidates[n].append(self.plate_candidate(plate, detection['bbox'], detection['confidence'],
+                                                              combined_confidence, self.localizer.name))
+            
+            for n in sorted(processed):
+                if candidates[n]:
+                    results[n] = DetectionResult(self.top_candidates(candidates[n]))
+                    logger.info(f"FINAL RESULT: '{results[n].license_plate}' "
+                                f"(confidence: {results[n].confidence:.2f})")
+                elif n not in needs_fallback:
+                    needs_fallback.append(n)
+            
+            cropped = {n for n, _ in owners}
+            for n in needs_fallback:
+                if not self.has_time_for_pass(deadlines[n]):
+                    logger.warning("Deadline near, skipping fallback")
+                    tiers[n] = degrade(tiers[n], 'no_fallback')
+                    continue
+                with stage('fallback'):
+                    results[n] = self.fallback_roi_ocr(images[n], profiles[n], deadlines[n])
+                if results[n]:
+                    tiers[n] = degrade(tiers[n], results[n].tier)
+                if n not in cropped:
+                    self.debug_capture.submit(f"{names[n] or 'frame'}_full", images[n], None,
+                                              results[n].license_plate if results[n] else None)
+            
+            for n in processed:
+                if results[n]:
+                    results[n].tier = tiers[n]
+            
+            # Kết quả bị giảm tải không được cache: request sau có thể đủ thời gian đọc tốt hơn
+            for n, key in enumerate(image_keys):
+                if key is not None and tiers[n] == 'full':
+                    entry = (results[n], self.plate_region_hash(images[n], results[n]))
+                    self.image_cache.put(key, entry, scope=camera_ids[n])
+            
         except Exception as e:
             logger.error(f"Detection failed: {e}")
+        
+        if details:
+            return results
+        return [result.license_plate if result else None for result in results]
+    
+    def plate_region_hash(self, image, result):
+        """dHash vùng biển số của kết quả chính, None nếu không có biển"""
+        if result is None or result.best.bbox is None:
+            return None
+        x1, y1, x2, y2 = result.best.bbox
+        region = image[y1:y2, x1:x2]
+        if region.size == 0:
+            return None
+        return dhash(region)
+    
+    def same_plate_region(self, image, result, plate_hash):
+        """Near hit của image cache: vùng biển số của frame mới phải gần trùng vùng đã đọc
+        
+        Frame không đọc được biển (result None) chỉ dùng lại khi trùng hash tuyệt đối.
+        """
+        if plate_hash is None:
+            return False
+        region_hash = self.plate_region_hash(image, result)
+        return region_hash is not None and hamming(region_hash, plate_hash) <= self.plate_confirm_distance
+    
+    def plate_candidate(self, plate, bbox, detector_score, confidence, method):
+        """Ứng viên của một ảnh từ kết quả read_plates của một vùng"""
+        return PlateCandidate(plate['text'], confidence, detector_score, plate['confidence'], bbox,
+                              f"{method}+OCR", variant=plate.get('variant'), plate_type=plate.get('type'),
+                              corrected_from=plate.get('corrected_from'),
+                              registry_distance=plate.get('registry_distance'))
+    
+    def top_candidates(self, candidates):
+        """max_candidates ứng viên tốt nhất, mỗi biển số chỉ giữ vùng có confidence cao nhất"""
+        best = {}
+        for candidate in candidates:
+            current = best.get(candidate.license_plate)
+            if current is None or candidate.confidence > current.confidence:
+                best[candidate.license_plate] = candidate
+        return sorted(best.values(), key=lambda c: c.confidence, reverse=True)[:self.max_candidates]
+    
+    def fallback_roi_ocr(self, image, profile=None, request_deadline=None):
+        """Fallback khi không đọc được biển: OCR lần lượt các ROI ứng viên cho tới khi hết time budget
+        
+        Budget bị cắt theo request_deadline (nếu có). Trả về DetectionResult hoặc None.
+        """
+        try:
+            deadline = time.monotonic() + self.fallback_budget
+            if request_deadline is not None:
+                deadline = min(deadline, request_deadline)
+            with stage('roi_proposal'):
+                candidates = self.localize(image, profile, self.roi_proposer)
+            logger.info(f"Fallback ROI candidates: {len(candidates)}")
+            
+            found = []
+            tier = 'full'
+            for candidate in candidates:
+                if time.monotonic() >= deadline:
+                    logger.warning("Fallback time budget exhausted")
+                    break
+                
+                crop = self.crop_license_plate(image, candidate['bbox'])
+                if crop is None:
+                    continue
+                # Cascade của từng ROI cũng bị giới hạn bởi fallback budget
+                plate = self.read_plates([crop], [profile], [deadline])[0]
+                if plate:
+                    # Chỉ báo giảm tải khi do request deadline, không phải fallback budget thông thường
+                    if request_deadline is not None and deadline == request_deadline:
+                        tier = degrade(tier, plate.get('tier', 'full'))
+                    found.append(self.plate_candidate(plate, candidate['bbox'], candidate['confidence'],
+                                                      plate['confidence'], self.roi_proposer.name))
+                    if plate['confidence'] >= self.cascade_min_confidence or 'registry_distance' in plate:
+                        break
+            
+            if found:
+                result = DetectionResult(self.top_candidates(found), tier)
+                logger.info(f"Fallback ROI result: '{result.license_plate}' (conf: {result.confidence:.2f})")
+                return result
+            
+            if self.fallback_full_frame and time.monotonic() < deadline:
+                return self.fallback_full_image_ocr(image)
+            return None
+            
+        except Exception as e:
+            logger.error(f"ROI fallback failed: {e}")
             return None
     
-    def fallback_full_image_ocr(self, image_path):
-        """Fallback OCR on full image"""
+    def fallback_full_image_ocr(self, image):
+        """Fallback OCR on full image (chậm, chỉ dùng khi bật fallback_full_frame)"""
         try:
             logger.info("Using fallback full image OCR...")
             
-            image = cv2.imread(image_path)
             processed_images = self.preprocess_crop_for_ocr(image)
+            ocr_results = self.ocr_batch(processed_images)
             
-            for i, proc_img in enumerate(processed_images):
+            for i, results in enumerate(ocr_results):
                 try:
-                    results = self.reader.readtext(proc_img, detail=1, paragraph=False)
-                    
                     for bbox, text, confidence in results:
                         if confidence > 0.2:
                             # Try to construct license plate from this text
@@ -535,7 +1021,10 @@ class LicensePlateDetector:
                             
                             if result:
                                 logger.info(f"Fallback result: '{result['text']}'")
-                                return result['text']
+                                h, w = image.shape[:2]
+                                plate = dict(result, variant=VARIANT_NAMES[i])
+                                return DetectionResult([self.plate_candidate(plate, [0, 0, w, h], None,
+                                                                             result['confidence'], 'FULL')])
                                 
                 except Exception as e:
                     logger.error(f"Fallback OCR {i} failed: {e}")
@@ -545,117 +1034,3 @@ class LicensePlateDetector:
         except Exception as e:
             logger.error(f"Fallback failed: {e}")
             return None
-    
-    def find_car_pattern(self, texts):
-        """Tìm pattern biển số ô tô với validation tốt hơn"""
-        try:
-            for item in texts:
-                text = item['text'].replace(' ', '').replace('-', '')
-                
-                # Car pattern: 2-3 digits + 1-2 letters + 3-5 digits
-                match = re.match(r'^(\d{2,3})([A-Z]{1,2})(\d{3,5})$', text)
-                if match:
-                    province = match.group(1)
-                    letters = match.group(2)
-                    numbers = match.group(3)
-                    
-                    # Validate reasonable ranges
-                    if len(numbers) >= 3 and len(numbers) <= 5:
-                        result_text = f"{province}{letters}-{numbers}"
-                        logger.info(f"Car pattern found: '{result_text}'")
-                        
-                        return {
-                            'text': result_text,
-                            'confidence': item['confidence'],
-                            'type': 'car'
-                        }
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"Car pattern search failed: {e}")
-            return None
-
-    def format_license_plate(self, text):
-        """Format text thành biển số hợp lệ với validation"""
-        try:
-            # Remove spaces
-            clean = text.replace(' ', '')
-            
-            # Car format: digits + letters + digits
-            car_match = re.match(r'^(\d{2,3})([A-Z]{1,2})(\d{3,5})$', clean)
-            if car_match:
-                province = car_match.group(1)
-                letters = car_match.group(2)
-                numbers = car_match.group(3)
-                
-                # Validate complete numbers (not truncated)
-                if len(numbers) >= 3:
-                    return f"{province}{letters}-{numbers}"
-            
-            # Motorcycle format: digits + letters + numbers + . + numbers
-            moto_match = re.match(r'^(\d{2})([A-Z]{1,2})(\d{1,3})\.(\d{2})$', clean)
-            if moto_match:
-                province = moto_match.group(1)
-                letters = moto_match.group(2)
-                first_nums = moto_match.group(3)
-                second_nums = moto_match.group(4)
-                
-                return f"{province}-{letters}{first_nums} {first_nums}.{second_nums}"
-            
-            # Try to extract from mixed formats
-            numbers = re.findall(r'\d+', text)
-            letters = re.findall(r'[A-Z]+', text)
-            
-            if len(numbers) >= 2 and len(letters) >= 1:
-                province = numbers[0]
-                letter_part = letters[0]
-                
-                # Check if we have enough digits for car plate
-                if len(numbers) > 1:
-                    last_number = numbers[-1]
-                    if len(last_number) >= 3:  # Car format
-                        return f"{province}{letter_part}-{last_number}"
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"License plate formatting failed: {e}")
-            return None
-
-    def find_longest_valid_pattern(self, texts):
-        """Tìm text dài nhất có pattern hợp lý"""
-        try:
-            valid_texts = []
-            
-            for item in texts:
-                text = item['text']
-                
-                # Check if text has reasonable license plate characteristics
-                if (len(text) >= 5 and 
-                    re.search(r'\d', text) and  # Has digits
-                    (re.search(r'[A-Z]', text) or re.search(r'[-*:.]', text))):  # Has letters or separators
-                    
-                    valid_texts.append(item)
-            
-            if valid_texts:
-                # Sort by length and confidence
-                longest = max(valid_texts, key=lambda x: len(x['text']) + x['confidence'])
-                
-                # Try to format it properly
-                text = longest['text']
-                formatted = self.format_license_plate(text)
-                
-                if formatted:
-                    logger.info(f"Longest valid pattern: '{formatted}'")
-                    return {
-                        'text': formatted,
-                        'confidence': longest['confidence'] * 0.8,  # Slightly lower confidence
-                        'type': 'longest'
-                    }
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"Longest pattern search failed: {e}")
-            return None
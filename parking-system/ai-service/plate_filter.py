@@ -0,0 +1,70 @@
+"""Hậu xử lý detection của localizer trước OCR: chỉ OCR biển số quan trọng ở cổng
+
+Localizer trả mọi box trên ngưỡng (Roboflow: conf 30%, overlap 30%), gồm box trùng nhau
+giữa các class và biển nhỏ ở xa. DetectionFilter lần lượt:
+
+    min_score        bỏ box có confidence thấp
+    nms_threshold    NMS không phân biệt class (0 = tắt)
+    min_width/height bỏ biển nhỏ hơn kích thước này (pixel ảnh gốc), OCR không đọc được
+    position_prior   [x, y] tỉ lệ trong frame nơi xe dừng ở barrier; box càng xa càng bị
+                     giảm priority theo gaussian với prior_sigma (tỉ lệ kích thước frame)
+    top_k            giữ k box có priority (confidence x diện tích x position prior) cao nhất
+
+Kết quả sắp xếp theo priority giảm dần nên detection đầu tiên là biển đáng đọc nhất.
+"""
+import math
+
+import cv2
+import numpy as np
+
+
+class DetectionFilter:
+    """Lọc + xếp hạng detections {'bbox', 'confidence', 'method'}, mặc định không bỏ box nào"""
+
+    def __init__(self, min_score=0.0, nms_threshold=0.0, min_width=0, min_height=0, top_k=0,
+                 position_prior=None, prior_sigma=0.25):
+        if position_prior is not None and len(position_prior) != 2:
+            raise ValueError(f"position_prior must be [x, y]: {position_prior}")
+        if prior_sigma <= 0:
+            raise ValueError(f"prior_sigma must be positive: {prior_sigma}")
+        self.min_score = min_score
+        self.nms_threshold = nms_threshold
+        self.min_width = min_width
+        self.min_height = min_height
+        self.top_k = top_k
+        self.position_prior = position_prior
+        self.prior_sigma = prior_sigma
+
+    def priority(self, detection, width, height):
+        x1, y1, x2, y2 = detection['bbox']
+        area = max(0, x2 - x1) * max(0, y2 - y1) / float(width * height)
+        score = detection['confidence'] * area
+        if self.position_prior is not None:
+            dx = (x1 + x2) / 2.0 / width - self.position_prior[0]
+            dy = (y1 + y2) / 2.0 / height - self.position_prior[1]
+            score *= math.exp(-(dx * dx + dy * dy) / (2 * self.prior_sigma ** 2))
+        return score
+
+    def suppress(self, detections):
+        """NMS trên mọi box (không theo class), giữ box confidence cao hơn"""
+        boxes = [[x1, y1, x2 - x1, y2 - y1] for x1, y1, x2, y2 in (d['bbox'] for d in detections)]
+        scores = [d['confidence'] for d in detections]
+        indices = cv2.dnn.NMSBoxes(boxes, scores, 0.0, self.nms_threshold)
+        return [detections[i] for i in np.array(indices).flatten()]
+
+    def apply(self, detections, image_shape):
+        """Detections (toạ độ ảnh gốc) sau khi lọc, sắp theo priority giảm dần"""
+        height, width = image_shape[:2]
+        kept = [
+            d for d in detections
+            if d['confidence'] >= self.min_score
+            and d['bbox'][2] - d['bbox'][0] >= self.min_width
+            and d['bbox'][3] - d['bbox'][1] >= self.min_height
+        ]
+        if self.nms_threshold > 0 and len(kept) > 1:
+            kept = self.suppress(kept)
+
+        kept.sort(key=lambda d: self.priority(d, width, height), reverse=True)
+        if self.top_k > 0:
+            kept = kept[:self.top_k]
+        return kept
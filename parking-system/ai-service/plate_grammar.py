@@ -0,0 +1,241 @@
+"""Grammar biển số Việt Nam: bảng tra, template và parser cho OCR fragments
+
+Mọi bảng/pattern được build một lần khi import. parse_fragments() đọc toàn bộ
+fragments của một crop trong một lượt và trả về biển số tốt nhất.
+"""
+import re
+import sys
+import time
+
+# Mã tỉnh/thành hợp lệ (2 số đầu)
+PROVINCE_CODES = frozenset(
+    ['11', '12'] +
+    [str(code) for code in range(14, 39)] +
+    ['40', '41', '43'] +
+    [str(code) for code in range(47, 87)] +
+    ['88', '89', '90', '92', '93', '94', '95', '97', '98', '99']
+)
+
+# Chuẩn hoá dấu câu / ký tự rác (áp dụng cho mọi vị trí)
+PUNCT_TABLE = str.maketrans({
+    '*': '-', ':': '-', '_': '-', ',': '.',
+    '"': None, "'": None, '[': None, ']': None, '(': None, ')': None,
+    '|': 'I'
+})
+NON_PLATE_CHARS_RE = re.compile(r'[^A-Z0-9\s\-\.]')
+SEPARATORS_RE = re.compile(r'[\s\-]+')
+
+# Nhầm lẫn ký tự theo vị trí: chỉ áp dụng trong ô số (D) hoặc ô chữ (L)
+DIGIT_SLOT_CONFUSIONS = {
+    'O': '0', 'Q': '0', 'D': '0', 'U': '0', 'C': '0',
+    'I': '1', 'L': '1', 'J': '1', 'T': '1',
+    'Z': '2', 'S': '5', 'G': '6', 'B': '8', 'A': '4'
+}
+LETTER_SLOT_CONFUSIONS = {
+    '0': 'D', '2': 'Z', '4': 'A', '5': 'S', '6': 'G', '7': 'T', '8': 'B'
+}
+
+# Template theo slot: D = chữ số, L = chữ cái, '.' = dấu chấm
+FRAGMENT_TEMPLATES = {
+    # Dòng trên biển xe máy: 29G1, 29AB
+    'moto_top': ('DDLD', 'DDLL'),
+    # Dòng dưới biển xe máy: 452.30
+    'moto_bottom': ('DDD.DD',),
+    # Biển xe máy đọc thành một dòng
+    'moto_full': ('DDLDDDD.DD', 'DDLLDDD.DD', 'DDLDDDDDD'),
+    # Biển ô tô: 30A12345, 51F123.45, 30LD1234
+    'car': ('DDLDDD.DD', 'DDLDDDDD', 'DDLDDDD', 'DDLDDD',
+            'DDLLDDD.DD', 'DDLLDDDDD', 'DDLLDDDD', 'DDLLDDD'),
+}
+TEMPLATES_BY_LENGTH = {}
+for _kind, _templates in FRAGMENT_TEMPLATES.items():
+    for _template in _templates:
+        TEMPLATES_BY_LENGTH.setdefault(len(_template), []).append((_kind, _template))
+
+# Bonus khi chọn pattern (ưu tiên biển xe máy - phổ biến ở Việt Nam)
+TYPE_BONUS = {
+    'motorcycle': 0.3,
+    'car_complete': 0.2,
+    'motorcycle_partial': 0.1,
+}
+# Mỗi ký tự phải sửa theo confusion table làm giảm confidence
+COERCION_PENALTY = 0.95
+
+
+def clean_text(text):
+    """Upper-case, chuẩn hoá dấu câu và khoảng trắng (không đổi chữ <-> số)"""
+    text = text.upper().translate(PUNCT_TABLE)
+    text = NON_PLATE_CHARS_RE.sub('', text)
+    return ' '.join(text.split())
+
+
+def match_template(text, template):
+    """Ép text vào template theo từng vị trí; trả về (value, số ký tự đã sửa) hoặc None"""
+    out = []
+    coerced = 0
+    for char, slot in zip(text, template):
+        if slot == 'D':
+            if char.isdigit():
+                out.append(char)
+            elif char in DIGIT_SLOT_CONFUSIONS:
+                out.append(DIGIT_SLOT_CONFUSIONS[char])
+                coerced += 1
+            else:
+                return None
+        elif slot == 'L':
+            if char.isalpha():
+                out.append(char)
+            elif char in LETTER_SLOT_CONFUSIONS:
+                out.append(LETTER_SLOT_CONFUSIONS[char])
+                coerced += 1
+            else:
+                return None
+        elif char != slot:
+            return None
+        else:
+            out.append(char)
+
+    value = ''.join(out)
+    if value[:2] not in PROVINCE_CODES and template[:2] == 'DD' and 'L' in template:
+        return None
+    return value, coerced
+
+
+def classify(token):
+    """Tất cả cách đọc hợp lệ của một token: list (kind, value, coerced)"""
+    matches = []
+    for kind, template in TEMPLATES_BY_LENGTH.get(len(token), ()):
+        matched = match_template(token, template)
+        if matched:
+            matches.append((kind, matched[0], matched[1]))
+    return matches
+
+
+def split_series(value):
+    """'29G1' -> ('29', 'G1')"""
+    return value[:2], value[2:]
+
+
+def format_car(value):
+    """'30A12345' -> '30A-12345', '51F123.45' -> '51F-123.45'"""
+    letters_end = 3 if not value[3].isalpha() else 4
+    return f"{value[:letters_end]}-{value[letters_end:]}"
+
+
+def format_moto(top, bottom=None):
+    province, series = split_series(top)
+    if bottom:
+        return f"{province}-{series} {bottom}"
+    return f"{province}-{series}"
+
+
+def format_moto_full(value):
+    """'29G145230' / '29G1452.30' -> '29-G1 452.30'"""
+    series_end = 4
+    bottom = value[series_end:]
+    if '.' not in bottom:
+        bottom = f"{bottom[:3]}.{bottom[3:]}"
+    return format_moto(value[:series_end], bottom)
+
+
+def tokens_of(text):
+    """Token để classify: cả chuỗi bỏ separator và từng phần tách bởi khoảng trắng/gạch"""
+    compact = SEPARATORS_RE.sub('', text)
+    tokens = [compact]
+    parts = [p for p in SEPARATORS_RE.split(text) if p]
+    if len(parts) > 1:
+        tokens.extend(parts)
+        # '29-G1' -> '29G1' nằm trong compact; '29-G1 452.30' cần thêm dòng trên
+        top = [p for p in text.split() if p]
+        if len(top) > 1:
+            tokens.append(SEPARATORS_RE.sub('', top[0]))
+    return tokens
+
+
+def parse_fragments(fragments, min_confidence=0.1, expected_type=None):
+    """Parse mọi OCR fragment trong một lượt, trả về {'text', 'confidence', 'type'} hoặc None
+
+    fragments: list dict có 'text' và 'confidence' (output của OCR)
+    expected_type: 'motorcycle' / 'car' (theo camera) - ưu tiên cách đọc đúng loại biển nếu có
+    """
+    best = {}
+
+    def offer(kind, value, confidence):
+        current = best.get(kind)
+        if current is None or confidence > current[1]:
+            best[kind] = (value, confidence)
+
+    for item in fragments:
+        confidence = item['confidence']
+        text = clean_text(item['text'])
+        if len(text) < 2 or confidence <= min_confidence:
+            continue
+
+        for token in tokens_of(text):
+            for kind, value, coerced in classify(token):
+                offer(kind, value, confidence * COERCION_PENALTY ** coerced)
+
+    candidates = []
+    if 'moto_full' in best:
+        value, confidence = best['moto_full']
+        candidates.append({'text': format_moto_full(value), 'confidence': confidence, 'type': 'motorcycle'})
+    if 'moto_top' in best and 'moto_bottom' in best:
+        (top, top_conf), (bottom, bottom_conf) = best['moto_top'], best['moto_bottom']
+        candidates.append({'text': format_moto(top, bottom), 'confidence': (top_conf + bottom_conf) / 2,
+                           'type': 'motorcycle'})
+    elif 'moto_top' in best:
+        top, top_conf = best['moto_top']
+        candidates.append({'text': format_moto(top), 'confidence': top_conf * 0.6,
+                           'type': 'motorcycle_partial'})
+    if 'car' in best:
+        value, confidence = best['car']
+        candidates.append({'text': format_car(value), 'confidence': confidence, 'type': 'car_complete'})
+
+    if not candidates:
+        return None
+
+    if expected_type:
+        preferred = [p for p in candidates if p['type'].startswith(expected_type)]
+        candidates = preferred or candidates
+
+    return max(candidates, key=lambda p: p['confidence'] + TYPE_BONUS[p['type']])
+
+
+def format_plate(text):
+    """Format một chuỗi đơn lẻ thành biển số hợp lệ, None nếu không khớp grammar"""
+    result = parse_fragments([{'text': text, 'confidence': 1.0}], min_confidence=0.0)
+    if result and result['type'] != 'motorcycle_partial':
+        return result['text']
+    return None
+
+
+def benchmark(corpus, repeat=100):
+    """Đo tốc độ parse trên corpus: list các list OCR string (fragments của một crop)"""
+    batches = [[{'text': text, 'confidence': 0.9} for text in fragments] for fragments in corpus]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for fragments in batches:
+            parse_fragments(fragments)
+    elapsed = time.perf_counter() - start
+    total = repeat * len(batches)
+    return {
+        'crops': total,
+        'seconds': elapsed,
+        'us_per_crop': elapsed / total * 1e6 if total else 0.0
+    }
+
+
+if __name__ == '__main__':
+    # Usage: python plate_grammar.py corpus.txt  (mỗi dòng một crop, fragments cách nhau bởi '|')
+    if len(sys.argv) < 2:
+        print("Usage: python plate_grammar.py corpus.txt [repeat]")
+        sys.exit(1)
+
+    with open(sys.argv[1], encoding='utf-8') as f:
+        corpus = [line.rstrip('\n').split('|') for line in f if line.strip()]
+
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    for fragments in corpus[:10]:
+        result = parse_fragments([{'text': t, 'confidence': 0.9} for t in fragments])
+        print(f"{fragments} -> {result['text'] if result else None}")
+    print(benchmark(corpus, repeat))
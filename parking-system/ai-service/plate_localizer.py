@@ -0,0 +1,326 @@
+import cv2
+import numpy as np
+import json
+import logging
+import math
+import os
+
+logger = logging.getLogger(__name__)
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+# Trained YOLOv8 plate weights (xem runs/detect/license_plate_train)
+DEFAULT_PT_CANDIDATES = [
+    'license_plate.pt',
+    os.path.join('..', '..', 'runs', 'detect', 'license_plate_train', 'weights', 'best.pt'),
+]
+
+
+class OnnxPlateLocalizer:
+    """Local YOLO plate detector exported to ONNX, chạy trên CPU (onnxruntime hoặc OpenCV DNN)"""
+
+    name = 'ONNX'
+
+    def __init__(self, model_path='license_plate.onnx', input_size=640, conf_threshold=0.3,
+                 nms_threshold=0.3, intra_op_threads=1, inter_op_threads=1,
+                 engine='auto', providers=None, pt_candidates=None):
+        self.model_path = model_path
+        self.input_size = int(input_size)
+        self.conf_threshold = conf_threshold
+        self.nms_threshold = nms_threshold
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.engine = engine
+        self.providers = providers or ['CPUExecutionProvider']
+        self.pt_candidates = pt_candidates or DEFAULT_PT_CANDIDATES
+        self.session = None
+        self.net = None
+        self.input_name = None
+        # cv2.dnn.Net giữ buffer trong object: caller phải serialize detect()
+        self.thread_safe = False
+        self.load()
+
+    def export_from_pt(self):
+        """Export trained .pt weights sang ONNX nếu chưa có file .onnx"""
+        for pt_path in self.pt_candidates:
+            if not os.path.exists(pt_path):
+                continue
+
+            logger.info(f"Exporting {pt_path} to ONNX (imgsz={self.input_size})...")
+            from ultralytics import YOLO
+            exported = YOLO(pt_path).export(format='onnx', imgsz=self.input_size, simplify=True)
+            if exported and os.path.exists(exported) and exported != self.model_path:
+                os.replace(exported, self.model_path)
+            return os.path.exists(self.model_path)
+
+        return False
+
+    def load(self):
+        """Load ONNX model vào onnxruntime session hoặc cv2.dnn"""
+        if not os.path.exists(self.model_path) and not self.export_from_pt():
+            raise FileNotFoundError(f"ONNX plate model not found: {self.model_path}")
+
+        if self.engine in ('auto', 'onnxruntime') and ort is not None:
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = self.intra_op_threads
+            options.inter_op_num_threads = self.inter_op_threads
+            options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self.session = ort.InferenceSession(self.model_path, sess_options=options,
+                                                providers=self.providers)
+            self.input_name = self.session.get_inputs()[0].name
+            # InferenceSession.run() an toàn khi gọi đồng thời từ nhiều thread
+            self.thread_safe = True
+            logger.info(f"ONNX localizer loaded with onnxruntime ({self.providers})")
+        elif self.engine in ('auto', 'opencv'):
+            self.net = cv2.dnn.readNetFromONNX(self.model_path)
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            logger.info("ONNX localizer loaded with OpenCV DNN")
+        else:
+            raise RuntimeError(f"ONNX engine '{self.engine}' is not available")
+
+    def letterbox(self, image):
+        """Resize giữ tỉ lệ + pad về input_size x input_size"""
+        h, w = image.shape[:2]
+        scale = min(self.input_size / h, self.input_size / w)
+        new_w, new_h = int(round(w * scale)), int(round(h * scale))
+
+        resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        pad_x = (self.input_size - new_w) // 2
+        pad_y = (self.input_size - new_h) // 2
+
+        canvas = np.full((self.input_size, self.input_size, 3), 114, dtype=np.uint8)
+        canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = resized
+        return canvas, scale, pad_x, pad_y
+
+    def forward(self, blob):
+        if self.session is not None:
+            return self.session.run(None, {self.input_name: blob})[0]
+
+        self.net.setInput(blob)
+        return self.net.forward()
+
+    def detect(self, image):
+        """Trả về list detections {'bbox', 'confidence', 'method'} theo toạ độ ảnh gốc"""
+        canvas, scale, pad_x, pad_y = self.letterbox(image)
+        blob = cv2.dnn.blobFromImage(canvas, 1 / 255.0, swapRB=True)
+
+        # YOLOv8 output: (1, 4 + num_classes, num_anchors)
+        output = self.forward(blob)[0].T
+        class_scores = output[:, 4:]
+        scores = class_scores.max(axis=1)
+        keep = scores >= self.conf_threshold
+        if not np.any(keep):
+            return []
+
+        boxes = output[keep, :4]
+        scores = scores[keep]
+
+        # cx, cy, w, h (input space) -> x, y, w, h (original image)
+        xywh = np.empty_like(boxes)
+        xywh[:, 0] = (boxes[:, 0] - boxes[:, 2] / 2 - pad_x) / scale
+        xywh[:, 1] = (boxes[:, 1] - boxes[:, 3] / 2 - pad_y) / scale
+        xywh[:, 2] = boxes[:, 2] / scale
+        xywh[:, 3] = boxes[:, 3] / scale
+
+        indices = cv2.dnn.NMSBoxes(xywh.tolist(), scores.tolist(),
+                                   self.conf_threshold, self.nms_threshold)
+
+        h, w = image.shape[:2]
+        detections = []
+        for idx in np.array(indices).flatten():
+            x, y, bw, bh = xywh[idx]
+            x1 = int(max(0, x))
+            y1 = int(max(0, y))
+            x2 = int(min(w, x + bw))
+            y2 = int(min(h, y + bh))
+            detections.append({
+                'bbox': [x1, y1, x2, y2],
+                'confidence': float(scores[idx]),
+                'method': self.name
+            })
+
+        return detections
+
+
+class ContourPlateLocalizer:
+    """Sinh ROI hình biển số bằng xử lý ảnh cổ điển (blackhat + gradient + contour), không cần model
+
+    Dùng cho fallback khi localizer chính không tìm thấy biển: chỉ OCR vài ROI thay vì cả frame.
+    confidence là điểm heuristic (mật độ nét chữ x độ tương phản x kích thước), chỉ dùng để xếp hạng.
+    """
+
+    name = 'ROI'
+    thread_safe = True
+
+    def __init__(self, work_width=640, max_candidates=5, min_aspect=1.0, max_aspect=6.0,
+                 min_area_ratio=0.002, max_area_ratio=0.2, nms_threshold=0.3):
+        self.work_width = work_width
+        self.max_candidates = max_candidates
+        self.min_aspect = min_aspect
+        self.max_aspect = max_aspect
+        self.min_area_ratio = min_area_ratio
+        self.max_area_ratio = max_area_ratio
+        self.nms_threshold = nms_threshold
+        self.blackhat_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (13, 5))
+        self.close_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (17, 5))
+        self.open_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+        # Nối hai dòng của biển xe máy
+        self.two_line_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 15))
+
+    def detect(self, image):
+        h, w = image.shape[:2]
+        scale = min(1.0, self.work_width / float(w))
+        small = cv2.resize(image, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA) if scale < 1.0 else image
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+        # Ký tự tối trên nền sáng: blackhat làm nổi nét chữ, gradient theo x giữ các nét dọc
+        blackhat = cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, self.blackhat_kernel)
+        grad = np.absolute(cv2.Sobel(blackhat, cv2.CV_32F, 1, 0, ksize=3))
+        grad = cv2.normalize(grad, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+        _, strokes = cv2.threshold(grad, 0, 1, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+        # Nối các ký tự thành khối rồi lọc theo hình dạng
+        grad = cv2.GaussianBlur(grad, (5, 5), 0)
+        closed = cv2.morphologyEx(grad, cv2.MORPH_CLOSE, self.close_kernel)
+        _, mask = cv2.threshold(closed, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.open_kernel, iterations=2)
+
+        two_line = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, self.two_line_kernel)
+
+        contours = []
+        for candidate_mask in (mask, two_line):
+            contours.extend(cv2.findContours(candidate_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0])
+        frame_area = float(gray.shape[0] * gray.shape[1])
+        boxes, scores = [], []
+        for contour in contours:
+            x, y, bw, bh = cv2.boundingRect(contour)
+            area = bw * bh
+            if not (self.min_area_ratio <= area / frame_area <= self.max_area_ratio):
+                continue
+            if not (self.min_aspect <= bw / float(bh) <= self.max_aspect):
+                continue
+            density = float(strokes[y:y + bh, x:x + bw].mean())
+            contrast = float(gray[y:y + bh, x:x + bw].std()) / 128.0
+            boxes.append([x, y, bw, bh])
+            scores.append(density * contrast * math.sqrt(area / frame_area))
+
+        if not boxes:
+            return []
+
+        indices = cv2.dnn.NMSBoxes(boxes, scores, 0.0, self.nms_threshold)
+        indices = sorted(np.array(indices).flatten(), key=lambda i: scores[i], reverse=True)
+
+        detections = []
+        for idx in indices[:self.max_candidates]:
+            x, y, bw, bh = boxes[idx]
+            detections.append({
+                'bbox': [int(x / scale), int(y / scale), int(min(w, (x + bw) / scale)), int(min(h, (y + bh) / scale))],
+                'confidence': float(scores[idx]),
+                'method': self.name
+            })
+        return detections
+
+
+class RoboflowPlateLocalizer:
+    """Roboflow hosted model (remote HTTP call mỗi frame)"""
+
+    name = 'Roboflow'
+    thread_safe = True
+
+    def __init__(self, api_key=None, workspace="platedetector-ecjn8",
+                 project="my-first-project-icuxt-pp5kj", version=1,
+                 conf_threshold=0.3, nms_threshold=0.3):
+        from roboflow import Roboflow
+
+        rf = Roboflow(api_key=api_key or os.environ.get('ROBOFLOW_API_KEY', "************"))
+        self.model = rf.workspace(workspace).project(project).version(version).model
+        self.conf_threshold = conf_threshold
+        self.nms_threshold = nms_threshold
+
+    def detect(self, image):
+        predictions = self.model.predict(image,
+                                         confidence=int(self.conf_threshold * 100),
+                                         overlap=int(self.nms_threshold * 100))
+
+        detections = []
+        if predictions and 'predictions' in predictions.json():
+            for prediction in predictions.json()['predictions']:
+                x = prediction['x']
+                y = prediction['y']
+                w = prediction['width']
+                h = prediction['height']
+
+                detections.append({
+                    'bbox': [int(x - w/2), int(y - h/2), int(x + w/2), int(y + h/2)],
+                    'confidence': prediction['confidence'],
+                    'method': self.name
+                })
+
+        return detections
+
+
+class StaticPlateLocalizer:
+    """Trả bbox đã gán nhãn sẵn (bench/labels.json) - không cần model hay network
+
+    Ảnh được nhận diện bằng perceptual hash nên dùng được cho ảnh đã decode lại.
+    Ảnh không có nhãn bbox (ví dụ crop trong uploads/) được coi là cả ảnh là biển số.
+    """
+
+    name = 'STATIC'
+    thread_safe = True
+
+    def __init__(self, labels=os.path.join('bench', 'labels.json'), max_distance=8, full_image_fallback=True):
+        from result_cache import dhash, hamming
+
+        self.dhash = dhash
+        self.hamming = hamming
+        self.max_distance = max_distance
+        self.full_image_fallback = full_image_fallback
+        self.boxes = []
+
+        with open(labels, encoding='utf-8') as f:
+            entries = json.load(f)
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(labels)))
+        for entry in entries:
+            image = cv2.imread(os.path.join(base_dir, entry['path']))
+            if image is None:
+                logger.warning(f"Static localizer: cannot read {entry['path']}")
+                continue
+            self.boxes.append((dhash(image), entry.get('bboxes') or []))
+
+    def detect(self, image):
+        key = self.dhash(image)
+        best, best_distance = None, self.max_distance + 1
+        for candidate, bboxes in self.boxes:
+            distance = self.hamming(key, candidate)
+            if distance < best_distance:
+                best, best_distance = bboxes, distance
+
+        if not best:
+            if not self.full_image_fallback:
+                return []
+            h, w = image.shape[:2]
+            best = [[0, 0, w, h]]
+
+        return [{'bbox': list(bbox), 'confidence': 1.0, 'method': self.name} for bbox in best]
+
+
+LOCALIZER_BACKENDS = {
+    'onnx': OnnxPlateLocalizer,
+    'roboflow': RoboflowPlateLocalizer,
+    'static': StaticPlateLocalizer,
+    'contour': ContourPlateLocalizer,
+}
+
+
+def create_localizer(backend='onnx', **options):
+    """Factory cho plate localizer backend"""
+    if backend not in LOCALIZER_BACKENDS:
+        raise ValueError(f"Unknown localizer backend: {backend}")
+
+    return LOCALIZER_BACKENDS[backend](**options)
@@ -0,0 +1,135 @@
+"""Index các biển số đang gửi trong bãi để sửa kết quả OCR confidence thấp
+
+Backend đẩy danh sách biển số (xe vào: add, xe ra: remove, đồng bộ toàn bộ: replace).
+Biển số được chuẩn hoá thành chuỗi A-Z0-9 và index theo deletion neighborhood: mỗi biển
+được lưu dưới mọi chuỗi có được khi xoá tối đa max_distance ký tự. Hai chuỗi có edit
+distance <= max_distance luôn có chung ít nhất một chuỗi như vậy, nên lookup chỉ tra
+vài chục key rồi tính edit distance trên số ít ứng viên. (BK-tree duyệt gần hết cây với
+biển số: chuỗi ngắn cùng format nên khoảng cách giữa các biển tập trung ở 6-8.)
+"""
+import logging
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+NON_ALNUM_RE = re.compile(r'[^A-Z0-9]')
+
+
+def normalize_plate(text):
+    return NON_ALNUM_RE.sub('', (text or '').upper())
+
+
+def edit_distance(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def deletions(key, max_distance):
+    """Mọi chuỗi có được khi xoá tối đa max_distance ký tự của key (gồm cả key)"""
+    found = {key}
+    frontier = {key}
+    for _ in range(max_distance):
+        frontier = {word[:i] + word[i + 1:] for word in frontier for i in range(len(word))}
+        found |= frontier
+    return found
+
+
+class PlateRegistry:
+    """Tập biển số đã đăng ký (đang gửi), thread-safe, cập nhật từng phần"""
+
+    def __init__(self, max_distance=1, min_length=6):
+        self.max_distance = max_distance
+        # Chuỗi quá ngắn (đọc được một phần biển) dễ khớp nhầm
+        self.min_length = min_length
+        self.plates = {}
+        self.index = {}
+        self.lock = threading.Lock()
+        self.stats = {'lookups': 0, 'matches': 0, 'corrections': 0, 'ambiguous': 0}
+
+    def __len__(self):
+        return len(self.plates)
+
+    def add(self, plates):
+        with self.lock:
+            for plate in plates:
+                self.insert(plate)
+
+    def insert(self, plate):
+        """Thêm một biển (caller giữ lock)"""
+        key = normalize_plate(plate)
+        if not key:
+            return
+        if key not in self.plates:
+            for variant in deletions(key, self.max_distance):
+                self.index.setdefault(variant, set()).add(key)
+        self.plates[key] = plate
+
+    def remove(self, plates):
+        with self.lock:
+            for plate in plates:
+                key = normalize_plate(plate)
+                if self.plates.pop(key, None) is None:
+                    continue
+                for variant in deletions(key, self.max_distance):
+                    keys = self.index.get(variant)
+                    if keys is not None:
+                        keys.discard(key)
+                        if not keys:
+                            del self.index[variant]
+
+    def replace(self, plates):
+        with self.lock:
+            self.plates = {}
+            self.index = {}
+            for plate in plates:
+                self.insert(plate)
+
+    def apply(self, add=None, remove=None, replace=None):
+        """Áp dụng một lần push từ backend; replace (nếu có) chạy trước add/remove"""
+        if replace is not None:
+            self.replace(replace)
+        if remove:
+            self.remove(remove)
+        if add:
+            self.add(add)
+        logger.info(f"Plate registry updated: {len(self.plates)} plates")
+
+    def match(self, text):
+        """(biển đã đăng ký, distance) gần nhất với text trong max_distance
+
+        None nếu không có, hoặc có nhiều biển cùng khoảng cách (không đoán giữa hai xe).
+        """
+        key = normalize_plate(text)
+        if len(key) < self.min_length:
+            return None
+
+        with self.lock:
+            self.stats['lookups'] += 1
+            candidates = set()
+            for variant in deletions(key, self.max_distance):
+                candidates |= self.index.get(variant, set())
+            found = [(edit_distance(key, candidate), candidate) for candidate in candidates]
+            found = [(distance, candidate) for distance, candidate in found if distance <= self.max_distance]
+            if not found:
+                return None
+            best = min(distance for distance, _ in found)
+            nearest = [candidate for distance, candidate in found if distance == best]
+            if len(nearest) > 1:
+                self.stats['ambiguous'] += 1
+                return None
+            self.stats['matches'] += 1
+            if best > 0:
+                self.stats['corrections'] += 1
+            return self.plates[nearest[0]], best
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, plates=len(self.plates), max_distance=self.max_distance)
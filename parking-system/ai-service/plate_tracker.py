@@ -0,0 +1,237 @@
+import itertools
+import logging
+import time
+from collections import defaultdict
+
+from result_cache import dhash, hamming
+
+logger = logging.getLogger(__name__)
+
+
+def bbox_iou(a, b):
+    """IoU của hai bbox [x1, y1, x2, y2]"""
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    if inter == 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return inter / float(area_a + area_b - inter)
+
+
+def centroid_distance(a, b):
+    """Khoảng cách tâm hai bbox, chuẩn hoá theo đường chéo bbox a"""
+    ax, ay = (a[0] + a[2]) / 2.0, (a[1] + a[3]) / 2.0
+    bx, by = (b[0] + b[2]) / 2.0, (b[1] + b[3]) / 2.0
+    diag = max(1.0, ((a[2] - a[0]) ** 2 + (a[3] - a[1]) ** 2) ** 0.5)
+    return (((ax - bx) ** 2 + (ay - by) ** 2) ** 0.5) / diag
+
+
+class PlateTrack:
+    """Một biển số được theo dõi qua nhiều frame, vote từng ký tự theo confidence"""
+
+    def __init__(self, track_id, bbox, now=None):
+        self.track_id = track_id
+        self.bbox = bbox
+        # Thời điểm (monotonic) track được thấy lần cuối: motion gating bỏ frame tĩnh nên
+        # không đếm được số frame bị miss
+        self.last_seen = time.monotonic() if now is None else now
+        self.observations = 0
+        self.length_votes = defaultdict(float)
+        self.char_votes = defaultdict(lambda: defaultdict(lambda: defaultdict(float)))
+        self.emitted = None
+        # Track đã chốt: hash crop lúc verify gần nhất, số frame từ đó, và track thách thức
+        # gom các lần đọc khác biển đã chốt (xe khác dừng cùng vị trí)
+        self.crop_hash = None
+        self.frames_since_verify = 0
+        self.challenger = None
+
+    def add_reading(self, text, confidence):
+        """Cộng vote cho độ dài chuỗi và từng vị trí ký tự"""
+        weight = max(confidence, 1e-3)
+        self.observations += 1
+        self.length_votes[len(text)] += weight
+        positions = self.char_votes[len(text)]
+        for i, char in enumerate(text):
+            positions[i][char] += weight
+
+    def consensus(self):
+        """Trả về (text, agreement) - agreement là trung bình tỉ lệ vote thắng mỗi vị trí"""
+        if not self.length_votes:
+            return None, 0.0
+
+        length = max(self.length_votes, key=self.length_votes.get)
+        positions = self.char_votes[length]
+        chars = []
+        agreements = []
+        for i in range(length):
+            votes = positions[i]
+            char = max(votes, key=votes.get)
+            chars.append(char)
+            agreements.append(votes[char] / sum(votes.values()))
+
+        length_agreement = self.length_votes[length] / sum(self.length_votes.values())
+        agreement = length_agreement * sum(agreements) / len(agreements)
+        return ''.join(chars), agreement
+
+    def is_stable(self):
+        return self.emitted is not None
+
+
+class PlateTracker:
+    """Liên kết bbox biển số qua các frame (IoU/centroid) và gộp kết quả OCR bằng voting"""
+
+    def __init__(self, detector, iou_threshold=0.3, max_centroid_distance=0.5, max_idle_seconds=3.0,
+                 min_observations=3, agreement_threshold=0.75, reverify_frames=10, reverify_distance=24):
+        self.detector = detector
+        self.iou_threshold = iou_threshold
+        self.max_centroid_distance = max_centroid_distance
+        # Track không được thấy quá max_idle_seconds bị xoá (xe đã đi / stream đứng yên)
+        self.max_idle_seconds = max_idle_seconds
+        self.min_observations = min_observations
+        self.agreement_threshold = agreement_threshold
+        # Track đã chốt được OCR lại sau reverify_frames frame hoặc khi dHash crop đổi quá reverify_distance bit
+        self.reverify_frames = reverify_frames
+        self.reverify_distance = reverify_distance
+        self.tracks = []
+        self.ids = itertools.count(1)
+        self.stats = {'frames': 0, 'ocr_crops': 0, 'skipped_stable': 0, 'reverified': 0,
+                      'replaced': 0, 'expired': 0, 'emitted': 0}
+
+    def associate(self, detections, now=None):
+        """Greedy matching theo IoU, fallback centroid distance; trả về list (track, detection)"""
+        now = time.monotonic() if now is None else now
+        # Xoá track quá hạn trước khi match để xe mới không bị gán vào track cũ
+        alive = [track for track in self.tracks if now - track.last_seen <= self.max_idle_seconds]
+        self.stats['expired'] += len(self.tracks) - len(alive)
+        self.tracks = alive
+
+        pairs = []
+        for t, track in enumerate(self.tracks):
+            for d, detection in enumerate(detections):
+                iou = bbox_iou(track.bbox, detection['bbox'])
+                distance = centroid_distance(track.bbox, detection['bbox'])
+                if iou >= self.iou_threshold or distance <= self.max_centroid_distance:
+                    pairs.append((iou, -distance, t, d))
+
+        pairs.sort(reverse=True)
+        used_tracks, used_detections = set(), set()
+        matches = []
+        for _, _, t, d in pairs:
+            if t in used_tracks or d in used_detections:
+                continue
+            used_tracks.add(t)
+            used_detections.add(d)
+            matches.append((self.tracks[t], detections[d]))
+
+        for d, detection in enumerate(detections):
+            if d not in used_detections:
+                track = PlateTrack(next(self.ids), detection['bbox'], now)
+                self.tracks.append(track)
+                matches.append((track, detection))
+
+        return matches
+
+    def needs_verify(self, track, crop_hash):
+        """Track đã chốt cần OCR lại: đủ số frame hoặc crop đã đổi (có thể là xe khác)"""
+        track.frames_since_verify += 1
+        # Đang có vote khác biển đã chốt: OCR tiếp tới khi challenger đủ đồng thuận hoặc bị huỷ
+        if track.challenger is not None or track.frames_since_verify >= self.reverify_frames:
+            return True
+        return track.crop_hash is None or hamming(track.crop_hash, crop_hash) > self.reverify_distance
+
+    def agreed_plate(self, track):
+        """(plate, agreement) nếu track đạt đồng thuận, ngược lại None"""
+        plate, agreement = track.consensus()
+        if track.observations < self.min_observations or agreement < self.agreement_threshold:
+            return None
+        return plate, agreement
+
+    def emit(self, track, plate, agreement):
+        """Chốt kết quả của track"""
+        track.emitted = plate
+        self.stats['emitted'] += 1
+        logger.info(f"Track {track.track_id} consolidated: '{plate}' "
+                    f"(agreement: {agreement:.2f}, frames: {track.observations})")
+        return {
+            'license_plate': plate,
+            'agreement': agreement,
+            'frames': track.observations,
+            'track_id': track.track_id
+        }
+
+    def verify(self, track, text, confidence):
+        """Lần đọc lại của track đã chốt; vote khác biển đã chốt thì track thách thức thay thế track cũ"""
+        if text == track.emitted:
+            track.challenger = None
+            return None
+
+        if track.challenger is None:
+            track.challenger = PlateTrack(next(self.ids), track.bbox, track.last_seen)
+        challenger = track.challenger
+        challenger.add_reading(text, confidence)
+        agreed = self.agreed_plate(challenger)
+        if agreed is None:
+            return None
+        if agreed[0] == track.emitted:
+            # Đồng thuận lại đúng biển cũ (đọc sai tạm thời)
+            track.challenger = None
+            return None
+
+        logger.info(f"Track {track.track_id} ('{track.emitted}') replaced by track {challenger.track_id}")
+        self.stats['replaced'] += 1
+        challenger.bbox, challenger.last_seen = track.bbox, track.last_seen
+        challenger.crop_hash = track.crop_hash
+        self.tracks[self.tracks.index(track)] = challenger
+        return self.emit(challenger, *agreed)
+
+    def process_frame(self, image, now=None):
+        """Xử lý một frame, trả về list plate mới đạt đồng thuận (mỗi track emit một lần)"""
+        now = time.monotonic() if now is None else now
+        self.stats['frames'] += 1
+        detections = self.detector.detect_plate_regions(image)
+        matches = self.associate(detections, now)
+
+        crops = []
+        owners = []
+        for track, detection in matches:
+            track.bbox = detection['bbox']
+            track.last_seen = now
+            crop = self.detector.crop_license_plate(image, detection['bbox'])
+            if crop is None:
+                continue
+
+            if track.is_stable():
+                crop_hash = dhash(crop)
+                if not self.needs_verify(track, crop_hash):
+                    self.stats['skipped_stable'] += 1
+                    continue
+                self.stats['reverified'] += 1
+                track.crop_hash = crop_hash
+                track.frames_since_verify = 0
+            crops.append(crop)
+            owners.append(track)
+
+        emitted = []
+        if not crops:
+            return emitted
+
+        self.stats['ocr_crops'] += len(crops)
+        # Bỏ qua crop cache: các frame gần giống nhau phải là các lần đọc độc lập, nếu không vote vô nghĩa
+        readings = self.detector.extract_texts_from_crops(crops, use_cache=False)
+        for track, crop, (text, confidence) in zip(owners, crops, readings):
+            if not text:
+                continue
+            if track.is_stable():
+                result = self.verify(track, text, confidence)
+            else:
+                track.add_reading(text, confidence)
+                agreed = self.agreed_plate(track)
+                result = self.emit(track, *agreed) if agreed else None
+                if result is not None:
+                    track.crop_hash = dhash(crop)
+            if result is not None:
+                emitted.append(result)
+
+        return emitted
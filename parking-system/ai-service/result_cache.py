@@ -0,0 +1,116 @@
+import cv2
+import numpy as np
+import threading
+import time
+from collections import OrderedDict
+
+
+def dhash(image, hash_size=16):
+    """Difference hash (hash_size * hash_size bit) của ảnh BGR hoặc grayscale"""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class PerceptualCache:
+    """LRU + TTL cache keyed bằng perceptual hash, chấp nhận sai khác tới max_distance bit
+
+    scope (vd. camera id) tách các entry: near match chỉ so với entry cùng scope.
+    """
+
+    def __init__(self, max_entries=256, ttl=5.0, max_distance=6, hash_size=16):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.rejected = 0
+        self.misses = 0
+
+    def enabled(self):
+        return self.max_entries > 0
+
+    def key(self, image):
+        return dhash(image, self.hash_size)
+
+    def get(self, key, scope=None, confirm=None):
+        """Trả về (found, value)
+
+        confirm(value) -> bool: kiểm tra thêm cho near match (không trùng hash tuyệt đối),
+        vd. so hash vùng biển số mà hash cả frame không phân biệt được.
+        """
+        if not self.enabled():
+            return False, None
+
+        now = time.monotonic()
+        with self.lock:
+            self.evict_expired(now)
+
+            # Fast path: trùng hash tuyệt đối
+            entry = self.entries.get((scope, key))
+            if entry is not None:
+                self.entries.move_to_end((scope, key))
+                self.hits += 1
+                return True, entry[1]
+
+            if self.max_distance > 0:
+                near = []
+                for candidate_scope, candidate in self.entries:
+                    if candidate_scope != scope:
+                        continue
+                    distance = hamming(key, candidate)
+                    if distance <= self.max_distance:
+                        near.append((distance, candidate))
+                for _, candidate in sorted(near):
+                    value = self.entries[(scope, candidate)][1]
+                    if confirm is not None and not confirm(value):
+                        self.rejected += 1
+                        continue
+                    self.entries.move_to_end((scope, candidate))
+                    self.hits += 1
+                    self.near_hits += 1
+                    return True, value
+
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value, scope=None):
+        if not self.enabled():
+            return
+
+        with self.lock:
+            self.entries[(scope, key)] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end((scope, key))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def evict_expired(self, now):
+        # OrderedDict theo thứ tự LRU nên không đảm bảo theo expiry - quét toàn bộ (cache nhỏ)
+        expired = [k for k, (expires, _) in self.entries.items() if expires <= now]
+        for k in expired:
+            del self.entries[k]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'near_hits': self.near_hits,
+                'rejected': self.rejected,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,265 @@
+import cv2
+import numpy as np
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class MotionDetector:
+    """Phát hiện chuyển động bằng frame differencing trên ảnh gray đã downscale"""
+
+    def __init__(self, width=320, pixel_threshold=25, min_changed_ratio=0.01):
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.min_changed_ratio = min_changed_ratio
+        self.previous = None
+
+    def has_motion(self, frame):
+        h, w = frame.shape[:2]
+        scale = self.width / float(w)
+        small = cv2.resize(frame, (self.width, max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+        previous, self.previous = self.previous, gray
+        if previous is None:
+            return True
+
+        diff = cv2.absdiff(previous, gray)
+        changed = np.count_nonzero(diff > self.pixel_threshold)
+        return changed >= self.min_changed_ratio * diff.size
+
+
+class StreamProcessor:
+    """Đọc RTSP/MJPEG/video file ở background, chỉ detect các frame có chuyển động"""
+
+    def __init__(self, stream_id, source, detect_fn, lane_id=None, max_fps=2.0,
+                 dedup_seconds=10.0, motion_options=None, loop_file=False, tracker=None):
+        self.stream_id = stream_id
+        self.source = source
+        self.detect_fn = detect_fn
+        self.tracker = tracker
+        self.lane_id = lane_id
+        self.min_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.dedup_seconds = dedup_seconds
+        self.motion = MotionDetector(**(motion_options or {}))
+        self.loop_file = loop_file
+
+        self.latest_frame = None
+        self.frame_lock = threading.Condition()
+        self.stop_event = threading.Event()
+        self.subscribers = []
+        self.subscribers_lock = threading.Lock()
+        self.last_plates = {}
+        self.stats = {'frames_read': 0, 'frames_processed': 0, 'frames_skipped': 0,
+                      'events': 0, 'duplicates': 0}
+        self.reader_thread = None
+        self.worker_thread = None
+
+    def start(self):
+        self.reader_thread = threading.Thread(target=self.read_frames, daemon=True)
+        self.worker_thread = threading.Thread(target=self.process_frames, daemon=True)
+        self.reader_thread.start()
+        self.worker_thread.start()
+        logger.info(f"Stream {self.stream_id} started: {self.source}")
+
+    def stop(self):
+        self.stop_event.set()
+        with self.frame_lock:
+            self.frame_lock.notify_all()
+        self.broadcast(None)
+
+    def is_running(self):
+        return not self.stop_event.is_set()
+
+    def read_frames(self):
+        """Reader thread: chỉ giữ frame mới nhất, frame cũ bị bỏ (CPU không phụ thuộc FPS camera)"""
+        capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            logger.error(f"Stream {self.stream_id}: cannot open {self.source}")
+            self.stop()
+            return
+
+        try:
+            while not self.stop_event.is_set():
+                ok, frame = capture.read()
+                if not ok:
+                    if self.loop_file:
+                        capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        continue
+                    logger.warning(f"Stream {self.stream_id}: end of stream")
+                    break
+
+                with self.frame_lock:
+                    if self.latest_frame is not None:
+                        self.stats['frames_skipped'] += 1
+                    self.latest_frame = frame
+                    self.stats['frames_read'] += 1
+                    self.frame_lock.notify()
+        finally:
+            capture.release()
+            self.stop()
+
+    def next_frame(self):
+        with self.frame_lock:
+            while self.latest_frame is None and not self.stop_event.is_set():
+                self.frame_lock.wait(timeout=1.0)
+            frame, self.latest_frame = self.latest_frame, None
+            return frame
+
+    def process_frames(self):
+        """Worker thread: rate limit + motion gating + detect + duplicate suppression"""
+        last_run = 0.0
+        while not self.stop_event.is_set():
+            frame = self.next_frame()
+            if frame is None:
+                continue
+
+            wait = self.min_interval - (time.monotonic() - last_run)
+            if wait > 0:
+                self.stats['frames_skipped'] += 1
+                continue
+
+            if not self.motion.has_motion(frame):
+                self.stats['frames_skipped'] += 1
+                continue
+
+            last_run = time.monotonic()
+            self.stats['frames_processed'] += 1
+            try:
+                if self.tracker is not None:
+                    # Multi-frame voting: chỉ emit khi track đạt đồng thuận
+                    for result in self.tracker.process_frame(frame):
+                        self.emit_plate(result['license_plate'], result)
+                    continue
+
+                plate = self.detect_fn(frame)
+            except Exception as e:
+                logger.error(f"Stream {self.stream_id} detection failed: {e}")
+                continue
+
+            if plate:
+                self.emit_plate(plate)
+
+    def emit_plate(self, plate, details=None):
+        now = time.time()
+        last_seen = self.last_plates.get(plate)
+        self.last_plates[plate] = now
+        if last_seen is not None and now - last_seen < self.dedup_seconds:
+            self.stats['duplicates'] += 1
+            return
+
+        # Dọn các plate đã hết hạn dedup
+        self.last_plates = {p: t for p, t in self.last_plates.items() if now - t < self.dedup_seconds}
+
+        event = {
+            'stream_id': self.stream_id,
+            'lane_id': self.lane_id,
+            'license_plate': plate,
+            'timestamp': now
+        }
+        if details:
+            event.update({k: v for k, v in details.items() if k != 'license_plate'})
+
+        self.stats['events'] += 1
+        self.broadcast(event)
+
+    def subscribe(self, max_events=100):
+        subscriber = queue.Queue(maxsize=max_events)
+        with self.subscribers_lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.subscribers_lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def broadcast(self, event):
+        with self.subscribers_lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # Client chậm: bỏ event cũ nhất
+                try:
+                    subscriber.get_nowait()
+                    subscriber.put_nowait(event)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def sse_events(self, keepalive=15.0):
+        """Generator Server-Sent Events cho Flask streaming response"""
+        subscriber = self.subscribe()
+        try:
+            while True:
+                try:
+                    event = subscriber.get(timeout=keepalive)
+                except queue.Empty:
+                    if not self.is_running():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    break
+                yield f"event: plate\ndata: {json.dumps(event)}\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+    def info(self):
+        return {
+            'stream_id': self.stream_id,
+            'source': self.source,
+            'lane_id': self.lane_id,
+            'running': self.is_running(),
+            'tracking': self.tracker is not None,
+            'stats': dict(self.stats),
+            'tracker_stats': dict(self.tracker.stats) if self.tracker is not None else None
+        }
+
+
+class StreamManager:
+    """Quản lý các stream đang chạy theo stream_id"""
+
+    def __init__(self, detect_fn, tracker_factory=None):
+        self.detect_fn = detect_fn
+        self.tracker_factory = tracker_factory
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+    def start_stream(self, source, stream_id=None, tracking=True, **options):
+        with self.lock:
+            stream_id = str(stream_id or f"stream-{next(self.ids)}")
+            existing = self.streams.get(stream_id)
+            if existing is not None and existing.is_running():
+                raise ValueError(f"Stream {stream_id} is already running")
+
+            if tracking and self.tracker_factory is not None:
+                options['tracker'] = self.tracker_factory()
+
+            stream = StreamProcessor(stream_id, source, self.detect_fn, **options)
+            self.streams[stream_id] = stream
+
+        stream.start()
+        return stream
+
+    def get(self, stream_id):
+        with self.lock:
+            return self.streams.get(stream_id)
+
+    def stop_stream(self, stream_id):
+        with self.lock:
+            stream = self.streams.pop(stream_id, None)
+        if stream is not None:
+            stream.stop()
+        return stream is not None
+
+    def list_streams(self):
+        with self.lock:
+            return [stream.info() for stream in self.streams.values()]
@@ -10,6 +10,7 @@ import org.springframework.web.client.RestTemplate;
 import org.springframework.web.multipart.MultipartFile;
 import com.parkingsystem.model.Vehicle;
 import com.parkingsystem.repository.VehicleRepository;
+import com.parkingsystem.service.PlateRegistryClient;
 
 import java.time.LocalDateTime;
 import java.time.temporal.ChronoUnit;
@@ -23,13 +24,17 @@ public class CameraController {
     @Autowired
     private VehicleRepository vehicleRepository;
     
+    @Autowired
+    private PlateRegistryClient plateRegistryClient;
+    
     @Value("${ai.service.url:http://localhost:5000}")
     private String aiServiceUrl;
     
     private final RestTemplate restTemplate = new RestTemplate();
 
     @PostMapping("/detect")
-    public ResponseEntity<?> detectLicensePlate(@RequestParam("file") MultipartFile file) {
+    public ResponseEntity<?> detectLicensePlate(@RequestParam("file") MultipartFile file,
+                                                @RequestParam(value = "cameraId", required = false) String cameraId) {
         try {
             // Validate file
             if (file.isEmpty()) {
@@ -45,6 +50,10 @@ public class CameraController {
             
             MultiValueMap<String, Object> body = new LinkedMultiValueMap<>();
             body.add("file", file.getResource());
+            if (cameraId != null && !cameraId.isEmpty()) {
+                // Lets the AI service apply the camera's ROI / resolution profile
+                body.add("camera_id", cameraId);
+            }
             
             HttpEntity<MultiValueMap<String, Object>> requestEntity = new HttpEntity<>(body, headers);
             
@@ -66,6 +75,7 @@ public class CameraController {
                 vehicle.setAiMethod((String) aiResult.get("method"));
                 
                 Vehicle savedVehicle = vehicleRepository.save(vehicle);
+                plateRegistryClient.vehicleEntered(licensePlate);
                 
                 return ResponseEntity.ok(Map.of(
                     "success", true,
@@ -108,6 +118,7 @@ public class CameraController {
             vehicle.setSlot(slot);
             
             Vehicle savedVehicle = vehicleRepository.save(vehicle);
+            plateRegistryClient.vehicleEntered(licensePlate);
             
             return ResponseEntity.ok(Map.of(
                 "success", true,
@@ -155,6 +166,7 @@ public class CameraController {
             vehicle.setParkingFee(parkingFee);
             
             Vehicle savedVehicle = vehicleRepository.save(vehicle);
+            plateRegistryClient.vehicleExited(vehicle.getLicensePlate());
             
             return ResponseEntity.ok(Map.of(
                 "success", true,
@@ -2,6 +2,7 @@ package com.parkingsystem.controller;
 
 import com.parkingsystem.model.Vehicle;
 import com.parkingsystem.repository.VehicleRepository;
+import com.parkingsystem.service.PlateRegistryClient;
 import org.springframework.beans.factory.annotation.Autowired;
 import org.springframework.beans.factory.annotation.Value;
 import org.springframework.http.*;
@@ -25,6 +26,9 @@ public class VehicleController {
     @Autowired
     private VehicleRepository vehicleRepository;
 
+    @Autowired
+    private PlateRegistryClient plateRegistryClient;
+
     @Value("${ai.service.url:http://localhost:5000}")
     private String aiServiceUrl;
 
@@ -129,6 +133,7 @@ public class VehicleController {
             vehicle.setEntryTime(LocalDateTime.now());
             
             Vehicle savedVehicle = vehicleRepository.save(vehicle);
+            plateRegistryClient.vehicleEntered(licensePlate);
             
             response.put("success", true);
             response.put("vehicle", savedVehicle);
@@ -164,6 +169,7 @@ public class VehicleController {
             
             vehicle.setExitTime(LocalDateTime.now());
             Vehicle updatedVehicle = vehicleRepository.save(vehicle);
+            plateRegistryClient.vehicleExited(vehicle.getLicensePlate());
             
             response.put("success", true);
             response.put("vehicle", updatedVehicle);
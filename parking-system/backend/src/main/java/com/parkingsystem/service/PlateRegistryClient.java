@@ -0,0 +1,120 @@
+package com.parkingsystem.service;
+
+import com.parkingsystem.model.Vehicle;
+import com.parkingsystem.repository.VehicleRepository;
+import jakarta.annotation.PreDestroy;
+import org.springframework.beans.factory.annotation.Autowired;
+import org.springframework.beans.factory.annotation.Value;
+import org.springframework.boot.CommandLineRunner;
+import org.springframework.http.HttpEntity;
+import org.springframework.http.HttpMethod;
+import org.springframework.http.client.SimpleClientHttpRequestFactory;
+import org.springframework.stereotype.Component;
+import org.springframework.web.client.RestTemplate;
+
+import java.util.List;
+import java.util.Map;
+import java.util.concurrent.Executors;
+import java.util.concurrent.ScheduledExecutorService;
+import java.util.concurrent.TimeUnit;
+import java.util.stream.Collectors;
+
+/**
+ * Đẩy danh sách biển số đang gửi sang AI service (/registry) để sửa kết quả OCR ở cổng ra.
+ * Best-effort: request chạy trên một thread riêng (giữ thứ tự add/remove) nên luồng vào/ra
+ * không chờ AI service. Registry nằm trong RAM của AI service (mất khi restart), vì vậy
+ * toàn bộ danh sách được đồng bộ lại định kỳ và ngay lần kiểm tra kế tiếp sau khi một request lỗi.
+ */
+@Component
+public class PlateRegistryClient implements CommandLineRunner {
+
+    @Autowired
+    private VehicleRepository vehicleRepository;
+
+    @Value("${ai.service.url:http://localhost:5000}")
+    private String aiServiceUrl;
+
+    // Chu kỳ đồng bộ toàn bộ
+    @Value("${ai.registry.sync-interval-ms:300000}")
+    private long syncIntervalMs;
+
+    // Chu kỳ kiểm tra (đồng bộ lại sau lỗi)
+    @Value("${ai.registry.retry-interval-ms:10000}")
+    private long retryIntervalMs;
+
+    private final RestTemplate restTemplate;
+
+    private final ScheduledExecutorService executor = Executors.newSingleThreadScheduledExecutor(runnable -> {
+        Thread thread = new Thread(runnable, "plate-registry-sync");
+        thread.setDaemon(true);
+        return thread;
+    });
+
+    // Chỉ truy cập từ thread của executor
+    private boolean syncNeeded = true;
+    private long lastSyncMillis;
+
+    public PlateRegistryClient() {
+        SimpleClientHttpRequestFactory factory = new SimpleClientHttpRequestFactory();
+        factory.setConnectTimeout(1000);
+        factory.setReadTimeout(2000);
+        this.restTemplate = new RestTemplate(factory);
+    }
+
+    // Đồng bộ toàn bộ khi backend khởi động, sau đó kiểm tra định kỳ
+    @Override
+    public void run(String... args) {
+        executor.scheduleWithFixedDelay(this::syncIfDue, 0, retryIntervalMs, TimeUnit.MILLISECONDS);
+    }
+
+    @PreDestroy
+    public void shutdown() {
+        executor.shutdownNow();
+    }
+
+    public void vehicleEntered(String licensePlate) {
+        if (licensePlate != null && !licensePlate.isEmpty()) {
+            executor.execute(() -> send(HttpMethod.POST, Map.of("add", List.of(licensePlate))));
+        }
+    }
+
+    public void vehicleExited(String licensePlate) {
+        if (licensePlate != null && !licensePlate.isEmpty()) {
+            executor.execute(() -> send(HttpMethod.POST, Map.of("remove", List.of(licensePlate))));
+        }
+    }
+
+    private void syncIfDue() {
+        if (syncNeeded || System.currentTimeMillis() - lastSyncMillis >= syncIntervalMs) {
+            pushAll();
+        }
+    }
+
+    private void pushAll() {
+        try {
+            List<String> plates = vehicleRepository.findByExitTimeIsNull().stream()
+                .map(Vehicle::getLicensePlate)
+                .collect(Collectors.toList());
+            if (send(HttpMethod.PUT, Map.of("plates", plates))) {
+                syncNeeded = false;
+                lastSyncMillis = System.currentTimeMillis();
+            }
+        } catch (Exception e) {
+            // Lỗi đọc DB: thử lại ở lần kiểm tra sau, không để exception dừng lịch định kỳ
+            System.err.println("⚠️ Plate registry sync failed: " + e.getMessage());
+            syncNeeded = true;
+        }
+    }
+
+    private boolean send(HttpMethod method, Map<String, Object> body) {
+        try {
+            restTemplate.exchange(aiServiceUrl + "/registry", method, new HttpEntity<>(body), Map.class);
+            return true;
+        } catch (Exception e) {
+            System.err.println("⚠️ Plate registry sync failed: " + e.getMessage());
+            // Registry bên AI service có thể đã lệch (hoặc service vừa restart): đồng bộ lại toàn bộ
+            syncNeeded = true;
+            return false;
+        }
+    }
+}